@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compiled Topology: 経路計算用の配列ベースのトポロジ
+NetworkX の dict-of-dict の代わりに、隣接関係を CSR 配列、重み・帯域をエッジ順のベクトルで保持し、
+配列上で直接動くヒープDijkstraを提供する
+
+エッジ（リンク）と弧（探索方向）の関係:
+    無向: 1エッジ = 2弧（u→v, v→u が同じ重みを共有）
+    有向: 1エッジ = 1弧
+"""
+
+import heapq
+import logging
+from typing import List, Dict, Tuple, Optional, Hashable, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INF = float('inf')  # 未到達距離
+
+
+class CompiledTopology:
+    """CSR形式のトポロジ
+
+    indptr / indices / arc_edge: ノード i から出る弧は indptr[i]:indptr[i+1] の範囲で、
+    行き先ノードが indices、対応するエッジ番号が arc_edge（arc_tail は弧の出発ノード）
+    """
+
+    def __init__(self, nodes: Sequence[Hashable], edges: Sequence[Tuple[Hashable, Hashable]],
+                 weights: Optional[Sequence[float]] = None, capacities: Optional[Sequence[float]] = None,
+                 directed: bool = False):
+        self.nodes = list(nodes)
+        self.node_index: Dict[Hashable, int] = {node: i for i, node in enumerate(self.nodes)}
+        self.edges = [tuple(edge) for edge in edges]
+        self.directed = directed
+        num_nodes, num_edges = len(self.nodes), len(self.edges)
+
+        self.weight = np.ones(num_edges) if weights is None else np.array(weights, dtype=np.float64)
+        self.capacity = np.full(num_edges, np.inf) if capacities is None else np.array(capacities, dtype=np.float64)
+        self.endpoints = np.array([(self.node_index[u], self.node_index[v]) for u, v in self.edges],
+                                  dtype=np.int64).reshape(num_edges, 2)
+
+        # (u, v) → エッジ番号（無向は逆向きも同じエッジ）
+        self.edge_index: Dict[Tuple[Hashable, Hashable], int] = {}
+        for e, (u, v) in enumerate(self.edges):
+            self.edge_index[(u, v)] = e
+            if not directed:
+                self.edge_index[(v, u)] = e
+
+        # CSR 隣接配列の構築
+        tails, heads, arc_edges = [], [], []
+        for e, (u, v) in enumerate(self.endpoints):
+            tails.append(u)
+            heads.append(v)
+            arc_edges.append(e)
+            if not directed:
+                tails.append(v)
+                heads.append(u)
+                arc_edges.append(e)
+        tails = np.array(tails, dtype=np.int64)
+        order = np.argsort(tails, kind='stable')
+        self.arc_tail = tails[order]
+        self.indices = np.array(heads, dtype=np.int64)[order]
+        self.arc_edge = np.array(arc_edges, dtype=np.int64)[order]
+        self.indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tails, minlength=num_nodes), out=self.indptr[1:])
+
+        # 探索ループ用の隣接リスト（トポロジは固定なので構築時に1回だけ作る）
+        indptr, indices, arc_edge = self.indptr.tolist(), self.indices.tolist(), self.arc_edge.tolist()
+        self._adjacency = [tuple(zip(range(indptr[i], indptr[i + 1]),
+                                     indices[indptr[i]:indptr[i + 1]], arc_edge[indptr[i]:indptr[i + 1]]))
+                           for i in range(num_nodes)]
+        self._arc_tail = self.arc_tail.tolist()
+        self._arc_edge = arc_edge
+
+        # 逆向きの隣接リスト（ノード v に入る弧: (弧番号, 出発ノード, エッジ番号)）と、エッジごとの弧
+        heads = self.indices.tolist()
+        self._in_adjacency = [[] for _ in range(num_nodes)]
+        self._edge_arcs = [[] for _ in range(num_edges)]
+        for arc, (u, v, e) in enumerate(zip(self._arc_tail, heads, arc_edge)):
+            self._in_adjacency[v].append((arc, u, e))
+            self._edge_arcs[e].append((arc, u, v))
+
+        # 探索用の作業配列（呼び出しごとに再確保しない）
+        self._dist = [INF] * num_nodes
+        self._pred = [-1] * num_nodes
+        self._done = [False] * num_nodes
+
+    @classmethod
+    def from_networkx(cls, graph, weight: str = 'weight', capacity: str = 'max_bandwidth') -> "CompiledTopology":
+        """NetworkX グラフから作成（エッジ順は graph.edges() の順）"""
+        edges = list(graph.edges(data=True))
+        return cls(
+            nodes=list(graph.nodes()),
+            edges=[(u, v) for u, v, _ in edges],
+            weights=[data.get(weight, 1.0) for _, _, data in edges],
+            capacities=[data.get(capacity, np.inf) for _, _, data in edges],
+            directed=graph.is_directed()
+        )
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.edges)
+
+    def set_weights(self, weights: Sequence[float]):
+        """重みベクトルを上書き（配列は再確保しない）"""
+        self.weight[:] = weights
+
+    def weights_from(self, graph, weight: str = 'weight') -> np.ndarray:
+        """NetworkX グラフの現在の重みを重みベクトルへ反映"""
+        self.weight[:] = [graph[u][v][weight] for u, v in self.edges]
+        return self.weight
+
+    def dijkstra(self, src: Hashable, dst: Optional[Hashable] = None,
+                 weight: Optional[np.ndarray] = None) -> Tuple[List[float], List[int]]:
+        """ヒープDijkstra（dst 指定時は確定した時点で終了）
+
+        Args:
+            weight: エッジ重みベクトル（省略時は self.weight）
+
+        Returns:
+            (dist, pred_arc) - ノード番号順の距離と、直前の弧番号（-1: 未到達・始点）
+        """
+        w = (self.weight if weight is None else weight).tolist()
+        dist, pred, done = self._dist, self._pred, self._done
+        for i in range(len(dist)):
+            dist[i] = INF
+            pred[i] = -1
+            done[i] = False
+
+        source = self.node_index[src]
+        target = self.node_index[dst] if dst is not None else -1
+        adjacency = self._adjacency
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if done[u]:
+                continue
+            done[u] = True
+            if u == target:
+                break
+            for arc, v, e in adjacency[u]:
+                nd = d + w[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = arc
+                    heapq.heappush(heap, (nd, v))
+        return dist, pred
+
+    def shortest_path(self, src: Hashable, dst: Hashable,
+                      weight: Optional[np.ndarray] = None) -> Optional[Tuple[List[Hashable], float, List[int]]]:
+        """最短経路
+
+        Returns:
+            (ノードリスト, コスト, 使用エッジ番号リスト)。到達不能なら None
+        """
+        dist, pred = self.dijkstra(src, dst, weight)
+        target = self.node_index[dst]
+        if dist[target] == INF:
+            return None
+        path, edges = self.trace(pred, target)
+        return path, dist[target], edges
+
+    def bottleneck(self, src: Hashable, capacity: np.ndarray) -> List[float]:
+        """src から各ノードへの最大ボトルネック幅（経路上の最小 capacity の最大値、未到達は -INF）"""
+        c = capacity.tolist()
+        width = [-INF] * self.num_nodes
+        done = self._done
+        for i in range(len(done)):
+            done[i] = False
+        source = self.node_index[src]
+        width[source] = INF
+        heap = [(-INF, source)]
+        adjacency = self._adjacency
+        while heap:
+            neg, u = heapq.heappop(heap)
+            if done[u]:
+                continue
+            done[u] = True
+            for _, v, e in adjacency[u]:
+                nw = min(-neg, c[e])
+                if nw > width[v]:
+                    width[v] = nw
+                    heapq.heappush(heap, (-nw, v))
+        return width
+
+    def widest_path(self, src: Hashable, dst: Hashable, capacity: np.ndarray,
+                    weight: Optional[np.ndarray] = None) -> Optional[Tuple[List[Hashable], float, List[int]]]:
+        """最大ボトルネック幅の経路（幅が最大の経路のうち weight の和が最小、weight 省略時はホップ数最小）
+
+        (幅, コスト) の辞書式順序は Dijkstra で直接は解けないため、最大幅 W を求めてから
+        幅 W 未満のエッジを除いた上で最短経路を求める。
+
+        Returns:
+            (ノードリスト, ボトルネック幅, 使用エッジ番号リスト)。到達不能なら None
+        """
+        width = self.bottleneck(src, capacity)[self.node_index[dst]]
+        if width == -INF:
+            return None
+        w = np.ones(self.num_edges) if weight is None else weight
+        result = self.shortest_path(src, dst, np.where(capacity >= width, w, INF))
+        if result is None:
+            return None
+        return result[0], width, result[2]
+
+    def widest_shortest_path(self, src: Hashable, dst: Hashable, weight: np.ndarray,
+                             capacity: np.ndarray) -> Optional[Tuple[List[Hashable], float, List[int]]]:
+        """最短経路のうちボトルネック幅が最大の経路（(コスト, -幅) の辞書式順序の Dijkstra）
+
+        Returns:
+            (ノードリスト, コスト, 使用エッジ番号リスト)。到達不能なら None
+        """
+        w, c = weight.tolist(), capacity.tolist()
+        num_nodes = self.num_nodes
+        label = [(INF, INF)] * num_nodes   # (コスト, -幅)
+        pred, done = self._pred, self._done
+        for i in range(num_nodes):
+            pred[i] = -1
+            done[i] = False
+        source, target = self.node_index[src], self.node_index[dst]
+        label[source] = (0.0, -INF)
+        heap = [(0.0, -INF, source)]
+        adjacency = self._adjacency
+        while heap:
+            d, neg, u = heapq.heappop(heap)
+            if done[u]:
+                continue
+            done[u] = True
+            if u == target:
+                break
+            for arc, v, e in adjacency[u]:
+                candidate = (d + w[e], -min(-neg, c[e]))
+                if candidate < label[v]:
+                    label[v] = candidate
+                    pred[v] = arc
+                    heapq.heappush(heap, (candidate[0], candidate[1], v))
+        if label[target][0] == INF:
+            return None
+        path, edges = self.trace(pred, target)
+        return path, label[target][0], edges
+
+    def hop_limited_path(self, src: Hashable, dst: Hashable, max_hops: int,
+                         weight: Optional[np.ndarray] = None) -> Optional[Tuple[List[Hashable], float, List[int]]]:
+        """ホップ数 max_hops 以下で weight の和が最小の経路（ホップ数で層別した Bellman-Ford、O(max_hops × 弧数)）
+
+        Returns:
+            (ノードリスト, コスト, 使用エッジ番号リスト)。条件を満たす経路が無ければ None
+        """
+        w = (self.weight if weight is None else weight).tolist()
+        source, target = self.node_index[src], self.node_index[dst]
+        dist = [INF] * self.num_nodes
+        dist[source] = 0.0
+        # rounds[h][v]: h+1 ホップ目で v の距離を更新した弧（-1: 更新なし、h ホップ以下の値を引き継ぐ）
+        rounds = []
+        adjacency = self._adjacency
+        for _ in range(max_hops):
+            updated = list(dist)
+            pred = [-1] * self.num_nodes
+            for u, du in enumerate(dist):
+                if du == INF:
+                    continue
+                for arc, v, e in adjacency[u]:
+                    nd = du + w[e]
+                    if nd < updated[v]:
+                        updated[v] = nd
+                        pred[v] = arc
+            rounds.append(pred)
+            dist = updated
+        if dist[target] == INF:
+            return None
+
+        nodes, edges = [target], []
+        node = target
+        for pred in reversed(rounds):
+            arc = pred[node]
+            if arc == -1:
+                continue
+            edges.append(self._arc_edge[arc])
+            node = self._arc_tail[arc]
+            nodes.append(node)
+        nodes.reverse()
+        edges.reverse()
+        return [self.nodes[i] for i in nodes], dist[target], edges
+
+    def trace(self, pred: List[int], target: int) -> Tuple[List[Hashable], List[int]]:
+        """直前の弧をたどって (ノードリスト, 使用エッジ番号リスト) を復元"""
+        path, edges = [target], []
+        node = target
+        while pred[node] != -1:
+            arc = pred[node]
+            edges.append(self._arc_edge[arc])
+            node = self._arc_tail[arc]
+            path.append(node)
+        path.reverse()
+        edges.reverse()
+        return [self.nodes[i] for i in path], edges
+
+    def path_edges(self, path: Sequence[Hashable]) -> List[int]:
+        """ノードリストを使用エッジ番号のリストに変換"""
+        return [self.edge_index[(u, v)] for u, v in zip(path, path[1:])]
+
+    def utilization(self, load: np.ndarray) -> np.ndarray:
+        """エッジごとの負荷（Bytes/s）を帯域で割った利用率"""
+        return load / self.capacity
+
+    def to_networkx(self, weight: str = 'weight', capacity: str = 'max_bandwidth'):
+        """NetworkX グラフへ変換（可視化・分析用）"""
+        import networkx as nx
+        graph = nx.DiGraph() if self.directed else nx.Graph()
+        graph.add_nodes_from(self.nodes)
+        for e, (u, v) in enumerate(self.edges):
+            graph.add_edge(u, v, **{weight: float(self.weight[e]), capacity: float(self.capacity[e])})
+        return graph
+
+
+class ShortestPathTree:
+    """1つの始点からの最短経路木（重みの変化分だけを再計算する）
+
+    update() は木を作ったときの重みと比較し、epsilon を超えて変化したエッジだけを反映する。
+        - 木に含まれる弧の重みが増えた場合: その弧より下の部分木だけを未確定に戻して再計算
+        - 弧の重みが減った場合: 距離が短くなる到着ノードから先だけを再計算
+    変化が全て epsilon 以下なら何もしない（小さな変化は木の重みとの差として蓄積される）。
+    """
+
+    def __init__(self, topology: CompiledTopology, source: Hashable, weights: np.ndarray):
+        self.topology = topology
+        self.source = source
+        self.weights = np.array(weights, dtype=np.float64)
+        dist, pred = topology.dijkstra(source, None, self.weights)
+        self.dist = list(dist)
+        self.pred = list(pred)
+        self.last_affected = topology.num_nodes
+
+    def changed_edges(self, weights: np.ndarray, epsilon: float = 0.0) -> np.ndarray:
+        """木の重みから epsilon を超えて変化したエッジ番号"""
+        return np.flatnonzero(np.abs(weights - self.weights) > epsilon)
+
+    def update(self, weights: np.ndarray, epsilon: float = 0.0) -> int:
+        """重みの変化を反映
+
+        Returns:
+            反映したエッジ数（0: 変化なしで木をそのまま使用）
+        """
+        changed = self.changed_edges(weights, epsilon)
+        self.last_affected = 0
+        if changed.size == 0:
+            return 0
+
+        topology = self.topology
+        old = self.weights
+        self.weights = old.copy()
+        self.weights[changed] = weights[changed]
+        w = self.weights.tolist()
+        dist, pred = self.dist, self.pred
+
+        # 重みが増えた木の弧の下にある部分木を未確定に戻す
+        roots, decreased = [], []
+        for e in changed.tolist():
+            for arc, u, v in topology._edge_arcs[e]:
+                if w[e] > old[e]:
+                    if pred[v] == arc:
+                        roots.append(v)
+                else:
+                    decreased.append((arc, u, v, e))
+        affected = set()
+        if roots:
+            children = [[] for _ in range(topology.num_nodes)]
+            for v, arc in enumerate(pred):
+                if arc != -1:
+                    children[topology._arc_tail[arc]].append(v)
+            stack = roots
+            while stack:
+                node = stack.pop()
+                if node not in affected:
+                    affected.add(node)
+                    stack.extend(children[node])
+            for node in affected:
+                dist[node] = INF
+                pred[node] = -1
+
+        # 未確定ノードは確定済みの隣接ノードからの距離、重みが減った弧は到着ノードの距離を更新して探索を再開
+        heap = []
+        for v in affected:
+            for arc, u, e in topology._in_adjacency[v]:
+                if u not in affected and dist[u] + w[e] < dist[v]:
+                    dist[v] = dist[u] + w[e]
+                    pred[v] = arc
+            if dist[v] < INF:
+                heap.append((dist[v], v))
+        for arc, u, v, e in decreased:
+            if dist[u] + w[e] < dist[v]:
+                dist[v] = dist[u] + w[e]
+                pred[v] = arc
+                heap.append((dist[v], v))
+        heapq.heapify(heap)
+
+        adjacency = topology._adjacency
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for arc, v, e in adjacency[u]:
+                nd = d + w[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = arc
+                    heapq.heappush(heap, (nd, v))
+
+        self.last_affected = len(affected)
+        return int(changed.size)
+
+    def path_to(self, dst: Hashable) -> Optional[Tuple[List[Hashable], float, List[int]]]:
+        """始点から dst への経路 (ノードリスト, コスト, 使用エッジ番号リスト)。到達不能なら None"""
+        target = self.topology.node_index[dst]
+        if self.dist[target] == INF:
+            return None
+        path, edges = self.topology.trace(self.pred, target)
+        return path, self.dist[target], edges
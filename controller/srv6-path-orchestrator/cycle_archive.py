@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Cycle Archive: 制御サイクルごとのテレメトリ・経路決定の列指向アーカイブ
+1サイクル = 1行として、リンクごとのレート・利用率・重み、選択した3経路とコスト、
+処理段階ごとの所要時間を メモリマップした .npy セグメントへ追記する
+
+ディレクトリ構成:
+    <archive_dir>/meta.json              エッジ順・段階名などの定義（作成時に1回だけ書く）
+    <archive_dir>/segment_000000/*.npy   列ごとの固定長配列（segment_rows 行で次のセグメントへ）
+
+timestamp 列は NaN で初期化し、各行の最後に書き込む。
+読み出し時は timestamp が埋まっている行数をその行数とみなす（途中終了しても壊れない）。
+"""
+
+import os
+import json
+import logging
+from typing import List, Dict, Tuple, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# status 列の値
+STATUS_FAILED = 0
+STATUS_UPDATED = 1
+STATUS_SKIPPED = 2
+
+ARCHIVE_VERSION = 1
+META_FILE = "meta.json"
+SEGMENT_PREFIX = "segment_"
+
+
+def _columns(num_edges: int, num_paths: int, max_hops: int, num_stages: int) -> Dict[str, Tuple[str, Tuple[int, ...]]]:
+    """列定義 {列名: (dtype, 1行あたりの形状)}"""
+    return {
+        "timestamp": ("<f8", ()),
+        "status": ("i1", ()),
+        "rate": ("<f8", (num_edges,)),             # Bytes/s（エッジ方向のDS、データなしは NaN）
+        "utilization": ("<f8", (num_edges,)),      # 観測利用率（0-1、データなしは NaN）
+        "weight": ("<f8", (num_edges,)),           # 経路計算に使った重み
+        "path": ("<i2", (num_paths, max_hops)),    # 往路の選択経路（ノード番号、未使用は -1）
+        "cost": ("<f8", (num_paths,)),
+        "return_path": ("<i2", (num_paths, max_hops)),
+        "return_cost": ("<f8", (num_paths,)),
+        "stage_ms": ("<f8", (num_stages,)),        # 処理段階ごとの所要時間（ミリ秒）
+    }
+
+
+def _fill_value(dtype: str):
+    """未書き込み行の初期値"""
+    return np.nan if dtype.endswith("f8") else -1
+
+
+class CycleArchive:
+    """サイクル単位の追記専用アーカイブ（書き込み側）"""
+
+    def __init__(self, directory: str, edges: Sequence[Tuple[int, int]], stages: Sequence[str],
+                 num_paths: int = 3, max_hops: int = 16, segment_rows: int = 1440):
+        self.directory = directory
+        self.edges = [tuple(edge) for edge in edges]
+        self.stages = list(stages)
+        self.num_paths = num_paths
+        self.max_hops = max_hops
+        self.segment_rows = segment_rows
+        self.columns = _columns(len(self.edges), num_paths, max_hops, len(self.stages))
+
+        os.makedirs(directory, exist_ok=True)
+        meta = {
+            "version": ARCHIVE_VERSION,
+            "edges": [list(edge) for edge in self.edges],
+            "stages": self.stages,
+            "num_paths": num_paths,
+            "max_hops": max_hops,
+            "segment_rows": segment_rows,
+        }
+        meta_path = os.path.join(directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                existing = json.load(f)
+            if {k: existing.get(k) for k in meta} != meta:
+                raise ValueError(f"既存アーカイブとエッジ・列の定義が異なります: {directory}")
+            self.segment_rows = existing["segment_rows"]
+        else:
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, indent=2)
+
+        # 既存アーカイブの場合は最後のセグメントの続きから追記
+        segments = _segment_dirs(directory)
+        self.segment_index = len(segments) - 1 if segments else 0
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._open_segment(create=not segments)
+        self.row = _row_count(self._arrays["timestamp"])
+        self.total_rows = sum(_row_count(np.load(os.path.join(path, "timestamp.npy"), mmap_mode='r'))
+                              for path in segments[:-1]) + self.row
+
+    def _segment_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{index:06d}")
+
+    def _open_segment(self, create: bool):
+        """セグメントの列ファイルをメモリマップ（create=True で新規作成）"""
+        self.close_segment()
+        path = self._segment_path(self.segment_index)
+        os.makedirs(path, exist_ok=True)
+        for name, (dtype, shape) in self.columns.items():
+            column_path = os.path.join(path, f"{name}.npy")
+            if create or not os.path.exists(column_path):
+                array = np.lib.format.open_memmap(column_path, mode='w+', dtype=dtype,
+                                                  shape=(self.segment_rows,) + shape)
+                array[:] = _fill_value(dtype)
+            else:
+                array = np.load(column_path, mmap_mode='r+')
+            self._arrays[name] = array
+        logger.debug(f"アーカイブセグメント: {path}")
+
+    def append(self, timestamp: float, status: int,
+               rates: Optional[np.ndarray] = None,
+               utilization: Optional[np.ndarray] = None,
+               weights: Optional[np.ndarray] = None,
+               paths: Optional[List[Tuple[List[int], float]]] = None,
+               return_paths: Optional[List[Tuple[List[int], float]]] = None,
+               stage_ms: Optional[Dict[str, float]] = None):
+        """1サイクル分を追記
+
+        Args:
+            rates / utilization / weights: edges と同じ順のベクトル
+            paths / return_paths: [(ノードリスト, コスト), ...]（最大 num_paths 件）
+            stage_ms: {段階名: ミリ秒}（stages に無い段階は無視）
+        """
+        if self.row >= self.segment_rows:
+            self.segment_index += 1
+            self._open_segment(create=True)
+            self.row = 0
+
+        row = self.row
+        arrays = self._arrays
+        arrays["status"][row] = status
+        for name, vector in (("rate", rates), ("utilization", utilization), ("weight", weights)):
+            if vector is not None:
+                arrays[name][row] = vector
+        for path_name, cost_name, selected in (("path", "cost", paths),
+                                               ("return_path", "return_cost", return_paths)):
+            for i, (path, cost) in enumerate((selected or [])[:self.num_paths]):
+                hops = path[:self.max_hops]
+                arrays[path_name][row, i, :len(hops)] = hops
+                arrays[cost_name][row, i] = cost
+        if stage_ms:
+            arrays["stage_ms"][row] = [stage_ms.get(stage, np.nan) for stage in self.stages]
+        # timestamp を最後に書くことで、読み出し側は書き込み途中の行を無視できる
+        arrays["timestamp"][row] = timestamp
+
+        self.row += 1
+        self.total_rows += 1
+
+    def flush(self):
+        """メモリマップの内容をディスクへ書き出す"""
+        for array in self._arrays.values():
+            array.flush()
+
+    def close_segment(self):
+        """現在のセグメントを閉じる"""
+        if self._arrays:
+            self.flush()
+            self._arrays = {}
+
+    def close(self):
+        """アーカイブを閉じる"""
+        self.close_segment()
+
+
+def _segment_dirs(directory: str) -> List[str]:
+    """セグメントディレクトリ一覧（番号順）"""
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.startswith(SEGMENT_PREFIX)]
+
+
+def _row_count(timestamps: np.ndarray) -> int:
+    """書き込み済み行数（timestamp が NaN でない先頭からの行数）"""
+    unwritten = np.flatnonzero(np.isnan(timestamps))
+    return int(unwritten[0]) if unwritten.size else len(timestamps)
+
+
+def load_cycle_archive(directory: str, columns: Optional[Sequence[str]] = None) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """アーカイブを列ごとに読み出す
+
+    セグメントが1つだけの場合は読み取り専用のメモリマップをそのまま返す（コピーなし）。
+
+    Returns:
+        (meta, {列名: (rows, ...) 配列})
+    """
+    with open(os.path.join(directory, META_FILE), encoding='utf-8') as f:
+        meta = json.load(f)
+    meta["edges"] = [tuple(edge) for edge in meta["edges"]]
+
+    segments = _segment_dirs(directory)
+    if columns is None:
+        columns = list(_columns(len(meta["edges"]), meta["num_paths"], meta["max_hops"], len(meta["stages"])))
+
+    parts: Dict[str, List[np.ndarray]] = {name: [] for name in columns}
+    for path in segments:
+        rows = _row_count(np.load(os.path.join(path, "timestamp.npy"), mmap_mode='r'))
+        if rows == 0:
+            continue
+        for name in columns:
+            parts[name].append(np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')[:rows])
+
+    result = {}
+    for name, arrays in parts.items():
+        if len(arrays) == 1:
+            result[name] = arrays[0]
+        elif arrays:
+            result[name] = np.concatenate(arrays)
+        else:
+            dtype, shape = _columns(len(meta["edges"]), meta["num_paths"], meta["max_hops"],
+                                    len(meta["stages"]))[name]
+            result[name] = np.empty((0,) + shape, dtype=dtype)
+    return meta, result
+
+
+def decode_paths(path_rows: np.ndarray) -> List[List[List[int]]]:
+    """path 列（rows, num_paths, max_hops）をノードリストに戻す"""
+    return [[[int(n) for n in hops if n >= 0] for hops in row] for row in path_rows]
+
+
+def main():
+    """アーカイブの概要を表示"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="サイクルアーカイブの概要表示")
+    parser.add_argument("directory", help="アーカイブディレクトリ")
+    args = parser.parse_args()
+
+    meta, data = load_cycle_archive(args.directory)
+    rows = len(data["timestamp"])
+    print(f"行数: {rows}, エッジ数: {len(meta['edges'])}, 段階: {', '.join(meta['stages'])}")
+    if rows == 0:
+        return
+    status = data["status"]
+    print(f"更新: {int((status == STATUS_UPDATED).sum())}, スキップ: {int((status == STATUS_SKIPPED).sum())}, "
+          f"失敗: {int((status == STATUS_FAILED).sum())}")
+    print(f"期間: {data['timestamp'][0]:.0f} - {data['timestamp'][-1]:.0f}")
+    stage_means = np.nanmean(np.where(status[:, None] == STATUS_UPDATED, data["stage_ms"], np.nan), axis=0)
+    for stage, mean in zip(meta["stages"], stage_means):
+        print(f"  {stage}: 平均 {mean:.2f} ms")
+    utilization = np.nanmean(data["utilization"], axis=0)
+    busiest = np.argsort(np.nan_to_num(utilization, nan=-1))[::-1][:5]
+    print("平均利用率の高いリンク:")
+    for i in busiest:
+        u, v = meta["edges"][i]
+        print(f"  r{u}-r{v}: {utilization[i]:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+IP Batch Session: ルーター上に常駐させた `ip -6 -force -batch -` プロセスへの経路操作ストリーム
+SSH接続プールの接続上にチャネルを1本開いたまま ip を起動しておき、
+経路操作を標準入力へ流し込み、結果を標準エラー出力から逐次読み取る
+
+1回のバッチの区切りには、必ず失敗する番兵行（存在しないオブジェクト名）を末尾に付ける。
+ip は -force 指定時に失敗行ごとに "Command failed -:行番号" を出力し、行番号はプロセス起動からの通算のため、
+番兵行の番号が返ってきた時点でそれまでの行が全て処理済みとなる。
+
+リモートの ip が終了した場合（引数エラーで ip 自体が exit する場合を含む）は、
+そのバッチの未確認行を失敗として返し、次回のバッチで ip を起動し直す。
+"""
+
+import re
+import time
+import socket
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IP_BATCH_COMMAND = "ip -6 -force -batch -"
+SENTINEL_COMMAND = "batch-sentinel"
+FAILURE_PATTERN = re.compile(r'^Command failed (\S+):(\d+)$')
+
+
+class IPBatchSession:
+    """1ルーター分の常駐 ip -batch セッション
+
+    Args:
+        pool: SSHConnectionPool（接続の取り出しと再接続に使う）
+        host: ルーターのアドレス
+        timeout: 1バッチの結果を待つ時間（秒、超えた場合はプロセスを終了して失敗扱い）
+    """
+
+    def __init__(self, pool, host: str, timeout: float = 5.0, command: str = IP_BATCH_COMMAND):
+        self.pool = pool
+        self.host = host
+        self.timeout = timeout
+        self.command = command
+
+        self._channel = None
+        self._lines_sent = 0
+        self._stderr_buffer = b""
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'starts': 0,
+            'restarts': 0,
+            'batches': 0,
+            'lines': 0,
+            'timeouts': 0,
+        }
+
+    def alive(self) -> bool:
+        """リモートの ip プロセスが動作中か"""
+        channel = self._channel
+        return channel is not None and not channel.closed and not channel.exit_status_ready()
+
+    def _start(self):
+        """ip -batch をリモートで起動（既存のチャネルは閉じる）"""
+        if self.stats['starts']:
+            self.stats['restarts'] += 1
+            logger.warning(f"ip -batch プロセスを再起動します: {self.host}")
+        self._close_channel()
+        client = self.pool.acquire(self.host)
+        channel = client.get_transport().open_session(timeout=self.timeout)
+        channel.exec_command(self.command)
+        self._channel = channel
+        self._lines_sent = 0
+        self._stderr_buffer = b""
+        self.stats['starts'] += 1
+        logger.debug(f"ip -batch セッション開始: {self.host}")
+
+    def _close_channel(self):
+        if self._channel is not None:
+            try:
+                self._channel.close()
+            except Exception:
+                pass
+            self._channel = None
+
+    def _read_line(self, deadline: float) -> Optional[str]:
+        """標準エラー出力から1行読む（プロセス終了・タイムアウト時は None）"""
+        channel = self._channel
+        while b"\n" not in self._stderr_buffer:
+            # 標準出力は使わないが、ウィンドウが埋まって ip が止まらないよう読み捨てる
+            while channel.recv_ready():
+                channel.recv(65536)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.stats['timeouts'] += 1
+                return None
+            channel.settimeout(remaining)
+            try:
+                data = channel.recv_stderr(65536)
+            except socket.timeout:
+                continue
+            if not data:
+                return None
+            self._stderr_buffer += data
+        line, self._stderr_buffer = self._stderr_buffer.split(b"\n", 1)
+        return line.decode('utf-8', errors='replace').strip()
+
+    def _send(self, payload: bytes):
+        """ip が終了していれば起動し直して送信（送信自体の失敗は1回だけ再試行）"""
+        for attempt in range(2):
+            if not self.alive():
+                self._start()
+            try:
+                self._channel.sendall(payload)
+                return
+            except (socket.error, EOFError) as e:
+                if attempt:
+                    raise
+                logger.warning(f"ip -batch への送信失敗のため再起動します ({self.host}): {e}")
+                self._close_channel()
+
+    def execute(self, commands: List[str]) -> Tuple[bool, Dict[int, str], str]:
+        """コマンド列を1バッチとして流し込み、番兵行の結果が返るまで待つ
+
+        Args:
+            commands: "ip -6" を除いた形の1行ずつのコマンド（例: "route replace ..."）
+
+        Returns:
+            (完了したか, {失敗行の番号（バッチ内、1始まり）: エラーメッセージ}, 途中終了時のエラーメッセージ)
+            完了しなかった場合、最後の失敗行より後の行は実行されたか不明
+        """
+        if any("\n" in command for command in commands):
+            raise ValueError("コマンドに改行を含めることはできません")
+
+        with self._lock:
+            payload = "".join(f"{command}\n" for command in commands) + f"{SENTINEL_COMMAND}\n"
+            self._send(payload.encode('utf-8'))
+            base = self._lines_sent
+            sentinel_line = base + len(commands) + 1
+            self._lines_sent = sentinel_line
+            self.stats['batches'] += 1
+            self.stats['lines'] += len(commands)
+
+            errors = {}
+            pending = []
+            deadline = time.monotonic() + self.timeout
+            while True:
+                line = self._read_line(deadline)
+                if line is None:
+                    # ip が終了した（またはタイムアウト）- 次回のバッチで起動し直す
+                    self._close_channel()
+                    return False, errors, "; ".join(pending) or "ip -batch プロセスが応答しません"
+                match = FAILURE_PATTERN.match(line)
+                if not match:
+                    if line:
+                        pending.append(line)
+                    continue
+                number = int(match.group(2))
+                if number == sentinel_line:
+                    return True, errors, ""
+                if base < number < sentinel_line:
+                    errors[number - base] = "; ".join(pending) or "失敗"
+                pending = []
+
+    def close(self):
+        """標準入力を閉じて ip を終了させ、チャネルを閉じる"""
+        with self._lock:
+            if self._channel is not None:
+                try:
+                    self._channel.shutdown_write()
+                except Exception:
+                    pass
+            self._close_channel()
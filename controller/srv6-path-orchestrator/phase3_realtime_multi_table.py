@@ -6,21 +6,85 @@ phase3_multi_table_simple.py + main.py の統合拡張版
 """
 
 import networkx as nx
+import numpy as np
 import matplotlib
 matplotlib.use('Agg')  # ファイル保存用バックエンド（GUIなし環境対応）
 import matplotlib.pyplot as plt
+import socket
 import subprocess
+import struct
+import json
 import sys
 import math
+import re
 import time
+import itertools
 import paramiko
 import logging
 import warnings
+from collections import deque
 from contextlib import contextmanager
 from dataclasses import dataclass
 from typing import List, Dict, Tuple, Optional
 import threading
 import os
+import xml.etree.ElementTree as ET
+
+try:
+    import rrdtool  # python-rrdtool: librrdを直接呼び出す（fork不要）
+except ImportError:
+    rrdtool = None
+
+try:
+    from rrd_mmap_reader import MmapRRDReader, read_last_update  # rrdtool不要のmmapリーダー
+except ImportError:
+    MmapRRDReader = None
+    read_last_update = None
+
+try:
+    from snmp_traffic_collector import SNMPTrafficCollector, load_mrtg_targets  # MRTGを介さない直接収集
+except ImportError:
+    SNMPTrafficCollector = None
+
+try:
+    from cycle_archive import CycleArchive, STATUS_FAILED, STATUS_UPDATED, STATUS_SKIPPED  # サイクルごとの列指向アーカイブ
+except ImportError:
+    CycleArchive = None
+    STATUS_FAILED, STATUS_UPDATED, STATUS_SKIPPED = 0, 1, 2
+
+try:
+    from compiled_topology import CompiledTopology, ShortestPathTree  # CSR配列ベースのトポロジとDijkstra
+except ImportError:
+    CompiledTopology = None
+
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra as csgraph_dijkstra  # scipy 経路計算エンジン
+except ImportError:
+    csr_matrix = None
+    csgraph_dijkstra = None
+
+try:
+    from weight_optimizer import BackgroundWeightOptimizer, WeightProblem, load_weights, fortz_thorup_phi  # Fortz–Thorup 型リンク重み最適化
+except ImportError:
+    BackgroundWeightOptimizer = None
+    WeightProblem = load_weights = None
+    fortz_thorup_phi = None
+
+try:
+    from scipy.optimize import linprog  # 優先度クラスの多品種フロー割り当て
+except ImportError:
+    linprog = None
+
+try:
+    from ssh_connection_pool import shared_pool  # r1/r16 へのSSH接続を使い回す接続プール
+except ImportError:
+    shared_pool = None
+
+try:
+    from ip_batch_session import IPBatchSession  # ルーターごとに常駐させる ip -batch プロセス
+except ImportError:
+    IPBatchSession = None
 
 # ログ設定
 logging.basicConfig(
@@ -39,6 +103,9 @@ warnings.filterwarnings('ignore', message='.*Glyph.*missing from.*font.*')
 # 履歴保存先ディレクトリ名（visualization/以下のパス）
 HISTORY_SAVE_DIR = "srv6_evaluation3_tcp/trial1"
 
+# リプレイ結果の出力先（visualization/以下のパス、リプレイ元の名前のサブディレクトリに出力）
+REPLAY_SAVE_DIR = "replay"
+
 # 測定停止時間（分）- この時間が経過すると自動停止
 MEASUREMENT_DURATION_MINUTES = 52
 # ============================================================================
@@ -54,6 +121,26 @@ class SRv6Config:
     ssh_password: str = "@k@n@3>ki"
     device: str = "eth1"
     timeout: int = 15
+    ssh_pool: bool = True            # SSH接続をサイクル間で使い回す（False: 更新ごとに接続・切断）
+    ssh_keepalive: int = 15          # 接続プールのトランスポート keepalive 間隔（秒、0 で無効）
+    
+    # 経路の書き込み方式（sequential: テーブルごとに show → del → add を個別に実行,
+    #                     batch: ルーターごとに全テーブルの変更を1本の ip -batch スクリプトにまとめて1往復で実行,
+    #                     stream: ルーターごとに常駐させた ip -batch プロセスへ流し込む（接続プールが必要））
+    route_install: str = "sequential"
+    stream_timeout: float = 5.0      # stream: 1回の更新の結果を待つ時間（秒）
+    # 既存経路を消してから追加せず ip route replace で1操作で差し替える（テーブルが空になる瞬間を作らない）
+    route_replace: bool = False
+    # テーブル更新の前後でフォールスルーカウンタを読み、切り替え中に rt_table を外れてメインテーブルで
+    # 転送されたマーク付きパケット数を記録（カウンタは Phase 2 の nftables 設定で srv6_fallthrough チェーンに作成）
+    measure_switch_loss: bool = False
+    r1_nft_table: str = "ip6 mangle"          # r1 の nftables テーブル（Phase 2 と同じ）
+    r16_nft_table: str = "ip6 mangle_r16"     # r16 の nftables テーブル（Phase 2 と同じ）
+    # bidirectional: 書き込み済みの状態と比較し、SIDリストか出力インターフェースが変わったテーブルのみ書き込む
+    route_reconcile: bool = False
+    # route_reconcile: このサイクル数ごとに全テーブルを書き込み直す（0 で無効）
+    # 書き込み済みの状態はルーター側を読まないため、手動でのクリアなど再接続を伴わない変化はこの周期で戻す
+    reconcile_resync_cycles: int = 60
     
     # ルーティング設定
     route_prefix: str = "fd03:1::/64"  # r1→r16方向
@@ -62,7 +149,74 @@ class SRv6Config:
     # テーブル定義
     tables: List[Dict[str, str]] = None
     
+    # グラフモード（True: 有向グラフでリンクの方向ごとに重みを持つ）
+    directed: bool = False
+    
+    # 重み関数（instant: 最新値, ewma: 指数移動平均, mean: 窓平均, p95: 窓内95パーセンタイル）
+    weight_function: str = "instant"
+    telemetry_window: int = 10       # mean / p95 / ewma の対象サンプル数
+    ewma_alpha: float = 0.3
+    telemetry_capacity: int = 120    # リングバッファに保持するサンプル数
+    
+    # 利用率から重みへの変換（COST_FUNCTIONS のいずれか: linear / mm1 / fortz-thorup / exponential）
+    cost_function: str = "linear"
+    
+    # 経路選択後に使用エッジの重みへ掛ける倍率（テーブル順、None は PathCalculator.WEIGHT_MULTIPLIERS）
+    weight_multipliers: Optional[List[float]] = None
+    
+    # 利用率予測（none / holt / ar）- 次の更新間隔の予測値で経路計算する
+    forecast_method: str = "none"
+    forecast_window: int = 30
+    
+    # rrdcached 設定（例: "unix:/var/run/rrdcached.sock"、未指定時は環境変数 RRDCACHED_ADDRESS）
+    rrdcached_address: Optional[str] = None
+    
+    # トラフィック取得元（"rrd": MRTGのRRDファイル, "snmp": SNMP GETBULK で直接収集）
+    traffic_source: str = "rrd"
+    snmp_interval: float = 1.0
+    mrtg_config_path: str = "/opt/app/mrtg/mrtg_kurage.conf"
+    
+    # サイクルごとのレート・重み・経路・処理時間を追記する列指向アーカイブ（None で無効）
+    archive_dir: Optional[str] = None
+    
+    # 可視化画像と履歴の出力先（None で visualization/ と visualization/HISTORY_SAVE_DIR、リプレイでは実測と分ける）
+    visualization_dir: Optional[str] = None
+    
+    # 経路計算エンジン（networkx: NetworkXのDijkstra, scipy: scipy.sparse.csgraph,
+    #                   array: CSR配列上のDijkstra, dynamic: 最短経路木の差分更新,
+    #                   candidate: 起動時に列挙した候補経路を行列積で評価）
+    path_engine: str = "networkx"
+    candidate_limit: int = 2000      # 列挙する候補経路数の上限（超える大規模トポロジでは candidate は使用不可）
+    spt_epsilon: float = 0.0         # dynamic エンジン: この値以下の重み変化は最短経路木に反映しない
+    
+    # テーブルごとの経路の選び方（multiplier: 使用エッジの重みに倍率を掛けて順に選択,
+    #                             edge-disjoint / node-disjoint: リンク・ノードを共有しない経路の組,
+    #                             ksp: k最短経路から既選択経路との重複にペナルティを掛けて選択,
+    #                             lp: クラスごとの需要を最大リンク利用率が最小になるよう1経路ずつ割り当て）
+    path_mode: str = "multiplier"
+    ksp_candidates: int = 8          # ksp: 列挙する経路数
+    ksp_overlap_penalty: float = 2.0 # ksp: 既選択経路と共有するエッジの重みに加算する倍率
+    class_demands: Optional[List[float]] = None  # lp: クラスごとの需要推定（Mbps、テーブル順）。None で観測値から推定
+    
+    # テーブルごとの経路メトリック（multiplier 方式で有効。None は全テーブル shortest）
+    #   shortest: 重みの和, widest: 残余帯域のボトルネック最大（同幅ならホップ数最小）,
+    #   widest-shortest: 重みの和が最小の経路のうちボトルネック最大, shortest-widest: ボトルネック最大の経路のうち重みの和が最小
+    table_metrics: Optional[List[str]] = None
+    
+    # テーブルごとの経路制約（CSPF、None は制約なし）
+    #   [{"max_utilization": 観測利用率がこれを超えるリンクを除外, "max_hops": ホップ数上限 = SRHのSID数上限}, ...]
+    class_constraints: Optional[List[Dict]] = None
+    
+    # リンク重み最適化（none: 利用率ベースの重み, background: 別プロセスで最適化した重みで経路計算）
+    weight_optimization: str = "none"
+    tuned_weights_path: Optional[str] = None  # オフラインで最適化した重み（weight_optimizer.py の出力）
+    optimizer_iterations: int = 200
+    optimizer_max_weight: int = 20
+    optimizer_time_limit: Optional[float] = None  # 1回の最適化の打ち切り時間（秒、None で反復回数のみ）
+    
     def __post_init__(self):
+        if self.rrdcached_address is None:
+            self.rrdcached_address = os.environ.get("RRDCACHED_ADDRESS") or None
         if self.tables is None:
             self.tables = [
                 {"name": "rt_table1", "priority": "高優先度", "description": "高優先度"},
@@ -144,15 +298,391 @@ class SRv6Config:
             2: {5: ("fd01:4::12", "eth3"), 4: ("fd01:2::12", "eth3"), 1: ("fd01:1::11", "eth1")},
         }
 
+class RRDCachedClient:
+    """rrdcached クライアント（UNIXソケット経由でFLUSHを送る）"""
+    
+    def __init__(self, address: str, timeout: float = 5.0):
+        self.address = address[len("unix:"):] if address.startswith("unix:") else address
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+    
+    def _connect(self):
+        """ソケット接続（未接続時のみ）"""
+        if self.sock is not None:
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+        logger.debug(f"rrdcached接続成功: {self.address}")
+    
+    def close(self):
+        """ソケット切断"""
+        if self.reader is not None:
+            self.reader.close()
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.reader = None
+    
+    def _read_response(self) -> Tuple[int, str]:
+        """応答1件を読む（status > 0 の場合は続く status 行も読み捨てる）"""
+        line = self.reader.readline().decode('utf-8', 'replace').strip()
+        if not line:
+            raise ConnectionError("rrdcachedが接続を閉じました")
+        status_str, _, message = line.partition(' ')
+        status = int(status_str)
+        for _ in range(max(status, 0)):
+            self.reader.readline()
+        return status, message
+    
+    def flush(self, rrd_paths: List[str]) -> bool:
+        """指定ファイルの未書き込みデータをディスクへ反映（コマンドをまとめて送信）"""
+        if not rrd_paths:
+            return True
+        for attempt in range(2):
+            try:
+                self._connect()
+                self.sock.sendall("".join(f"FLUSH {path}\n" for path in rrd_paths).encode('utf-8'))
+                failed = 0
+                for path in rrd_paths:
+                    status, message = self._read_response()
+                    if status < 0:
+                        failed += 1
+                        logger.debug(f"rrdcached FLUSH失敗 ({path}): {message}")
+                return failed == 0
+            except (OSError, ValueError, ConnectionError) as e:
+                # デーモン再起動などで切断された場合は1回だけ再接続
+                self.close()
+                if attempt == 1:
+                    logger.warning(f"rrdcached FLUSHエラー ({self.address}): {e}")
+        return False
+
+class LinkTelemetryBuffer:
+    """リンクごとの直近利用率を保持する固定長リングバッファ（NumPy配列）
+    
+    values[slot, edge] に1サイクル1行で記録し、重み関数は全リンク同時にベクトル演算する。
+    """
+    
+    WEIGHT_FUNCTIONS = ("instant", "ewma", "mean", "p95")
+    
+    def __init__(self, edges: List[Tuple[int, int]], capacity: int = 120):
+        self.edges = list(edges)
+        self.capacity = capacity
+        self.values = np.full((capacity, len(self.edges)), np.nan)
+        self.timestamps = np.full(capacity, np.nan)
+        self.head = 0   # 次に書き込むスロット
+        self.count = 0  # 有効なサンプル数
+    
+    def push(self, sample: np.ndarray, timestamp: Optional[float] = None):
+        """1サイクル分のサンプルを追加（最も古い行を上書き）"""
+        self.values[self.head] = sample
+        self.timestamps[self.head] = time.time() if timestamp is None else timestamp
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+    
+    def window(self, size: Optional[int] = None) -> np.ndarray:
+        """直近 size 件を時系列順（古い→新しい）の (size, edges) 配列で返す"""
+        size = self.count if size is None else min(size, self.count)
+        idx = (self.head - size + np.arange(size)) % self.capacity
+        return self.values[idx]
+    
+    def smoothed(self, function: str, size: int, alpha: float = 0.3,
+                 latest: Optional[np.ndarray] = None) -> np.ndarray:
+        """重み関数を適用した利用率ベクトル（データが無いリンクは NaN）"""
+        if function == "instant" or self.count == 0:
+            return latest if latest is not None else self.window(1)[-1]
+        
+        data = self.window(size)
+        valid = ~np.isnan(data)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # 全NaN列は NaN のまま返す
+            if function == "mean":
+                return np.nanmean(data, axis=0)
+            if function == "p95":
+                return np.nanpercentile(data, 95, axis=0)
+            if function == "ewma":
+                # 新しいサンプルほど重い係数 alpha*(1-alpha)^k（欠損を除いて正規化）
+                decay = (1.0 - alpha) ** np.arange(len(data) - 1, -1, -1)
+                coeff = np.where(valid, alpha * decay[:, None], 0.0)
+                total = coeff.sum(axis=0)
+                return np.where(total > 0, (coeff * np.nan_to_num(data)).sum(axis=0) / np.where(total > 0, total, 1.0), np.nan)
+        raise ValueError(f"未対応の重み関数です: {function}")
+
+# 利用率 → 重みの変換関数（全リンクの利用率ベクトルに一括適用、NaN はそのまま返す）
+MM1_MAX_UTILIZATION = 0.99   # mm1: 1/(1-u) が発散しないよう利用率を上限で抑える（重み最大 100）
+EXPONENTIAL_ALPHA = 10.0     # exponential: 立ち上がりの鋭さ（u=1 で約 2200）
+
+COST_FUNCTIONS = {
+    # 利用率そのもの（従来の重み）
+    "linear": lambda u: u,
+    # M/M/1 待ち行列の遅延 1/(1-u)（空きリンクでも 1 になるため、低負荷時はホップ数の少ない経路を選ぶ）
+    "mm1": lambda u: 1.0 / (1.0 - np.minimum(u, MM1_MAX_UTILIZATION)),
+    # (exp(αu) - 1) / α（低負荷では linear とほぼ同じで、高負荷で急増）
+    "exponential": lambda u: np.expm1(EXPONENTIAL_ALPHA * u) / EXPONENTIAL_ALPHA,
+}
+if fortz_thorup_phi is not None:
+    # Fortz–Thorup の区分線形凸コスト（1/3, 2/3, 0.9, 1.0, 1.1 で傾きが 1→3→10→70→500→5000）
+    COST_FUNCTIONS["fortz-thorup"] = fortz_thorup_phi
+
+class UtilizationForecaster:
+    """リンク利用率の短期予測（次の更新間隔の値を全リンク同時に予測）
+    
+    holt: Holt線形指数平滑（水準+傾き）, ar: 切片付きAR(1)を最小二乗で推定
+    予測誤差（前回の予測と今回の観測の差）を MAE/RMSE として集計する。
+    """
+    
+    METHODS = ("none", "holt", "ar")
+    
+    def __init__(self, method: str = "holt", alpha: float = 0.5, beta: float = 0.3, min_samples: int = 3):
+        if method not in self.METHODS:
+            raise ValueError(f"未対応の予測手法です: {method}")
+        self.method = method
+        self.alpha = alpha
+        self.beta = beta
+        self.min_samples = min_samples
+        self.last_forecast: Optional[np.ndarray] = None
+        
+        # 予測誤差の累積
+        self.error_count = 0
+        self.abs_error_sum = 0.0
+        self.sq_error_sum = 0.0
+        self.last_mae: Optional[float] = None
+    
+    @staticmethod
+    def _forward_fill(data: np.ndarray) -> np.ndarray:
+        """欠損（NaN）を直前の値で埋める（先頭の欠損は最初の有効値で埋める）"""
+        filled = data.copy()
+        for t in range(1, len(filled)):
+            missing = np.isnan(filled[t])
+            filled[t, missing] = filled[t - 1, missing]
+        for t in range(len(filled) - 2, -1, -1):
+            missing = np.isnan(filled[t])
+            filled[t, missing] = filled[t + 1, missing]
+        return filled
+    
+    def _holt(self, data: np.ndarray) -> np.ndarray:
+        """Holt線形指数平滑による1ステップ先予測"""
+        level = data[1].copy()
+        trend = data[1] - data[0]
+        for x in data[2:]:
+            previous_level = level
+            level = self.alpha * x + (1.0 - self.alpha) * (level + trend)
+            trend = self.beta * (level - previous_level) + (1.0 - self.beta) * trend
+        return level + trend
+    
+    @staticmethod
+    def _ar1(data: np.ndarray) -> np.ndarray:
+        """x[t] = c + phi * x[t-1] の1ステップ先予測"""
+        x, y = data[:-1], data[1:]
+        mean_x, mean_y = x.mean(axis=0), y.mean(axis=0)
+        var_x = ((x - mean_x) ** 2).sum(axis=0)
+        cov_xy = ((x - mean_x) * (y - mean_y)).sum(axis=0)
+        phi = np.clip(np.divide(cov_xy, var_x, out=np.zeros_like(var_x), where=var_x > 0), -1.0, 1.0)
+        intercept = mean_y - phi * mean_x
+        return intercept + phi * data[-1]
+    
+    def forecast(self, history: np.ndarray) -> np.ndarray:
+        """(samples, edges) の履歴から次の利用率を予測（予測不可のリンクは NaN）"""
+        n_edges = history.shape[1] if history.ndim == 2 else 0
+        prediction = np.full(n_edges, np.nan)
+        if self.method == "none" or len(history) < self.min_samples:
+            self.last_forecast = None
+            return prediction
+        
+        enough = (~np.isnan(history)).sum(axis=0) >= self.min_samples
+        if enough.any():
+            data = self._forward_fill(history[:, enough])
+            predicted = self._holt(data) if self.method == "holt" else self._ar1(data)
+            prediction[enough] = np.clip(predicted, 0.0, 1.0)
+        self.last_forecast = prediction
+        return prediction
+    
+    def record_error(self, observed: np.ndarray) -> Optional[float]:
+        """前回の予測と今回の観測の誤差を集計し、今回のMAEを返す"""
+        if self.last_forecast is None or len(self.last_forecast) != len(observed):
+            return None
+        valid = ~np.isnan(observed) & ~np.isnan(self.last_forecast)
+        if not valid.any():
+            return None
+        errors = observed[valid] - self.last_forecast[valid]
+        self.error_count += errors.size
+        self.abs_error_sum += float(np.abs(errors).sum())
+        self.sq_error_sum += float((errors ** 2).sum())
+        self.last_mae = float(np.abs(errors).mean())
+        return self.last_mae
+    
+    @property
+    def mae(self) -> Optional[float]:
+        """累積平均絶対誤差"""
+        return self.abs_error_sum / self.error_count if self.error_count else None
+    
+    @property
+    def rmse(self) -> Optional[float]:
+        """累積二乗平均平方根誤差"""
+        return math.sqrt(self.sq_error_sum / self.error_count) if self.error_count else None
+
+class ReplayRateSource:
+    """アーカイブ済みトラフィックを仮想時刻に沿って返すレートソース
+
+    SNMPTrafficCollector と同じインターフェース（latest_rates / generation / stop）を持ち、
+    RRDDataManager.rate_source に設定すると RRDファイルの代わりに読み出される。
+
+    values: (rows, links, 2) - ds0(in) / ds1(out)、欠損は NaN
+    """
+
+    # RRDDataManager._read_rates と同じく、最新3行の中から有効値を探す
+    LOOKBACK_ROWS = 3
+
+    def __init__(self, keys: List[Tuple[int, int]], timestamps: np.ndarray, values: np.ndarray):
+        self.keys = list(keys)
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.now = float(self.timestamps[0]) if len(self.timestamps) else 0.0
+        self.generation = -1  # 現在の行番号（行が進むと新しいサンプルとみなす）
+
+    @classmethod
+    def from_rrd(cls, rrd_paths: Dict[Tuple[int, int], str], cf: str = 'AVERAGE') -> "ReplayRateSource":
+        """RRDファイルのRRA全体（1440行 = 1日分）から作成"""
+        if MmapRRDReader is None:
+            raise ImportError("RRDリプレイには rrd_mmap_reader モジュールが必要です")
+        reader = MmapRRDReader()
+        try:
+            keys, timestamps, values = reader.read_history(rrd_paths, cf)
+            # mmap解除後も使えるよう (rows, links, ds) に並べ替えてコピー
+            values = np.ascontiguousarray(values.transpose(1, 0, 2)[:, :, :2]) if keys else values
+        finally:
+            reader.close()
+        if not keys:
+            raise ValueError("リプレイ可能なRRDファイルがありません")
+        return cls(keys, timestamps, values)
+
+    @classmethod
+    def from_jsonl(cls, archive_path: str) -> "ReplayRateSource":
+        """SNMP収集デーモンのテレメトリアーカイブ（1行1スナップショットのJSONL）から作成"""
+        snapshots = []
+        with open(archive_path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    snapshot = json.loads(line)
+                    if snapshot.get("timestamp") is not None:
+                        snapshots.append(snapshot)
+        if not snapshots:
+            raise ValueError(f"リプレイ可能なスナップショットがありません: {archive_path}")
+        snapshots.sort(key=lambda s: s["timestamp"])
+
+        keys = sorted({tuple(int(n) for n in name[1:].split('-r')) for s in snapshots for name in s["links"]})
+        index = {key: i for i, key in enumerate(keys)}
+        values = np.full((len(snapshots), len(keys), 2), np.nan)
+        for row, snapshot in enumerate(snapshots):
+            for name, rate in snapshot["links"].items():
+                values[row, index[tuple(int(n) for n in name[1:].split('-r'))]] = rate[:2]
+        return cls(keys, [s["timestamp"] for s in snapshots], values)
+
+    @classmethod
+    def load(cls, source_path: str, rrd_paths: Dict[Tuple[int, int], str]) -> "ReplayRateSource":
+        """ファイルならテレメトリアーカイブ、ディレクトリならその中のRRDファイル（rrd_paths と同名）から作成"""
+        if os.path.isfile(source_path):
+            return cls.from_jsonl(source_path)
+        archived = {edge_key: os.path.join(source_path, os.path.basename(rrd_path))
+                    for edge_key, rrd_path in rrd_paths.items()}
+        return cls.from_rrd({edge_key: path for edge_key, path in archived.items() if os.path.exists(path)})
+
+    @property
+    def start(self) -> float:
+        """最初に有効なサンプルがある時刻（RRAの未記録部分を読み飛ばす）"""
+        valid = np.flatnonzero(~np.isnan(self.values[:, :, 1]).all(axis=1))
+        return float(self.timestamps[valid[0]]) if valid.size else float(self.timestamps[0])
+
+    @property
+    def end(self) -> float:
+        """最後のサンプルの時刻"""
+        return float(self.timestamps[-1])
+
+    def seek(self, timestamp: float):
+        """仮想時刻を設定"""
+        self.now = float(timestamp)
+        self.generation = int(np.searchsorted(self.timestamps, self.now, side='right')) - 1
+
+    def latest_rates(self) -> Dict[Tuple[int, int], Tuple[Optional[float], float]]:
+        """仮想時刻時点の最新リンクレート {(u, v): (in_Bps, out_Bps)}（in が欠損したリンクは None）"""
+        row = self.generation
+        if row < 0:
+            return {}
+        window = self.values[max(0, row - self.LOOKBACK_ROWS + 1):row + 1]
+        rates = {}
+        for i, edge_key in enumerate(self.keys):
+            latest = []
+            for ds in range(2):
+                column = window[:, i, ds]
+                valid = column[~np.isnan(column)]
+                latest.append(float(valid[-1]) if valid.size else None)
+            in_bps, out_bps = latest
+            if out_bps is not None:
+                rates[edge_key] = (in_bps, out_bps)
+        return rates
+
+    def stop(self):
+        """SNMPTrafficCollector との互換用（停止するスレッドは無い）"""
+        pass
+
 class RRDDataManager:
     """RRDデータ管理クラス"""
     
     def __init__(self, config: SRv6Config):
         self.config = config
         self.fetch_count = 0
+        
+        # リンクごとの利用率履歴（最初の update_edge_weights でグラフのエッジ順に作成）
+        self.telemetry: Optional[LinkTelemetryBuffer] = None
+        self.forecaster = UtilizationForecaster(config.forecast_method)
+        
+        # リンクごとの取得キャッシュ {edge_key: ((mtime_ns, last_update), (in_Bps, out_Bps) or None)}
+        self._rate_cache: Dict[Tuple[int, int], Tuple[Tuple[int, Optional[float]], Optional[Tuple[Optional[float], float]]]] = {}
+        self.changed_links = set()
+        self.data_changed = True  # 直近の更新で新しいサンプルがあったか
+        self.cache_hits = 0
+        
+        # 直近の update_edge_weights の結果（アーカイブ用、graph.edges() 順）
+        self.last_rates: Optional[np.ndarray] = None
+        self.last_utilization: Optional[np.ndarray] = None
+        self.last_fetch_ms = 0.0
+        
+        # RRDファイルの代わりに使うレートソース（latest_rates() / generation / stop() を持つもの）
+        # traffic_source="snmp" の場合はSNMP直接収集、リプレイ時は ReplayRateSource を設定する
+        self.rate_source = None
+        self._source_generation = None
+        if config.traffic_source == "snmp":
+            if SNMPTrafficCollector is None:
+                raise ImportError("SNMP収集には snmp_traffic_collector モジュールが必要です")
+            targets = load_mrtg_targets(config.mrtg_config_path)
+            self.rate_source = SNMPTrafficCollector(targets, interval=config.snmp_interval)
+            self.rate_source.start()
+        
+        # rrdcached（設定時のみ）: 読み出し前に対象リンクだけFLUSHする
+        self.rrdcached = None
+        if config.rrdcached_address:
+            self.rrdcached = RRDCachedClient(config.rrdcached_address)
+            logger.info(f"rrdcached連携: {config.rrdcached_address}")
+        
+        # mmapリーダー（numpy が利用可能な場合のみ。.rrd を直接読むため fork も rrdtool も不要）
+        self.mmap_reader = None
+        if MmapRRDReader is not None:
+            try:
+                self.mmap_reader = MmapRRDReader()
+                logger.info("RRD読み出し: mmapリーダーを使用")
+            except ImportError as e:
+                logger.info(f"RRD読み出し: mmapリーダー無効 ({e})")
     
-    def fetch_rrd_data(self, rrd_path: str) -> Optional[float]:
-        """RRDデータ取得"""
+    def fetch_rrd_data(self, rrd_path: str, ds_index: int = 1) -> Optional[float]:
+        """RRDデータ取得（ds_index: 0=ds0(in), 1=ds1(out)）"""
         try:
             self.fetch_count += 1
             logger.debug(f"RRDデータ取得: {rrd_path}")
@@ -173,13 +703,13 @@ class RRDDataManager:
             
             # 最新の有効データを検索
             # RRDファイルには ds0(in) と ds1(out) の2つのデータソースがある
-            # 出力トラフィック（ds1 = out）を使用帯域として使用
+            # 既定では出力トラフィック（ds1 = out）を使用帯域として使用
             data_lines = lines[2:]
             for line in reversed(data_lines):
                 if ':' in line:
                     parts = line.split()
                     if len(parts) >= 3:  # timestamp, ds0, ds1
-                        val_str = parts[2]  # ds1 = out（出力トラフィック）
+                        val_str = parts[1 + ds_index]  # ds0 = in / ds1 = out
                         if val_str.lower() not in ['-nan', 'nan']:
                             try:
                                 val = float(val_str)
@@ -194,6 +724,160 @@ class RRDDataManager:
             logger.error(f"RRDデータ取得エラー ({rrd_path}): {e}")
             return None
     
+    def fetch_all_rates(self, edge_keys: Optional[List[Tuple[int, int]]] = None) -> Optional[Dict[Tuple[int, int], Tuple[Optional[float], float]]]:
+        """全リンクのRRDデータを一括取得（変更のないリンクはキャッシュから返す）
+        
+        リンクごとに (ファイルmtime, RRD last_update) をキーとしてキャッシュし、
+        MRTGが新しいサンプルを書き込んだリンクだけを読み直す。
+        変更のあったリンクは self.changed_links に記録する。
+        
+        Returns:
+            {(u, v): (in_Bps, out_Bps)} - ds0(in) / ds1(out) それぞれの最新有効値
+            （ds0 に有効値が無い場合は in_Bps が None。有向グラフでは v→u 方向のデータなしとして扱う。
+            取得自体に失敗した場合は None）
+        """
+        if edge_keys is None:
+            edge_keys = list(self.config.rrd_paths.keys())
+        
+        # レートソースがある場合はその最新レートをそのまま使う（世代で変化を判定）
+        if self.rate_source is not None:
+            rates = self.rate_source.latest_rates()
+            generation = self.rate_source.generation
+            self.changed_links = set(rates) if generation != self._source_generation else set()
+            self._source_generation = generation
+            return {edge_key: rates[edge_key] for edge_key in edge_keys if edge_key in rates}
+        
+        # rrdcached 経由の場合は、必要なリンクのみFLUSHしてからファイルを読む
+        # （FLUSH失敗時はディスク上のデータをそのまま読む）
+        if self.rrdcached is not None:
+            flush_paths = [self.config.rrd_paths[k] for k in edge_keys if k in self.config.rrd_paths]
+            if not self.rrdcached.flush(flush_paths):
+                logger.warning("rrdcached FLUSH失敗 - ディスク上のRRDを直接読み出します")
+        
+        # 存在しないファイルは読み出し対象から除外（xport は1つでも欠けると全体が失敗する）
+        # mtime が前回と同じ、または last_update が進んでいないリンクはキャッシュを使う
+        stale_targets = []
+        cache_keys = {}
+        hits = 0
+        self.changed_links = set()
+        for edge_key in edge_keys:
+            rrd_path = self.config.rrd_paths.get(edge_key)
+            try:
+                mtime_ns = os.stat(rrd_path).st_mtime_ns if rrd_path else None
+            except OSError:
+                mtime_ns = None
+            if mtime_ns is None:
+                logger.debug(f"RRDファイルなし: r{edge_key[0]}-r{edge_key[1]}")
+                self._rate_cache.pop(edge_key, None)
+                continue
+            
+            cached = self._rate_cache.get(edge_key)
+            if cached and cached[0][0] == mtime_ns:
+                hits += 1
+                continue
+            last_update = None
+            if read_last_update is not None:
+                try:
+                    last_update = read_last_update(rrd_path)
+                except (OSError, ValueError, struct.error) as e:
+                    logger.debug(f"last_update取得失敗 ({rrd_path}): {e}")
+            if cached and last_update is not None and cached[0][1] == last_update:
+                # ファイルは触られたが新しいサンプルは無い
+                self._rate_cache[edge_key] = ((mtime_ns, last_update), cached[1])
+                hits += 1
+                continue
+            cache_keys[edge_key] = (mtime_ns, last_update)
+            stale_targets.append((edge_key, rrd_path))
+        
+        if stale_targets:
+            rates = self._read_rates(stale_targets)
+            if rates is None:
+                return None
+            for edge_key, _ in stale_targets:
+                # 有効値が無い場合も None としてキャッシュする（次のサンプルまで読み直さない）
+                self._rate_cache[edge_key] = (cache_keys[edge_key], rates.get(edge_key))
+                self.changed_links.add(edge_key)
+        
+        self.cache_hits += hits
+        logger.debug(f"RRD取得: 読み出し {len(stale_targets)}リンク / キャッシュ {hits}リンク")
+        return {edge_key: self._rate_cache[edge_key][1] for edge_key in edge_keys
+                if edge_key in self._rate_cache and self._rate_cache[edge_key][1] is not None}
+    
+    def _read_rates(self, targets: List[Tuple[Tuple[int, int], str]]) -> Optional[Dict[Tuple[int, int], Tuple[Optional[float], float]]]:
+        """指定リンクのRRDデータを1回の読み出しで取得
+        
+        mmapリーダーが利用可能ならRRDファイルを直接読む。それ以外は python-rrdtool が
+        利用可能ならプロセス内で、無ければ rrdtool xport を1回だけ起動する。
+        """
+        if self.mmap_reader is not None:
+            self.fetch_count += 1
+            latest = self.mmap_reader.read_latest(dict(targets))
+            rates = {edge_key: (in_bps, out_bps)
+                     for edge_key, (in_bps, out_bps) in latest.items() if out_bps is not None}
+            if latest:
+                logger.debug(f"RRD mmap取得: {len(rates)}/{len(targets)}リンク")
+                return rates
+            # 全ファイルの解析に失敗した場合（未対応フォーマット等）は xport にフォールバック
+            logger.warning("RRD mmap読み出しに失敗したため、xport にフォールバックします")
+        
+        # DEF/XPORT を全リンク分まとめて組み立て（in: ds0, out: ds1）
+        args = ['--start', '-180s', '--end', 'now', '--step', '60']
+        for i, (_, rrd_path) in enumerate(targets):
+            escaped = rrd_path.replace(':', '\\:')
+            args.append(f"DEF:in{i}={escaped}:ds0:AVERAGE")
+            args.append(f"DEF:out{i}={escaped}:ds1:AVERAGE")
+        for i in range(len(targets)):
+            args.append(f"XPORT:in{i}")
+            args.append(f"XPORT:out{i}")
+        
+        try:
+            self.fetch_count += 1
+            if rrdtool is not None:
+                rows = [[v if v is not None else math.nan for v in row]
+                        for row in rrdtool.xport(*args)['data']]
+            else:
+                # XMLにencoding宣言が含まれるためバイト列のまま解析する
+                result = subprocess.run(
+                    ['rrdtool', 'xport'] + args,
+                    capture_output=True, timeout=10
+                )
+                if result.returncode != 0:
+                    logger.warning(f"RRD一括取得失敗: {result.stderr.decode('utf-8', 'replace').strip()}")
+                    return None
+                root = ET.fromstring(result.stdout)
+                rows = [[float(v.text) for v in row.findall('v')]
+                        for row in root.findall('./data/row')]
+        except Exception as e:
+            logger.error(f"RRD一括取得エラー: {e}")
+            return None
+        
+        # 列ごとに最新の有効データを検索（fetch_rrd_data と同じ方針）
+        def latest_valid(column: int) -> Optional[float]:
+            for row in reversed(rows):
+                if column < len(row) and not math.isnan(row[column]):
+                    return row[column]
+            return None
+        
+        rates = {}
+        for i, (edge_key, _) in enumerate(targets):
+            in_bps = latest_valid(2 * i)
+            out_bps = latest_valid(2 * i + 1)
+            if out_bps is None:
+                continue
+            rates[edge_key] = (in_bps, out_bps)
+        
+        logger.debug(f"RRD一括取得: {len(rates)}/{len(targets)}リンク")
+        return rates
+    
+    def close(self):
+        """収集スレッド・mmap・ソケットの解放"""
+        if self.rate_source is not None:
+            self.rate_source.stop()
+        if self.mmap_reader is not None:
+            self.mmap_reader.close()
+        if self.rrdcached is not None:
+            self.rrdcached.close()
+    
     def update_edge_weights(self, graph: nx.Graph) -> bool:
         """エッジ重みをRRDデータで更新（利用率: 0-1の範囲、重みとして設定）"""
         logger.info("RRDデータからエッジ重みを更新中...")
@@ -204,22 +888,57 @@ class RRDDataManager:
         # 最小重み値（利用率が0でも経路選択の多様性を保つため）
         min_weight = 0.0001
         
-        for u, v in graph.edges():
+        # データなしのリンクは空きリンクとして扱う（コスト関数の u=0 の値。mm1 では 1 になり、計測済みの空きリンクと同じ）
+        if self.config.cost_function not in COST_FUNCTIONS:
+            raise ValueError(f"未対応のコスト関数です: {self.config.cost_function}")
+        cost_function = COST_FUNCTIONS[self.config.cost_function]
+        idle_weight = max(float(cost_function(np.zeros(1))[0]), min_weight)
+        
+        # 有向グラフでは各リンクの2方向に ds0/ds1 を割り当てる
+        # RRDは番号の小さい側のルーターで計測: (u, v) のファイルの ds1(out) = u→v, ds0(in) = v→u
+        directed = graph.is_directed()
+        
+        # 全リンクを一括取得（失敗時はリンクごとの rrdtool fetch にフォールバック）
+        edge_keys = list(dict.fromkeys(
+            (u, v) if (u, v) in self.config.rrd_paths else (v, u) for u, v in graph.edges()))
+        fetch_start = time.perf_counter()
+        rates = self.fetch_all_rates(edge_keys)
+        self.last_fetch_ms = (time.perf_counter() - fetch_start) * 1000
+        if rates is None:
+            logger.warning("RRD一括取得に失敗したため、リンクごとの取得にフォールバックします")
+            self.data_changed = True
+        else:
+            self.data_changed = bool(self.changed_links)
+            if not self.data_changed:
+                logger.info("RRD新規サンプルなし（全リンクをキャッシュから取得）")
+        
+        # 今回の観測利用率（データなしは NaN）
+        edges = list(graph.edges())
+        observed = np.full(len(edges), np.nan)
+        observed_rates = np.full(len(edges), np.nan)
+        
+        for i, (u, v) in enumerate(edges):
             edge_key = (u, v) if (u, v) in self.config.rrd_paths else (v, u)
             rrd_path = self.config.rrd_paths.get(edge_key)
             max_bandwidth = graph[u][v].get('max_bandwidth', 125_000_000)  # デフォルト1Gbps
+            # 無向グラフは従来通り ds1(out) を使用。有向グラフは u→v 方向に対応するDSを使用
+            ds_index = 0 if directed and edge_key != (u, v) else 1
+            arrow = "->" if directed else "<->"
             
             if rrd_path:
-                out_bytes_per_sec = self.fetch_rrd_data(rrd_path)
-                if out_bytes_per_sec is not None:
+                if rates is not None:
+                    bytes_per_sec = rates[edge_key][ds_index] if edge_key in rates else None
+                else:
+                    bytes_per_sec = self.fetch_rrd_data(rrd_path, ds_index)
+                if bytes_per_sec is not None:
+                    observed_rates[i] = bytes_per_sec
                     # 利用率計算: u = データ転送量 / 帯域の最大値 (0-1の範囲)
-                    utilization = out_bytes_per_sec / max_bandwidth
+                    utilization = bytes_per_sec / max_bandwidth
                     utilization = max(0.0, min(1.0, utilization))  # 0-1にクリップ
-                    # 最小重み値を保証（0の場合でも0.0001以上）
-                    graph[u][v]['weight'] = max(utilization, min_weight)
+                    observed[i] = utilization
                     
                     # 表示用単位変換（バイト/秒 → bps → Mbps）
-                    bps = out_bytes_per_sec * 8  # バイト/秒 → ビット/秒
+                    bps = bytes_per_sec * 8  # バイト/秒 → ビット/秒
                     if bps >= 1_000_000:
                         display_val = round(bps / 1_000_000, 2)
                         unit = "Mbps"
@@ -230,25 +949,99 @@ class RRDDataManager:
                         display_val = round(bps, 2)
                         unit = "bps"
                     
-                    logger.info(f"Edge r{u} <-> r{v}: {display_val} {unit} (利用率: {utilization:.4f})")
+                    logger.info(f"Edge r{u} {arrow} r{v}: {display_val} {unit} (利用率: {utilization:.4f})")
                     update_count += 1
                 else:
-                    graph[u][v]['weight'] = min_weight  # データなしの場合は最小値
-                    logger.warning(f"Edge r{u} <-> r{v}: RRDデータ取得失敗 (重み={min_weight})")
+                    logger.warning(f"Edge r{u} {arrow} r{v}: RRDデータ取得失敗 (重み={idle_weight})")
                     no_data_count += 1
             else:
-                graph[u][v]['weight'] = min_weight  # RRDパスなしの場合は最小値
-                logger.warning(f"Edge r{u} <-> r{v}: RRDファイル未定義 (重み={min_weight})")
+                logger.warning(f"Edge r{u} {arrow} r{v}: RRDファイル未定義 (重み={idle_weight})")
                 no_rrd_count += 1
         
+        self.last_rates = observed_rates
+        self.last_utilization = observed
+        
+        # 新しいサンプルのみリングバッファへ追加（キャッシュ値の重複登録を避ける）
+        if self.telemetry is None or self.telemetry.edges != edges:
+            self.telemetry = LinkTelemetryBuffer(edges, self.config.telemetry_capacity)
+        if self.data_changed:
+            # 前回の予測値と今回の観測値で予測誤差を記録
+            error = self.forecaster.record_error(observed)
+            if error is not None:
+                logger.info(f"予測誤差: 今回MAE={error:.4f}, 累積MAE={self.forecaster.mae:.4f}, "
+                            f"累積RMSE={self.forecaster.rmse:.4f}")
+            self.telemetry.push(observed)
+        
+        # 重み関数を全リンクに対してベクトル演算で適用
+        smoothed = self.telemetry.smoothed(
+            self.config.weight_function, self.config.telemetry_window, self.config.ewma_alpha,
+            latest=observed)
+        
+        # 予測ステージ: 予測できたリンクは次の間隔の予測利用率で経路計算する
+        if self.config.forecast_method != "none":
+            if self.data_changed or self.forecaster.last_forecast is None:
+                self.forecaster.forecast(self.telemetry.window(self.config.forecast_window))
+            if self.forecaster.last_forecast is not None:
+                smoothed = np.where(np.isnan(self.forecaster.last_forecast), smoothed, self.forecaster.last_forecast)
+        
+        # 利用率を重みへ変換
+        smoothed = cost_function(smoothed)
+        
+        # 重みを書き込み（データなしは空きリンクの重み。0の場合でも0.0001以上を保証）
+        for i, (u, v) in enumerate(edges):
+            graph[u][v]['utilization'] = 0.0 if np.isnan(observed[i]) else float(observed[i])
+            graph[u][v]['weight'] = idle_weight if np.isnan(smoothed[i]) else max(float(smoothed[i]), min_weight)
+        if self.config.cost_function != "linear":
+            logger.info(f"コスト関数: {self.config.cost_function}")
+        if self.config.weight_function != "instant":
+            logger.info(f"重み関数: {self.config.weight_function} "
+                        f"(窓: {self.config.telemetry_window}, 蓄積サンプル: {self.telemetry.count})")
+        
         logger.info(f"エッジ重み更新完了: {update_count}/{len(graph.edges())} (RRD未定義: {no_rrd_count}, データ取得失敗: {no_data_count})")
         return update_count > 0
 
+ARCHIVE_STAGES = ("fetch", "weights", "paths", "program", "visualize")
+
+def open_cycle_archive(config: SRv6Config, graph: nx.Graph) -> Optional["CycleArchive"]:
+    """config.archive_dir が設定されていればサイクルアーカイブを開く（失敗時は無効化して継続）"""
+    if not config.archive_dir:
+        return None
+    if CycleArchive is None:
+        logger.warning("サイクルアーカイブには cycle_archive モジュールが必要です（無効化）")
+        return None
+    try:
+        archive = CycleArchive(config.archive_dir, list(graph.edges()), ARCHIVE_STAGES,
+                               num_paths=len(config.tables), max_hops=graph.number_of_nodes())
+    except (OSError, ValueError) as e:
+        logger.warning(f"サイクルアーカイブを開けません（無効化）: {e}")
+        return None
+    logger.info(f"サイクルアーカイブ: {config.archive_dir} (既存 {archive.total_rows}行)")
+    return archive
+
+def archive_cycle(archive: "CycleArchive", timestamp: float, status: int, rrd_manager: RRDDataManager,
+                  graph: nx.Graph, forward_routes, return_routes, stage_ms: Dict[str, float]):
+    """1サイクル分のレート・重み・選択経路・処理時間をアーカイブへ追記"""
+    edges = archive.edges
+    same_order = list(graph.edges()) == edges
+    try:
+        archive.append(
+            timestamp, status,
+            rates=rrd_manager.last_rates if same_order else None,
+            utilization=rrd_manager.last_utilization if same_order else None,
+            weights=np.array([graph[u][v].get('weight', np.nan) for u, v in edges]),
+            paths=[(route.path, route.cost) for route in forward_routes or []],
+            return_paths=[(route.path, route.cost) for route in return_routes or []],
+            stage_ms=stage_ms
+        )
+    except (OSError, ValueError) as e:
+        logger.warning(f"サイクルアーカイブ書き込み失敗: {e}")
+
 class SRv6PathManager:
     """SRv6双方向パス管理クラス（簡素化版）"""
     
-    def __init__(self, enable_visualization: bool = False):
-        self.config = SRv6Config()
+    def __init__(self, enable_visualization: bool = False, config: Optional[SRv6Config] = None,
+                 dry_run: bool = False, clock=None):
+        self.config = config or SRv6Config()
         self.rrd_manager = RRDDataManager(self.config)
         self.ssh_manager = SSHConnectionManager(self.config)
         self.path_calculator = PathCalculator(self.config)
@@ -260,14 +1053,38 @@ class SRv6PathManager:
         self.update_count = 0
         self.calculated_paths = None  # 計算された3つの経路を保存
         
+        # dry_run: テーブル更新をSSHで行わず、生成した経路の記録のみ行う（リプレイ用）
+        self.dry_run = dry_run
+        self.clock = clock or time.time
+        self.last_forward_routes: Optional[List["TableRoute"]] = None
+        self.last_return_routes: Optional[List["TableRoute"]] = None
+        
+        # RRDに新しいサンプルが無いサイクルの省略用
+        self.last_cycle_success = False
+        self.skipped_cycles = 0
+        self.tuned_weights_changed = False  # 今回のサイクルでバックグラウンド最適化の重みが更新されたか
+        
+        # 差分書き込み（route_reconcile）: 両方向とも書き込むテーブルが無かったサイクル数
+        self.programmed_tables = 0
+        self.noop_cycles = 0
+        
         if self.enable_visualization:
-            self.visualizer = TopologyVisualizer(self.path_calculator.graph)
+            if self.config.visualization_dir:
+                self.visualizer = TopologyVisualizer(self.path_calculator.graph, clock=clock,
+                                                     output_dir=self.config.visualization_dir,
+                                                     history_dir=os.path.join(self.config.visualization_dir, "history"))
+            else:
+                self.visualizer = TopologyVisualizer(self.path_calculator.graph, clock=clock)
             logger.info("トポロジ可視化機能を有効化しました")
+        
+        # サイクルごとの列指向アーカイブ（config.archive_dir 設定時のみ）
+        self.archive = open_cycle_archive(self.config, self.path_calculator.graph)
     
     def get_all_traffic_data(self):
         """RRDトラフィックデータ取得（エッジ重み更新）"""
         success = self.rrd_manager.update_edge_weights(self.path_calculator.graph)
         if success:
+            self.tuned_weights_changed = self.path_calculator.refresh_tuned_weights(self.rrd_manager.last_rates)
             return {"status": "success", "graph": self.path_calculator.graph}
         return None
     
@@ -280,6 +1097,14 @@ class SRv6PathManager:
                 return paths[0][0]  # 最適経路のノードリストを返す
         return None
     
+    def calculate_return_path(self, forward_optimal_path: List[int]) -> Optional[List[int]]:
+        """復路最適経路計算（有向グラフでは復路方向の重みで独立に計算）"""
+        if not self.path_calculator.graph.is_directed():
+            return forward_optimal_path[::-1]
+        paths = self.path_calculator.calculate_multiple_paths(
+            forward_optimal_path[-1], forward_optimal_path[0], 1, verbose=False)
+        return paths[0][0] if paths else None
+    
     def create_table_routes(self, optimal_path):
         """往路テーブルルート生成（既に計算済みの経路を使用）"""
         # self.calculated_paths に保存された経路情報を使用
@@ -311,6 +1136,13 @@ class SRv6PathManager:
     
     def update_all_tables(self, table_routes):
         """往路テーブル更新"""
+        self.last_forward_routes = table_routes
+        if self.config.route_reconcile:
+            success, programmed = self.table_manager.reconcile(table_routes, is_return=False, dry_run=self.dry_run)
+            self.programmed_tables += programmed
+            return success
+        if self.dry_run:
+            return True
         return self.table_manager.update_all_tables(table_routes, is_return=False)
     
     def create_return_table_routes(self, return_optimal_path):
@@ -319,6 +1151,13 @@ class SRv6PathManager:
     
     def update_return_tables(self, return_table_routes):
         """復路テーブル更新"""
+        self.last_return_routes = return_table_routes
+        if self.config.route_reconcile:
+            success, programmed = self.table_manager.reconcile(return_table_routes, is_return=True, dry_run=self.dry_run)
+            self.programmed_tables += programmed
+            return success
+        if self.dry_run:
+            return True
         return self.table_manager.update_all_tables(return_table_routes, is_return=True)
     
     def visualize_network(self):
@@ -327,24 +1166,57 @@ class SRv6PathManager:
             self.visualizer.visualize(paths=self.calculated_paths, update_count=self.update_count)
     
     def update_bidirectional_tables(self) -> bool:
-        """双方向テーブル統合更新メソッド"""
+        """双方向テーブル統合更新メソッド（アーカイブ有効時はサイクルの結果を追記）"""
+        timestamp = self.clock()
+        skipped_before = self.skipped_cycles
+        stage_ms = {}
+        success = self._update_bidirectional_tables(stage_ms)
+        
+        if self.archive is not None:
+            if self.skipped_cycles != skipped_before:
+                status = STATUS_SKIPPED
+            else:
+                status = STATUS_UPDATED if success else STATUS_FAILED
+            archive_cycle(self.archive, timestamp, status, self.rrd_manager, self.path_calculator.graph,
+                          self.last_forward_routes, self.last_return_routes, stage_ms)
+        return success
+    
+    def _update_bidirectional_tables(self, stage_ms: Dict[str, float]) -> bool:
+        """双方向テーブル更新の本体（stage_ms に処理段階ごとの所要時間を記録）"""
         try:
             logger.info("🚀 双方向テーブル更新開始")
             
             # RRDデータ取得と経路計算
+            stage_start = time.perf_counter()
             traffic_data = self.get_all_traffic_data()
+            stage_ms['fetch'] = self.rrd_manager.last_fetch_ms
+            stage_ms['weights'] = (time.perf_counter() - stage_start) * 1000 - stage_ms['fetch']
             if not traffic_data:
                 logger.error("トラフィックデータ取得失敗")
+                self.last_cycle_success = False
                 return False
             
+            # 新しいサンプルが無く前回の更新が成功していれば、経路計算・テーブル更新を省略
+            # （最適化した重みが更新された場合は再計算する）
+            if self.tuned_weights_changed:
+                logger.info("🔁 最適化したリンク重みを反映 - 経路を再計算")
+            elif not self.rrd_manager.data_changed and self.last_cycle_success:
+                self.skipped_cycles += 1
+                logger.info(f"⏭️ RRD更新なし - 経路計算・テーブル更新をスキップ (累計: {self.skipped_cycles}回)")
+                return True
+            
             # 最適経路計算（往路）
+            stage_start = time.perf_counter()
             forward_optimal_path = self.calculate_optimal_path(traffic_data)
             if not forward_optimal_path:
                 logger.error("往路最適経路計算失敗")
                 return False
             
-            # 復路最適経路計算（往路の逆順）
-            return_optimal_path = forward_optimal_path[::-1]
+            # 復路最適経路計算（無向: 往路の逆順, 有向: r16→r1方向の負荷で計算）
+            return_optimal_path = self.calculate_return_path(forward_optimal_path)
+            if not return_optimal_path:
+                logger.error("復路最適経路計算失敗")
+                return False
             
             forward_path_str = ' → '.join([f'r{node}' for node in forward_optimal_path])
             return_path_str = ' → '.join([f'r{node}' for node in return_optimal_path])
@@ -362,18 +1234,28 @@ class SRv6PathManager:
             if not return_table_routes:
                 logger.error("復路テーブル生成失敗")
                 return False
+            stage_ms['paths'] = (time.perf_counter() - stage_start) * 1000
             
             # 往路テーブル更新実行（r1）
+            stage_start = time.perf_counter()
+            programmed_before = self.programmed_tables
             forward_success = self.update_all_tables(forward_table_routes)
             
             # 復路テーブル更新実行（r16）
             return_success = self.update_return_tables(return_table_routes)
+            stage_ms['program'] = (time.perf_counter() - stage_start) * 1000
+            if self.config.route_reconcile and self.programmed_tables == programmed_before:
+                self.noop_cycles += 1
+                logger.info(f"⏸️ 経路変更なし - テーブル書き込みなし (累計: {self.noop_cycles}回)")
             
             # 可視化の更新
+            stage_start = time.perf_counter()
             self.update_count += 1
             self.visualize_network()
+            stage_ms['visualize'] = (time.perf_counter() - stage_start) * 1000
             
             # 結果判定
+            self.last_cycle_success = forward_success and return_success
             if forward_success and return_success:
                 logger.info("✅ 双方向テーブル更新成功")
                 logger.info(f"往路（r1）: {len(forward_table_routes)}テーブル更新完了")
@@ -385,20 +1267,481 @@ class SRv6PathManager:
                 
         except Exception as e:
             logger.error(f"双方向テーブル更新例外: {e}")
+            self.last_cycle_success = False
             return False
     
     def cleanup(self):
         """リソースのクリーンアップ"""
         if self.visualizer:
             self.visualizer.close()
+        if self.archive is not None:
+            self.archive.close()
+        self.table_manager.log_switch_stats()
+        self.path_calculator.close()
+        self.rrd_manager.close()
+        self.ssh_manager.close()
+    
+class CandidatePathSet:
+    """候補経路集合（起動時に src→dst の全単純経路を列挙し、エッジ接続行列として保持）
+    
+    incidence: (経路数, エッジ数) の 0/1 行列。全経路のコストは incidence @ weights の1回の積で求まる。
+    エッジ順は graph.edges() の順（無向グラフでは (u, v) と (v, u) は同じ列）
+    """
+    
+    def __init__(self, graph: nx.Graph, src: int, dst: int, limit: int = 2000):
+        self.src = src
+        self.dst = dst
+        self.edges = list(graph.edges())
+        self.edge_index = {}
+        for i, (u, v) in enumerate(self.edges):
+            self.edge_index[(u, v)] = i
+            if not graph.is_directed():
+                self.edge_index[(v, u)] = i
+        
+        paths = list(itertools.islice(nx.all_simple_paths(graph, src, dst), limit + 1))
+        if len(paths) > limit:
+            # 一部の経路だけでは最短経路を見落とすため、打ち切らずにエラーとする
+            raise ValueError(f"候補経路が上限 {limit} 本を超えています: r{src} → r{dst}")
+        # 同コストの場合はホップ数の少ない経路を優先（argmin は先頭を返すため）
+        paths.sort(key=len)
+        self.paths = paths
+        
+        self.incidence = np.zeros((len(paths), len(self.edges)))
+        for p, path in enumerate(paths):
+            self.incidence[p, [self.edge_index[(u, v)] for u, v in zip(path, path[1:])]] = 1.0
+        logger.info(f"候補経路列挙: r{src} → r{dst} {len(paths)}本 (エッジ数: {len(self.edges)})")
+    
+    def score(self, weights: np.ndarray) -> np.ndarray:
+        """全候補経路のコスト"""
+        return self.incidence @ weights
+    
+    def ranked(self, weights: np.ndarray) -> List[Tuple[List[int], float]]:
+        """全候補経路をコスト順に返す"""
+        costs = self.score(weights)
+        return [(self.paths[i], float(costs[i])) for i in np.argsort(costs, kind='stable')]
+
+class PathEngine:
+    """経路計算エンジンの基底クラス
+    
+    全エンジンが graph.edges() 順の重みベクトルを入力とし、
+    shortest_path(src, dst, weights) で (ノードリスト, コスト, 使用エッジ番号リスト) を返す。
+    トポロジ（ノード・エッジ）は作成時に固定し、重みだけを呼び出しごとに受け取る。
+    """
+    
+    name = None
+    
+    def __init__(self, graph: nx.Graph, config: SRv6Config):
+        self.graph = graph
+        self.config = config
+        self.edges = list(graph.edges())
+        self.edge_index = {}
+        for i, (u, v) in enumerate(self.edges):
+            self.edge_index[(u, v)] = i
+            if not graph.is_directed():
+                self.edge_index[(v, u)] = i
+    
+    def path_edges(self, path: List[int]) -> List[int]:
+        """ノードリストを使用エッジ番号のリストに変換"""
+        return [self.edge_index[(u, v)] for u, v in zip(path, path[1:])]
+    
+    def shortest_path(self, src: int, dst: int, weights: np.ndarray) -> Optional[Tuple[List[int], float, List[int]]]:
+        """最短経路（到達不能なら None）"""
+        raise NotImplementedError
+
+class NetworkXPathEngine(PathEngine):
+    """NetworkX のDijkstra（作業用グラフに重みを書き込んで計算）"""
+    
+    name = "networkx"
+    
+    def __init__(self, graph: nx.Graph, config: SRv6Config):
+        super().__init__(graph, config)
+        self.work_graph = graph.copy()
+    
+    def shortest_path(self, src, dst, weights):
+        for (u, v), weight in zip(self.edges, weights.tolist()):
+            self.work_graph[u][v]['weight'] = weight
+        try:
+            cost, path = nx.single_source_dijkstra(self.work_graph, src, dst, weight='weight')
+        except nx.NetworkXNoPath:
+            return None
+        return path, cost, self.path_edges(path)
+
+class ScipyPathEngine(PathEngine):
+    """scipy.sparse.csgraph.dijkstra（CSR行列の非ゼロ構造は固定し、データ配列だけを差し替える）"""
+    
+    name = "scipy"
+    
+    def __init__(self, graph: nx.Graph, config: SRv6Config):
+        if csgraph_dijkstra is None:
+            raise ImportError("scipy エンジンには scipy が必要です")
+        super().__init__(graph, config)
+        self.nodes = list(graph.nodes())
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+        
+        # 弧（探索方向）ごとに (出発ノード, 到着ノード, エッジ番号) を行優先で並べる
+        arcs = []
+        for e, (u, v) in enumerate(self.edges):
+            arcs.append((self.node_index[u], self.node_index[v], e))
+            if not graph.is_directed():
+                arcs.append((self.node_index[v], self.node_index[u], e))
+        arcs.sort()
+        tails = np.array([arc[0] for arc in arcs], dtype=np.int32)
+        self._indices = np.array([arc[1] for arc in arcs], dtype=np.int32)
+        self._arc_edge = np.array([arc[2] for arc in arcs], dtype=np.int64)
+        self._indptr = np.zeros(len(self.nodes) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(tails, minlength=len(self.nodes)), out=self._indptr[1:])
+    
+    def shortest_path(self, src, dst, weights):
+        matrix = csr_matrix((weights[self._arc_edge], self._indices, self._indptr),
+                            shape=(len(self.nodes), len(self.nodes)))
+        dist, predecessors = csgraph_dijkstra(matrix, directed=True, indices=self.node_index[src],
+                                              return_predecessors=True)
+        target = self.node_index[dst]
+        if np.isinf(dist[target]):
+            return None
+        path = [target]
+        while predecessors[path[-1]] >= 0:
+            path.append(int(predecessors[path[-1]]))
+        path = [self.nodes[i] for i in reversed(path)]
+        return path, float(dist[target]), self.path_edges(path)
+
+class ArrayPathEngine(PathEngine):
+    """CompiledTopology（CSR配列）上のヒープDijkstra"""
+    
+    name = "array"
+    
+    def __init__(self, graph: nx.Graph, config: SRv6Config):
+        if CompiledTopology is None:
+            raise ImportError("array エンジンには compiled_topology モジュールが必要です")
+        super().__init__(graph, config)
+        self.topology = CompiledTopology.from_networkx(graph)
+    
+    def shortest_path(self, src, dst, weights):
+        return self.topology.shortest_path(src, dst, weights)
+
+class DynamicPathEngine(PathEngine):
+    """最短経路木を保持し、重みの変化分だけを再計算するエンジン
+    
+    始点ごとにテーブル数分の木を保持する（1経路目は観測重み、2経路目以降は倍率適用後の重みで
+    計算するため、それぞれ前サイクルの同じ段の木が最も近い）。呼び出しごとに変化エッジ数が
+    最も少ない木を選んで差分更新し、config.spt_epsilon 以下の変化は無視する。
+    経路のコストは常に現在の重みで計算し直して返す。
+    """
+    
+    name = "dynamic"
+    
+    def __init__(self, graph: nx.Graph, config: SRv6Config):
+        if CompiledTopology is None:
+            raise ImportError("dynamic エンジンには compiled_topology モジュールが必要です")
+        super().__init__(graph, config)
+        self.topology = CompiledTopology.from_networkx(graph)
+        self.epsilon = config.spt_epsilon
+        self.max_trees = max(1, len(config.tables))
+        self.trees: Dict[int, List[ShortestPathTree]] = {}
+        self.stats = {'built': 0, 'updated': 0, 'unchanged': 0, 'affected_nodes': 0}
+    
+    def _tree(self, src: int, weights: np.ndarray) -> ShortestPathTree:
+        """重みが最も近い木を差分更新して返す（近い木が無く上限未満なら新しく作る）"""
+        trees = self.trees.setdefault(src, [])
+        if trees:
+            changes = [tree.changed_edges(weights, self.epsilon).size for tree in trees]
+            best = int(np.argmin(changes))
+            if changes[best] == 0 or len(trees) >= self.max_trees:
+                tree = trees[best]
+                if tree.update(weights, self.epsilon):
+                    self.stats['updated'] += 1
+                    self.stats['affected_nodes'] += tree.last_affected
+                else:
+                    self.stats['unchanged'] += 1
+                return tree
+        tree = ShortestPathTree(self.topology, src, weights)
+        trees.append(tree)
+        self.stats['built'] += 1
+        return tree
+    
+    def shortest_path(self, src, dst, weights):
+        result = self._tree(src, weights).path_to(dst)
+        if result is None:
+            return None
+        path, _, edge_ids = result
+        return path, float(weights[edge_ids].sum()), edge_ids
+
+class CandidatePathEngine(PathEngine):
+    """候補経路集合の接続行列と重みベクトルの積による選択（Dijkstraなし）"""
+    
+    name = "candidate"
+    
+    def __init__(self, graph: nx.Graph, config: SRv6Config):
+        super().__init__(graph, config)
+        # {(src, dst): CandidatePathSet}（初回使用時に列挙）
+        self._candidates: Dict[Tuple[int, int], CandidatePathSet] = {}
+    
+    def candidates(self, src: int, dst: int) -> CandidatePathSet:
+        """候補経路集合を取得（未列挙なら列挙）"""
+        candidates = self._candidates.get((src, dst))
+        if candidates is None:
+            candidates = CandidatePathSet(self.graph, src, dst, self.config.candidate_limit)
+            self._candidates[(src, dst)] = candidates
+        return candidates
+    
+    def shortest_path(self, src, dst, weights):
+        candidates = self.candidates(src, dst)
+        if not candidates.paths:
+            return None
+        costs = candidates.score(weights)
+        best = int(np.argmin(costs))
+        path = candidates.paths[best]
+        return path, float(costs[best]), self.path_edges(path)
+
+def compare_path_lists(reference: List[Tuple[List[int], float]], paths: List[Tuple[List[int], float]],
+                       rel_tol: float = 1e-9) -> str:
+    """2つのエンジンの複数経路計算結果を比較
+    
+    Returns:
+        "identical": 全経路一致
+        "tie": コストは一致するが経路が異なる（同コスト経路の選び方の違い。以降の経路は倍率の適用先が
+               変わるため比較しない）
+        "mismatch": コストが異なる（どちらかのエンジンが誤り）
+    """
+    if len(reference) != len(paths):
+        return "mismatch"
+    for (ref_path, ref_cost), (path, cost) in zip(reference, paths):
+        if not math.isclose(ref_cost, cost, rel_tol=rel_tol, abs_tol=1e-12):
+            return "mismatch"
+        if ref_path != path:
+            return "tie"
+    return "identical"
+
+def disjoint_paths(edges: List[Tuple[int, int]], weights: np.ndarray, src: int, dst: int, k: int,
+                   directed: bool = False, node_disjoint: bool = False) -> List[Tuple[List[int], float, List[int]]]:
+    """Suurballe/Bhandari 法による互いに素な経路の組（総コスト最小）
+    
+    単位容量の残余グラフ上で最短経路（負の逆向き弧があるため Bellman-Ford）を k 回増加させ、
+    流量が残ったエッジを経路に分解する。node_disjoint では src/dst 以外のノードを
+    入口・出口に分割し、各ノードを1経路しか通れないようにする。
+    
+    Returns:
+        [(ノードリスト, コスト, 使用エッジ番号リスト), ...]（コスト順、互いに素な経路が k 本無ければ存在する分だけ）
+    """
+    def node_in(n):
+        return (n, 'in') if node_disjoint and n not in (src, dst) else n
+    
+    def node_out(n):
+        return (n, 'out') if node_disjoint and n not in (src, dst) else n
+    
+    # 弧 i の逆向き弧は i ^ 1（順方向は容量1、逆向きは容量0・負のコスト）
+    tails, heads, costs, capacity, arc_edges = [], [], [], [], []
+    adjacency: Dict = {}
+    
+    def add_arc(u, v, cost: float, e: int):
+        for tail, head, c, cap in ((u, v, cost, 1), (v, u, -cost, 0)):
+            adjacency.setdefault(tail, []).append(len(heads))
+            tails.append(tail)
+            heads.append(head)
+            costs.append(c)
+            capacity.append(cap)
+            arc_edges.append(e)
+    
+    if node_disjoint:
+        for n in {n for edge in edges for n in edge} - {src, dst}:
+            add_arc((n, 'in'), (n, 'out'), 0.0, -1)
+    for e, ((u, v), w) in enumerate(zip(edges, weights.tolist())):
+        add_arc(node_out(u), node_in(v), w, e)
+        if not directed:
+            add_arc(node_out(v), node_in(u), w, e)
+    
+    source, target = node_out(src), node_in(dst)
+    if source not in adjacency or target not in adjacency:
+        return []
+    for _ in range(k):
+        # 残余グラフ上の最短経路（キュー版 Bellman-Ford）
+        dist, pred = {source: 0.0}, {}
+        queue, queued = deque([source]), {source}
+        while queue:
+            u = queue.popleft()
+            queued.discard(u)
+            for arc in adjacency[u]:
+                if capacity[arc] == 0:
+                    continue
+                v, nd = heads[arc], dist[u] + costs[arc]
+                if nd < dist.get(v, math.inf) - 1e-15:
+                    dist[v] = nd
+                    pred[v] = arc
+                    if v not in queued:
+                        queue.append(v)
+                        queued.add(v)
+        if target not in dist:
+            break
+        node = target
+        while node != source:
+            arc = pred[node]
+            capacity[arc] -= 1
+            capacity[arc ^ 1] += 1
+            node = tails[arc]
+    
+    # 流量のある順方向の弧（無向グラフで同じエッジを逆向きに流れる分は相殺）
+    flow_arcs = [arc for arc in range(0, len(heads), 2) if capacity[arc] == 0]
+    if not directed:
+        used = {}
+        for arc in flow_arcs:
+            used.setdefault(arc_edges[arc], []).append(arc)
+        flow_arcs = [arc for arc in flow_arcs if arc_edges[arc] == -1 or len(used[arc_edges[arc]]) == 1]
+    outgoing: Dict = {}
+    for arc in flow_arcs:
+        outgoing.setdefault(tails[arc], []).append(arc)
+    
+    paths = []
+    while outgoing.get(source):
+        nodes, edge_ids = [src], []
+        node = source
+        while node != target:
+            arc = outgoing[node].pop()
+            node = heads[arc]
+            if arc_edges[arc] == -1:
+                continue
+            n = node[0] if isinstance(node, tuple) else node
+            # 同コスト（重み0）の閉路を含む場合は取り除く
+            if n in nodes:
+                cut = nodes.index(n)
+                del nodes[cut + 1:]
+                del edge_ids[cut:]
+                continue
+            nodes.append(n)
+            edge_ids.append(arc_edges[arc])
+        paths.append((nodes, float(weights[edge_ids].sum()), edge_ids))
+    paths.sort(key=lambda item: item[1])
+    return paths
+
+def allocate_classes_lp(edges: List[Tuple[int, int]], capacities: np.ndarray, background: np.ndarray,
+                        demands: List[float], src: int, dst: int, directed: bool = False,
+                        weights: Optional[np.ndarray] = None) -> Optional[Tuple[List[Tuple[List[int], List[int]]], float]]:
+    """優先度クラスの多品種フロー割り当て（最大リンク利用率の最小化）
+    
+    各クラスを分割しない1経路に載せる 0-1 整数計画として linprog（HiGHS）で解く。
+        変数: クラス k が弧 a を使うか x[k, a]、最大リンク利用率 t
+        制約: クラスごとのフロー保存（src から1、dst へ1）
+              エッジ e ごとに background[e] + Σ_k demands[k] × x[k, e] ≤ t × capacities[e]
+        目的: t + ε Σ weights × x（最大利用率が同じなら重みの小さい経路を選ぶ）
+    
+    Args:
+        capacities / background: エッジ順の帯域と背景トラフィック（Bytes/s）
+        demands: クラスごとの需要（Bytes/s）
     
+    Returns:
+        ([(ノードリスト, 使用エッジ番号リスト), ...], 最大リンク利用率)。解が無ければ None
+    """
+    if linprog is None:
+        raise ImportError("LP割り当てには scipy が必要です")
+    arcs = [(u, v, e) for e, (u, v) in enumerate(edges)]
+    if not directed:
+        arcs += [(v, u, e) for e, (u, v) in enumerate(edges)]
+    nodes = list(dict.fromkeys(n for edge in edges for n in edge))
+    if src not in nodes or dst not in nodes:
+        return None
+    node_index = {n: i for i, n in enumerate(nodes)}
+    num_classes, num_arcs, num_edges = len(demands), len(arcs), len(edges)
+    num_vars = num_classes * num_arcs + 1
+    t_index = num_vars - 1
+    
+    weights = np.ones(num_edges) if weights is None else np.maximum(weights, 1e-6)
+    arc_weights = np.array([weights[e] for _, _, e in arcs])
+    c = np.zeros(num_vars)
+    c[:t_index] = np.tile(arc_weights, num_classes) * (1e-4 / (1.0 + num_classes * arc_weights.sum()))
+    c[t_index] = 1.0
+    
+    # フロー保存（行: クラス × ノード）
+    A_eq = np.zeros((num_classes * len(nodes), num_vars))
+    b_eq = np.zeros(num_classes * len(nodes))
+    for k in range(num_classes):
+        row = k * len(nodes)
+        for a, (u, v, _) in enumerate(arcs):
+            A_eq[row + node_index[u], k * num_arcs + a] += 1.0
+            A_eq[row + node_index[v], k * num_arcs + a] -= 1.0
+        b_eq[row + node_index[src]] = 1.0
+        b_eq[row + node_index[dst]] = -1.0
+    
+    # 容量（行: エッジ、無向エッジは2方向で帯域を共有）
+    A_ub = np.zeros((num_edges, num_vars))
+    for k, demand in enumerate(demands):
+        for a, (_, _, e) in enumerate(arcs):
+            A_ub[e, k * num_arcs + a] += demand
+    A_ub[:, t_index] = -capacities
+    b_ub = -background
+    
+    bounds = [(0, 1)] * (num_vars - 1) + [(0, None)]
+    integrality = np.ones(num_vars)
+    integrality[t_index] = 0
+    result = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=b_eq, bounds=bounds,
+                     integrality=integrality, method="highs")
+    if result.status != 0:
+        logger.warning(f"LP割り当て失敗: {result.message}")
+        return None
+    
+    allocation = []
+    for k in range(num_classes):
+        used = [a for a in range(num_arcs) if result.x[k * num_arcs + a] > 0.5]
+        outgoing = {arcs[a][0]: a for a in used}
+        path, edge_ids, node = [src], [], src
+        while node != dst and node in outgoing and len(path) <= len(nodes):
+            _, node, e = arcs[outgoing.pop(node)]
+            path.append(node)
+            edge_ids.append(e)
+        if node != dst:
+            return None
+        allocation.append((path, edge_ids))
+    return allocation, float(result.x[t_index])
+
 class PathCalculator:
     """経路計算とSIDリスト生成クラス"""
     
-    def __init__(self, config: SRv6Config):
+    # 経路選択後に使用エッジの重みへ掛ける倍率（高優先度、中優先度、低優先度）
+    WEIGHT_MULTIPLIERS = [3.0, 2.0, 1.0]
+    PATH_ENGINES = {
+        "networkx": NetworkXPathEngine,
+        "scipy": ScipyPathEngine,
+        "array": ArrayPathEngine,
+        "dynamic": DynamicPathEngine,
+        "candidate": CandidatePathEngine,
+    }
+    PATH_MODES = ("multiplier", "edge-disjoint", "node-disjoint", "ksp", "lp")
+    PATH_METRICS = ("shortest", "widest", "widest-shortest", "shortest-widest")
+    
+    def __init__(self, config: SRv6Config, graph: Optional[nx.Graph] = None):
         self.config = config
-        self.graph = nx.Graph()
-        self._create_topology()
+        self.weight_multipliers = list(config.weight_multipliers or self.WEIGHT_MULTIPLIERS)
+        if graph is not None:
+            # 任意のトポロジ（エンジン比較・大規模トポロジの評価用）
+            self.graph = graph
+        else:
+            # 有向モードでは r1→r16 と r16→r1 の負荷を別々の重みとして扱う
+            self.graph = nx.DiGraph() if config.directed else nx.Graph()
+            self._create_topology()
+        
+        # 経路計算エンジン（エッジ順は self.graph.edges() と同じ）
+        self.engine = self.create_engine(config.path_engine)
+        self._candidate_engine = self.engine if isinstance(self.engine, CandidatePathEngine) else None
+        self._ksp_graph = None
+        self._topology = None  # メトリック・制約付き経路計算用（初回使用時に作成）
+        
+        # 最適化したリンク重み（設定時は利用率ベースの重みの代わりに経路計算に使う、graph.edges() 順）
+        self.tuned_weights: Optional[np.ndarray] = None
+        self._tuned_integer_weights = None
+        if config.tuned_weights_path:
+            self.load_tuned_weights(config.tuned_weights_path)
+        self.weight_optimizer = None
+        if config.weight_optimization == "background":
+            if BackgroundWeightOptimizer is None:
+                raise ImportError("リンク重み最適化には weight_optimizer モジュールが必要です")
+            self.weight_optimizer = BackgroundWeightOptimizer()
+        # lp: 前回割り当てたクラス需要のエッジ負荷 {(src, dst, num_paths): Bytes/s ベクトル}（観測値から差し引いて背景トラフィックを推定）
+        # 同じ方向でもクラス数が違う呼び出し（復路の1経路計算と復路テーブル作成）では割り当てた需要が異なるため分けて持つ
+        self._lp_load: Dict[Tuple[int, int, int], np.ndarray] = {}
+    
+    def create_engine(self, name: str) -> PathEngine:
+        """経路計算エンジンを作成"""
+        if name not in self.PATH_ENGINES:
+            raise ValueError(f"未対応の経路計算エンジン: {name}")
+        return self.PATH_ENGINES[name](self.graph, self.config)
     
     def _create_topology(self):
         """ネットワークトポロジ作成（最大帯域幅: 1Gbps = 125,000,000 Bytes/s）"""
@@ -432,67 +1775,415 @@ class PathCalculator:
             (15, 16, {'weight': 0.0001, 'max_bandwidth': max_bandwidth}),
         ]
         self.graph.add_edges_from(edges)
+        if self.graph.is_directed():
+            self.graph.add_edges_from((v, u, dict(data)) for u, v, data in edges)
     
-    def calculate_multiple_paths(self, src: int, dst: int, num_paths: int = 3, verbose: bool = True) -> List[Tuple[List[int], float]]:
+    def edge_weights(self) -> np.ndarray:
+        """現在の重みを graph.edges() 順のベクトルで取得"""
+        return np.fromiter((data['weight'] for _, _, data in self.graph.edges(data=True)),
+                           dtype=np.float64, count=self.graph.number_of_edges())
+    
+    def calculate_multiple_paths(self, src: int, dst: int, num_paths: int = 3, verbose: bool = True,
+                                 engine: Optional[PathEngine] = None,
+                                 mode: Optional[str] = None) -> List[Tuple[List[int], float]]:
         """複数経路計算（利用率ベースのDijkstra法 + 重み倍率適用）
         
         利用率: データ転送量 / 帯域の最大値（0-1の範囲）
-        重み: 利用率を初期値とし、経路選択後に倍率適用（上限なし）
+        重み: 利用率を config.cost_function で変換した値を初期値とし、経路選択後に倍率適用（上限なし）
         
         1つ目の経路（高優先度）: 使用エッジの重みを3倍
         2つ目の経路（中優先度）: 使用エッジの重みを2倍
         3つ目の経路（低優先度）: そのまま
+        （倍率は config.weight_multipliers で変更可能）
+        
+        mode（省略時は config.path_mode）が edge-disjoint / node-disjoint / ksp / lp の場合は
+        倍率の代わりにそれぞれの方式で経路の組を選ぶ。
         
         Args:
             src: 送信元ノード
             dst: 宛先ノード
             num_paths: 計算する経路数
             verbose: 詳細ログを出力するか（Falseで復路の出力を抑制）
+            engine: 使用するエンジン（省略時は config.path_engine）
+            mode: 経路の選び方（PATH_MODES のいずれか）
         """
-        paths = []
-        temp_graph = self.graph.copy()
+        engine = engine or self.engine
+        mode = mode or self.config.path_mode
+        weights = self.edge_weights() if self.tuned_weights is None else self.tuned_weights.copy()
+        if mode == "multiplier":
+            residual = self.residual_capacity() if any(m != "shortest" for m in self.config.table_metrics or []) else None
+            return self._select_paths(engine, src, dst, num_paths, weights, verbose, residual=residual)
+        if mode in ("edge-disjoint", "node-disjoint"):
+            return self._select_disjoint_paths(engine, src, dst, num_paths, weights, verbose,
+                                               node_disjoint=(mode == "node-disjoint"))
+        if mode == "ksp":
+            return self._select_ksp_paths(engine, src, dst, num_paths, weights, verbose)
+        if mode == "lp":
+            return self._select_lp_paths(engine, src, dst, num_paths, weights, verbose)
+        raise ValueError(f"未対応の経路選択方式: {mode}")
+    
+    def load_tuned_weights(self, path: str):
+        """オフラインで最適化した重みを読み込む（トポロジに無いエッジがあれば ValueError）"""
+        if load_weights is None:
+            raise ImportError("最適化した重みの読み込みには weight_optimizer モジュールが必要です")
+        tuned = load_weights(path)
+        reverse = not self.graph.is_directed()
+        try:
+            self.tuned_weights = np.array([tuned[(u, v)] if (u, v) in tuned or not reverse else tuned[(v, u)]
+                                           for u, v in self.graph.edges()], dtype=np.float64)
+        except KeyError as e:
+            raise ValueError(f"最適化した重みにエッジ {e} がありません: {path}")
+        logger.info(f"最適化したリンク重みを使用: {path}")
+    
+    def refresh_tuned_weights(self, observed: Optional[np.ndarray], src: int = 1, dst: int = 16) -> bool:
+        """バックグラウンド最適化の結果を反映し、最新の観測レートで次の最適化を開始（待たない）
+        
+        新しいサンプルが無いサイクルでも呼び、完了した結果を経路計算に反映させる
+        
+        Args:
+            observed: graph.edges() 順の観測レート（Bytes/s）。None の場合は結果の反映のみ
+        
+        Returns:
+            最適化した重みが変わったか（True の場合は経路を再計算する）
+        """
+        if self.weight_optimizer is None:
+            return False
+        if WeightProblem is None:
+            raise ImportError("リンク重み最適化には weight_optimizer モジュールが必要です")
+        changed = False
+        result = self.weight_optimizer.poll()
+        if result is not None:
+            changed = self.tuned_weights is None or not np.array_equal(self.tuned_weights, result.weights)
+            self.tuned_weights = result.weights
+            self._tuned_integer_weights = result.integer_weights
+            logger.info(f"リンク重み最適化: 最大リンク利用率 {result.initial_max_utilization:.4f} → "
+                        f"{result.max_utilization:.4f} (評価 {result.evaluations}回, {result.elapsed:.2f}秒)")
+        if observed is None or self.weight_optimizer.busy:
+            return changed
+        
+        edges = list(self.graph.edges())
+        current = self.edge_weights() if self.tuned_weights is None else self.tuned_weights
+        problem = WeightProblem(
+            edges=edges,
+            capacities=[self.graph[u][v].get('max_bandwidth', 125_000_000) for u, v in edges],
+            observed=np.nan_to_num(observed).tolist(),
+            demands=self.class_demands(src),
+            pairs=[(src, dst)] + ([(dst, src)] if self.graph.is_directed() else []),
+            directed=self.graph.is_directed(),
+            multipliers=list(self.weight_multipliers),
+            current_weights=current.tolist(),
+            initial=None if self._tuned_integer_weights is None else self._tuned_integer_weights.tolist(),
+            max_weight=self.config.optimizer_max_weight,
+            iterations=self.config.optimizer_iterations,
+            time_limit=self.config.optimizer_time_limit
+        )
+        self.weight_optimizer.submit(problem)
+        return changed
+    
+    def close(self):
+        """バックグラウンド最適化のワーカーを停止"""
+        if self.weight_optimizer is not None:
+            self.weight_optimizer.close()
+            self.weight_optimizer = None
+    
+    def _log_path(self, i: int, path: List[int], cost: float, edge_ids: List[int], weights: np.ndarray):
+        """選択した経路と各エッジのコストをログ出力"""
+        logger.info(f"経路{i+1}（優先度: {['高', '中', '低'][i] if i < 3 else '---'}）: "
+                   f"{' → '.join([f'r{n}' for n in path])} (総コスト: {cost:.6f})")
+        
+        # 各エッジのコスト詳細を出力
+        for (u, v), e in zip(zip(path, path[1:]), edge_ids):
+            logger.info(f"  Edge r{u}-r{v}: コスト={weights[e]:.6f}")
+    
+    def compiled_topology(self) -> "CompiledTopology":
+        """メトリック・制約付き経路計算用の配列トポロジ（エッジ順は graph.edges() と同じ）"""
+        if self._topology is None:
+            if CompiledTopology is None:
+                raise ImportError("メトリック・制約付きの経路計算には compiled_topology モジュールが必要です")
+            self._topology = CompiledTopology.from_networkx(self.graph)
+        return self._topology
+    
+    def link_utilization(self) -> np.ndarray:
+        """エッジごとの観測利用率（graph.edges() 順）"""
+        return np.fromiter((data.get('utilization', 0.0) for _, _, data in self.graph.edges(data=True)),
+                           dtype=np.float64, count=self.graph.number_of_edges())
+    
+    def residual_capacity(self) -> np.ndarray:
+        """エッジごとの残余帯域（Bytes/s、帯域 × (1 - 観測利用率)、graph.edges() 順）"""
+        capacities = np.array([data.get('max_bandwidth', 125_000_000) for _, _, data in self.graph.edges(data=True)],
+                              dtype=np.float64)
+        return capacities * (1.0 - self.link_utilization())
+    
+    def table_constraint(self, i: int) -> Dict:
+        """i 番目のテーブルの経路制約（制約なしは空の dict）"""
+        constraints = self.config.class_constraints or []
+        return {k: v for k, v in constraints[i].items() if v is not None} if i < len(constraints) else {}
+    
+    def constrained_path(self, metric: str, src: int, dst: int, weights: np.ndarray,
+                         residual: Optional[np.ndarray], constraint: Dict) -> Optional[Tuple[List[int], float, List[int]]]:
+        """CSPF: 利用率上限を超えるリンクを除外し、ホップ数上限以下の経路を選ぶ（条件を満たす経路が無ければ None）
         
-        # 重み倍率の定義（優先度ごと）
-        weight_multipliers = [3.0, 2.0, 1.0]  # 高優先度、中優先度、低優先度
+        shortest 以外のメトリックは除外後のトポロジで計算し、ホップ数上限を超えた場合は
+        ホップ数制約付きの最短経路に切り替える。
+        """
+        topology = self.compiled_topology()
+        ceiling = constraint.get("max_utilization")
+        max_hops = constraint.get("max_hops")
+        pruned = self.link_utilization() > ceiling if ceiling is not None else np.zeros(weights.size, dtype=bool)
+        masked = np.where(pruned, np.inf, weights)
         
-        for i in range(num_paths):
+        result = None
+        if metric != "shortest" and residual is not None:
+            result = self.metric_path(metric, src, dst, masked, np.where(pruned, -np.inf, residual))
+            if result is not None and max_hops is not None and len(result[2]) > max_hops:
+                result = None
+        if result is None:
+            if max_hops is not None:
+                result = topology.hop_limited_path(src, dst, max_hops, masked)
+            else:
+                result = topology.shortest_path(src, dst, masked)
+        if result is None:
+            return None
+        path, _, edge_ids = result
+        return path, float(weights[edge_ids].sum()), edge_ids
+    
+    def table_metric(self, i: int) -> str:
+        """i 番目のテーブルの経路メトリック"""
+        metrics = self.config.table_metrics or []
+        return metrics[i] if i < len(metrics) else "shortest"
+    
+    def metric_path(self, metric: str, src: int, dst: int, weights: np.ndarray,
+                    residual: np.ndarray) -> Optional[Tuple[List[int], float, List[int]]]:
+        """ボトルネックを考慮したメトリックの経路（コストは weights の和）"""
+        topology = self.compiled_topology()
+        if metric == "widest":
+            result = topology.widest_path(src, dst, residual)
+        elif metric == "shortest-widest":
+            result = topology.widest_path(src, dst, residual, weights)
+        elif metric == "widest-shortest":
+            result = topology.widest_shortest_path(src, dst, weights, residual)
+        else:
+            raise ValueError(f"未対応の経路メトリック: {metric}")
+        if result is None:
+            return None
+        path, _, edge_ids = result
+        return path, float(weights[edge_ids].sum()), edge_ids
+    
+    def _select_paths(self, engine: PathEngine, src: int, dst: int, num_paths: int,
+                      weights: np.ndarray, verbose: bool = True, first: int = 0,
+                      residual: Optional[np.ndarray] = None) -> List[Tuple[List[int], float]]:
+        """重みベクトル weights（呼び出し側のコピー、倍率適用で書き換える）から複数経路を選択
+        
+        first: 何番目の経路から選ぶか（それより前の経路の倍率は呼び出し側で適用済み）
+        residual: 残余帯域（指定時は table_metrics のメトリックで選択。倍率は残余帯域を割る形でも適用）
+        """
+        paths = []
+        
+        for i in range(first, first + num_paths):
+            metric = self.table_metric(i) if residual is not None else "shortest"
+            constraint = self.table_constraint(i)
             try:
-                # Dijkstra法で最短経路計算（重みは利用率ベース）
-                path = nx.shortest_path(temp_graph, src, dst, weight='weight')
-                cost = nx.shortest_path_length(temp_graph, src, dst, weight='weight')
-                paths.append((path, cost))
-                
-                if verbose:
-                    logger.info(f"経路{i+1}（優先度: {['高', '中', '低'][i] if i < 3 else '---'}）: "
-                               f"{' → '.join([f'r{n}' for n in path])} (総コスト: {cost:.6f})")
-                    
-                    # 各エッジのコスト詳細を出力
-                    for j in range(len(path) - 1):
-                        u, v = path[j], path[j + 1]
-                        if temp_graph.has_edge(u, v):
-                            edge_cost = temp_graph[u][v]['weight']
-                            logger.info(f"  Edge r{u}-r{v}: コスト={edge_cost:.6f}")
-                
-                # 次の経路のために使用したエッジの重みを増加
-                if i < num_paths - 1 and i < len(weight_multipliers):
-                    multiplier = weight_multipliers[i]
-                    for j in range(len(path) - 1):
-                        u, v = path[j], path[j + 1]
-                        if temp_graph.has_edge(u, v):
-                            old_weight = temp_graph[u][v]['weight']
-                            new_weight = old_weight * multiplier  # 上限なし
-                            temp_graph[u][v]['weight'] = new_weight
-                            logger.debug(f"  Edge r{u}-r{v}: {old_weight:.4f} → {new_weight:.4f} ({multiplier}倍)")
-                            
-            except nx.NetworkXNoPath:
-                logger.warning(f"経路{i+1}の計算失敗: 経路が存在しません")
-                break
+                result = None
+                if constraint:
+                    result = self.constrained_path(metric, src, dst, weights, residual, constraint)
+                    if result is None:
+                        logger.warning(f"経路{i+1}: 制約 {constraint} を満たす経路が無いため制約なしで選択します")
+                if result is None and metric == "shortest":
+                    # 最短経路計算（重みは利用率ベース）
+                    result = engine.shortest_path(src, dst, weights)
+                elif result is None:
+                    result = self.metric_path(metric, src, dst, weights, residual)
             except Exception as e:
                 logger.error(f"経路計算エラー: {e}")
                 break
+            if result is None:
+                logger.warning(f"経路{i+1}の計算失敗: 経路が存在しません")
+                break
+            path, cost, edge_ids = result
+            paths.append((path, cost))
+            
+            if verbose:
+                self._log_path(i, path, cost, edge_ids, weights)
+                if residual is not None:
+                    logger.info(f"  メトリック: {metric}, ボトルネック残余帯域: "
+                                f"{residual[edge_ids].min() * 8 / 1e6:.1f} Mbps")
+            
+            # 次の経路のために使用したエッジの重みを増加（上限なし）
+            if i < first + num_paths - 1 and i < len(self.weight_multipliers):
+                weights[edge_ids] *= self.weight_multipliers[i]
+                if residual is not None:
+                    residual[edge_ids] /= self.weight_multipliers[i]
+        
+        return paths
+    
+    def _select_disjoint_paths(self, engine: PathEngine, src: int, dst: int, num_paths: int,
+                               weights: np.ndarray, verbose: bool = True,
+                               node_disjoint: bool = False) -> List[Tuple[List[int], float]]:
+        """互いに素な経路の組（Suurballe/Bhandari）をコスト順に各テーブルへ割り当て
+        
+        素な経路がテーブル数より少ない場合（r1・r16 はリンクが2本のため最大2本）、残りのテーブルは
+        選択済み経路に倍率を適用した重みで、倍率方式と同じく最短経路を選ぶ。
+        """
+        try:
+            selected = disjoint_paths(engine.edges, weights, src, dst, num_paths,
+                                      directed=self.graph.is_directed(), node_disjoint=node_disjoint)
+        except Exception as e:
+            logger.error(f"経路計算エラー: {e}")
+            return []
+        
+        paths = []
+        for i, (path, cost, edge_ids) in enumerate(selected):
+            paths.append((path, cost))
+            if verbose:
+                self._log_path(i, path, cost, edge_ids, weights)
+            if i < len(self.weight_multipliers):
+                weights[edge_ids] *= self.weight_multipliers[i]
+        
+        if paths and len(paths) < num_paths:
+            if verbose:
+                logger.info(f"{'ノード' if node_disjoint else 'リンク'}素な経路は{len(paths)}本のみ: "
+                            f"残り{num_paths - len(paths)}本は重み倍率で選択")
+            paths += self._select_paths(engine, src, dst, num_paths - len(paths), weights, verbose, first=len(paths))
+        return paths
+    
+    def _select_ksp_paths(self, engine: PathEngine, src: int, dst: int, num_paths: int,
+                          weights: np.ndarray, verbose: bool = True) -> List[Tuple[List[int], float]]:
+        """Yen の k 最短経路から、既選択経路との重複にペナルティを掛けたコストが最小の経路を順に選択
+        
+        評価コスト = Σ 重み × (1 + ksp_overlap_penalty × そのエッジを使う既選択経路数)
+        """
+        if self._ksp_graph is None:
+            self._ksp_graph = self.graph.copy()
+        for (u, v), weight in zip(engine.edges, weights.tolist()):
+            self._ksp_graph[u][v]['weight'] = weight
+        try:
+            candidates = [(path, engine.path_edges(path)) for path in itertools.islice(
+                nx.shortest_simple_paths(self._ksp_graph, src, dst, weight='weight'), self.config.ksp_candidates)]
+        except (nx.NetworkXNoPath, nx.NodeNotFound) as e:
+            logger.warning(f"経路1の計算失敗: {e}")
+            return []
+        
+        uses = np.zeros(weights.size)
+        paths = []
+        for i in range(min(num_paths, len(candidates))):
+            penalized = weights * (1.0 + self.config.ksp_overlap_penalty * uses)
+            best = min(range(len(candidates)), key=lambda j: penalized[candidates[j][1]].sum())
+            path, edge_ids = candidates.pop(best)
+            cost = float(weights[edge_ids].sum())
+            paths.append((path, cost))
+            if verbose:
+                self._log_path(i, path, cost, edge_ids, weights)
+            uses[edge_ids] += 1
+        return paths
+    
+    def class_demands(self, src: int) -> List[float]:
+        """クラスごとの需要推定（Bytes/s、テーブル順）
+        
+        config.class_demands（Mbps）が未設定の場合は src のリンクの観測トラフィック合計を
+        クラス数で等分する（経路を分散させるため1クラスあたり最低 1Mbps）。
+        """
+        if self.config.class_demands:
+            return [mbps * 125_000 for mbps in self.config.class_demands]
+        observed = sum(data.get('utilization', 0.0) * data.get('max_bandwidth', 125_000_000)
+                       for _, _, data in self.graph.edges(src, data=True))
+        num_classes = len(self.config.tables)
+        return [max(observed / num_classes, 125_000)] * num_classes
+    
+    def _select_lp_paths(self, engine: PathEngine, src: int, dst: int, num_paths: int,
+                         weights: np.ndarray, verbose: bool = True) -> List[Tuple[List[int], float]]:
+        """クラスごとの需要を多品種フロー（allocate_classes_lp）で1経路ずつ割り当て
+        
+        背景トラフィック = 観測レート − 前回このクラス群に割り当てた需要（0未満は0）。
+        解けない場合は重み倍率方式で選ぶ。
+        """
+        edges = engine.edges
+        capacities = np.array([self.graph[u][v].get('max_bandwidth', 125_000_000) for u, v in edges], dtype=np.float64)
+        observed = np.array([self.graph[u][v].get('utilization', 0.0) for u, v in edges]) * capacities
+        previous = self._lp_load.get((src, dst, num_paths))
+        background = observed if previous is None else np.maximum(observed - previous, 0.0)
+        demands = self.class_demands(src)[:num_paths]
         
+        try:
+            result = allocate_classes_lp(edges, capacities, background, demands, src, dst,
+                                         directed=self.graph.is_directed(), weights=weights)
+        except Exception as e:
+            logger.error(f"LP割り当てエラー: {e}")
+            result = None
+        if result is None:
+            logger.warning("LP割り当てができないため重み倍率方式で経路を選択します")
+            return self._select_paths(engine, src, dst, num_paths, weights, verbose)
+        
+        allocation, max_utilization = result
+        load = np.zeros(len(edges))
+        paths = []
+        for i, (path, edge_ids) in enumerate(allocation):
+            load[edge_ids] += demands[i]
+            cost = float(weights[edge_ids].sum())
+            paths.append((path, cost))
+            if verbose:
+                self._log_path(i, path, cost, edge_ids, weights)
+        self._lp_load[(src, dst, num_paths)] = load
+        if verbose:
+            logger.info(f"LP割り当て: 需要 {', '.join(f'{d * 8 / 1e6:.1f}' for d in demands)} Mbps, "
+                        f"最大リンク利用率 {max_utilization:.4f}")
+            if max_utilization > 1.0:
+                logger.warning("最大リンク利用率が1を超えています（需要が帯域を超過）")
         return paths
     
+    def rank_paths(self, src: int, dst: int) -> List[Tuple[List[int], float]]:
+        """全候補経路を現在の重みでのコスト順に返す（分析用）"""
+        if self._candidate_engine is None:
+            self._candidate_engine = CandidatePathEngine(self.graph, self.config)
+        return self._candidate_engine.candidates(src, dst).ranked(self.edge_weights())
+    
+    def compare_engines(self, pairs: List[Tuple[int, int]], engine_names: Optional[List[str]] = None,
+                        num_paths: int = 3, trials: int = 0, seed: int = 0) -> Dict[str, Dict]:
+        """各エンジンを同じ重みで実行し、結果と処理時間を比較
+        
+        現在の重みに加えて、trials 回のランダムな重み（同コスト経路がほぼ生じない）でも比較する。
+        結果の判定は compare_path_lists（先頭のエンジンを基準）。
+        
+        Returns:
+            {エンジン名: {"identical", "tie", "mismatch", "runs", "mean_us"}}
+        """
+        current = self.edge_weights()
+        engines = {}
+        for name in engine_names or list(self.PATH_ENGINES):
+            try:
+                engine = self.create_engine(name)
+                # 初回呼び出し（候補経路の列挙など）は計測から除外
+                for src, dst in pairs:
+                    engine.shortest_path(src, dst, current.copy())
+                engines[name] = engine
+            except (ImportError, ValueError) as e:
+                logger.warning(f"エンジン {name} を比較から除外: {e}")
+        
+        rng = np.random.default_rng(seed)
+        weight_sets = [current] + [rng.uniform(0.0001, 1.0, current.size) for _ in range(trials)]
+        results = {name: {"identical": 0, "tie": 0, "mismatch": 0, "runs": 0, "total_time": 0.0}
+                   for name in engines}
+        
+        for weights in weight_sets:
+            for src, dst in pairs:
+                reference = None
+                for name, engine in engines.items():
+                    start_time = time.perf_counter()
+                    paths = self._select_paths(engine, src, dst, num_paths, weights.copy(), verbose=False)
+                    results[name]["total_time"] += time.perf_counter() - start_time
+                    results[name]["runs"] += 1
+                    if reference is None:
+                        reference = paths
+                        results[name]["identical"] += 1
+                        continue
+                    verdict = compare_path_lists(reference, paths)
+                    results[name][verdict] += 1
+                    if verdict == "mismatch":
+                        logger.error(f"エンジン不一致 ({name}, r{src} → r{dst}): 基準 {reference} / {name} {paths}")
+        
+        for result in results.values():
+            result["mean_us"] = result.pop("total_time") / result["runs"] * 1e6 if result["runs"] else 0.0
+        return results
+    
     def path_to_sid_list(self, path: List[int], is_return: bool = False) -> Tuple[List[str], List[str], str]:
         """経路をSIDリストに変換"""
         segment_map = self.config.return_segments if is_return else self.config.forward_segments
@@ -511,19 +2202,23 @@ class PathCalculator:
 class TopologyVisualizer:
     """ネットワークトポロジ可視化クラス"""
     
-    def __init__(self, graph: nx.Graph, output_dir: str = "/opt/app/visualization"):
-        self.graph = graph
+    def __init__(self, graph: nx.Graph, output_dir: str = "/opt/app/visualization", clock=None,
+                 history_dir: Optional[str] = None):
+        # CompiledTopology が渡された場合は描画のたびに現在の重みで NetworkX へ変換する
+        self.topology = graph if CompiledTopology is not None and isinstance(graph, CompiledTopology) else None
+        self.graph = graph.to_networkx() if self.topology is not None else graph
         self.output_dir = output_dir
         self.fig = None
         self.ax = None
         self.pos = None
         
-        # 経過時間追跡用
-        self.start_time = time.time()
+        # 経過時間追跡用（clock: 現在時刻を返す関数。リプレイ時は仮想時刻）
+        self.clock = clock or time.time
+        self.start_time = self.clock()
         self.elapsed_minutes = 0
         
-        # 履歴保存用ディレクトリ（設定変数から参照）
-        self.history_dir = os.path.join(output_dir, HISTORY_SAVE_DIR)
+        # 履歴保存用ディレクトリ（未指定時は設定変数から参照）
+        self.history_dir = history_dir or os.path.join(output_dir, HISTORY_SAVE_DIR)
         
         # 出力ディレクトリの作成
         os.makedirs(self.output_dir, exist_ok=True)
@@ -556,6 +2251,8 @@ class TopologyVisualizer:
             paths: [(経路ノードリスト, コスト), ...] の形式のリスト（最大3つ）
             update_count: 更新回数
         """
+        if self.topology is not None:
+            self.graph = self.topology.to_networkx()
         self.ax.clear()
         
         # ノードの描画
@@ -575,9 +2272,12 @@ class TopologyVisualizer:
             ax=self.ax
         )
         
+        # 有向グラフは往復の辺が重なるため、描画には無向の骨格を使う
+        draw_graph = nx.Graph(self.graph.edges()) if self.graph.is_directed() else self.graph
+        
         # 全エッジの描画（グレー、細線）
         nx.draw_networkx_edges(
-            self.graph, self.pos,
+            draw_graph, self.pos,
             edge_color='gray',
             width=1,
             alpha=0.3,
@@ -586,15 +2286,22 @@ class TopologyVisualizer:
         
         # エッジの重み（利用率）をラベルとして表示
         edge_labels = {}
-        for u, v in self.graph.edges():
-            weight = self.graph[u][v].get('weight', 0.0)
-            # 利用率のみを表示
-            edge_labels[(u, v)] = f'U:{weight:.4f}'
+        for u, v in draw_graph.edges():
+            if self.graph.is_directed():
+                # 方向別の利用率を両方表示
+                a, b = min(u, v), max(u, v)
+                forward_weight = self.graph[a][b].get('weight', 0.0)
+                backward_weight = self.graph[b][a].get('weight', 0.0)
+                edge_labels[(u, v)] = f'{a}→{b}:{forward_weight:.4f}\n{b}→{a}:{backward_weight:.4f}'
+            else:
+                weight = self.graph[u][v].get('weight', 0.0)
+                # 利用率のみを表示
+                edge_labels[(u, v)] = f'U:{weight:.4f}'
         
         nx.draw_networkx_edge_labels(
-            self.graph, self.pos,
+            draw_graph, self.pos,
             edge_labels=edge_labels,
-            font_size=10,
+            font_size=10 if not self.graph.is_directed() else 8,
             ax=self.ax
         )
         
@@ -622,7 +2329,7 @@ class TopologyVisualizer:
                 path_str = " -> ".join([f"r{n}" for n in path_nodes])
                 avg_edge_cost = sum(edge_costs) / len(edge_costs) if edge_costs else 0.0
                 nx.draw_networkx_edges(
-                    self.graph, self.pos,
+                    draw_graph, self.pos,
                     edgelist=path_edges,
                     edge_color=colors[idx],
                     width=widths[idx],
@@ -632,10 +2339,11 @@ class TopologyVisualizer:
                 )
         
         # タイトルと凡例
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        now = self.clock()
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
         
         # 経過時間の計算（分単位）
-        self.elapsed_minutes = int((time.time() - self.start_time) / 60)
+        self.elapsed_minutes = int((now - self.start_time) / 60)
         
         # 経過時間を図の上部に表示
         elapsed_text = f"Elapsed: {self.elapsed_minutes} minute{'s' if self.elapsed_minutes != 1 else ''}"
@@ -671,10 +2379,29 @@ class SSHConnectionManager:
     
     def __init__(self, config: SRv6Config):
         self.config = config
+        self.pool = None
+        self.batch_sessions = {}  # stream: ホストごとの常駐 ip -batch セッション
+        if config.ssh_pool and shared_pool is not None:
+            self.pool = shared_pool(
+                port=config.ssh_port,
+                username=config.ssh_user,
+                password=config.ssh_password,
+                timeout=config.timeout,
+                keepalive=config.ssh_keepalive
+            )
     
     @contextmanager
     def connection(self, host: str):
-        """SSH接続コンテキストマネージャー"""
+        """SSH接続コンテキストマネージャー（接続プール有効時は閉じずにプールへ戻す）"""
+        if self.pool is not None:
+            try:
+                with self.pool.connection(host) as client:
+                    yield client
+            except Exception as e:
+                logger.error(f"SSH接続エラー ({host}): {e}")
+                raise
+            return
+        
         client = paramiko.SSHClient()
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         
@@ -711,7 +2438,10 @@ class SSHConnectionManager:
     def execute_command(self, client: paramiko.SSHClient, command: str) -> Tuple[int, str, str]:
         """SSHコマンド実行"""
         try:
-            stdin, stdout, stderr = client.exec_command(command)
+            if self.pool is not None:
+                stdin, stdout, stderr = self.pool.exec_command(client, command)
+            else:
+                stdin, stdout, stderr = client.exec_command(command)
             rc = stdout.channel.recv_exit_status()
             out = stdout.read().decode('utf-8').strip()
             err = stderr.read().decode('utf-8').strip()
@@ -719,6 +2449,127 @@ class SSHConnectionManager:
         except Exception as e:
             logger.error(f"コマンド実行エラー: {e}")
             return 1, "", str(e)
+    
+    def execute_batch(self, client: paramiko.SSHClient, commands: List[str]) -> Tuple[int, List["BatchLineResult"]]:
+        """ip -batch で複数コマンドを1チャネルで実行し、行ごとの結果を返す
+        
+        commands は "ip -6" を除いた形（例: "route add ..."）。-force で失敗行があっても残りを実行する
+        末尾に必ず失敗する番兵行を付け、その失敗行が出力された場合のみ最後まで実行されたとみなす
+        （ip は引数エラーでも終了コード 1 で終了するため、終了コードでは判別できない）
+        """
+        try:
+            if self.pool is not None:
+                stdin, stdout, stderr = self.pool.exec_command(client, IP_BATCH_COMMAND)
+            else:
+                stdin, stdout, stderr = client.exec_command(IP_BATCH_COMMAND)
+            stdin.write("".join(f"{command}\n" for command in commands) + f"{BATCH_SENTINEL_COMMAND}\n")
+            stdin.flush()
+            stdin.channel.shutdown_write()
+            rc = stdout.channel.recv_exit_status()
+            stdout.read()
+            err = stderr.read().decode('utf-8')
+        except Exception as e:
+            logger.error(f"バッチ実行エラー: {e}")
+            return 1, [BatchLineResult(i, command, False, str(e)) for i, command in enumerate(commands, start=1)]
+        results = parse_batch_results(commands, err)
+        return (0 if all(result.success for result in results) else 1), results
+    
+    def stream_batch(self, host: str, commands: List[str]) -> Tuple[int, List["BatchLineResult"]]:
+        """ルーターに常駐させた ip -batch プロセスへ流し込み、行ごとの結果を返す
+        
+        接続プールか ip_batch_session が使えない場合は execute_batch（1回ごとに ip を起動）で実行する
+        """
+        if self.pool is None or IPBatchSession is None:
+            with self.connection(host) as client:
+                return self.execute_batch(client, commands)
+        
+        session = self.batch_sessions.get(host)
+        if session is None:
+            session = self.batch_sessions[host] = IPBatchSession(self.pool, host, timeout=self.config.stream_timeout)
+        try:
+            completed, errors, trailing_error = session.execute(commands)
+        except Exception as e:
+            logger.error(f"ip -batch セッションエラー ({host}): {e}")
+            session.close()
+            return 1, [BatchLineResult(i, command, False, str(e)) for i, command in enumerate(commands, start=1)]
+        if not completed:
+            logger.warning(f"ip -batch プロセスが途中で終了しました ({host}): {trailing_error}")
+        return (0 if completed and not errors else 1), batch_line_results(commands, errors, completed, trailing_error)
+    
+    def reconnect_count(self, host: str) -> int:
+        """ホストへの再接続と常駐 ip -batch の再起動の回数（増えた場合はルーター側の状態が変わった可能性がある）"""
+        count = self.pool.reconnect_count(host) if self.pool is not None else 0
+        session = self.batch_sessions.get(host)
+        if session is not None:
+            count += session.stats['restarts']
+        return count
+    
+    def close(self):
+        """常駐 ip -batch セッションと接続プールの全接続を閉じる"""
+        for host, session in self.batch_sessions.items():
+            logger.info(f"ip -batch セッション ({host}): 起動 {session.stats['starts']}回, "
+                        f"再起動 {session.stats['restarts']}回, バッチ {session.stats['batches']}回")
+            session.close()
+        self.batch_sessions = {}
+        if self.pool is not None and self.pool.stats['connects']:
+            logger.info(f"SSH接続プール: 新規接続 {self.pool.stats['connects']}回, "
+                        f"再利用 {self.pool.stats['reuses']}回, 再接続 {self.pool.stats['reconnects']}回")
+            self.pool.close_all()
+
+# ip -batch の失敗行（iproute2 は -force 指定時に失敗した行ごとに "Command failed -:行番号" を出力）
+IP_BATCH_COMMAND = "ip -6 -force -batch -"
+# スクリプト末尾の番兵行（存在しないオブジェクト名のため必ず失敗し、その行番号で最後まで実行されたことが分かる）
+BATCH_SENTINEL_COMMAND = "batch-sentinel"
+BATCH_FAILURE_PATTERN = re.compile(r'^Command failed (\S+):(\d+)$')
+
+# フォールスルーカウンタ: postrouting でマーク付きのまま宛先プレフィックス宛て（= SRv6 でカプセル化されず
+# メインテーブルで転送された）パケットをテーブルごとに数える。カプセル化済みの外側ヘッダの宛先は SID のため数えない
+FALLTHROUGH_CHAIN = "srv6_fallthrough"
+FALLTHROUGH_PATTERN = re.compile(r'counter packets (\d+) bytes \d+ comment "srv6-fallthrough (\S+)"')
+
+@dataclass
+class BatchLineResult:
+    """ip -batch スクリプト1行ごとの実行結果"""
+    line: int          # スクリプト内の行番号（1始まり）
+    command: str
+    success: bool
+    error: str = ""
+
+def batch_line_results(commands: List[str], errors: Dict[int, str], completed: bool = True,
+                       trailing_error: str = "") -> List[BatchLineResult]:
+    """失敗行ごとのエラーから行ごとの結果を作る
+    
+    completed=False（引数エラーなどで ip 自体が途中で終了した場合）は、最後の失敗行より後の行は
+    実行されたか分からないため失敗扱いにする
+    """
+    last_failure = max(errors, default=0)
+    results = []
+    for i, command in enumerate(commands, start=1):
+        if i in errors:
+            results.append(BatchLineResult(i, command, False, errors[i]))
+        elif completed or i < last_failure:
+            results.append(BatchLineResult(i, command, True))
+        else:
+            results.append(BatchLineResult(i, command, False, trailing_error or "ip が途中で終了したため未確認"))
+    return results
+
+def parse_batch_results(commands: List[str], stderr: str) -> List[BatchLineResult]:
+    """ip -force -batch の標準エラー出力を行ごとの結果に対応付ける
+    
+    エラーメッセージ（"RTNETLINK answers: ..." など）は直後の "Command failed -:N" の行 N に属する。
+    スクリプトは commands の後に番兵行が続く前提で、番兵行の失敗が無ければ ip が途中で終了したとみなす
+    """
+    errors = {}
+    pending = []
+    for text in stderr.splitlines():
+        match = BATCH_FAILURE_PATTERN.match(text.strip())
+        if match:
+            errors[int(match.group(2))] = "; ".join(pending) or "失敗"
+            pending = []
+        elif text.strip():
+            pending.append(text.strip())
+    completed = errors.pop(len(commands) + 1, None) is not None
+    return batch_line_results(commands, errors, completed, "; ".join(pending))
 
 @dataclass
 class TableRoute:
@@ -745,6 +2596,52 @@ class PathChangeEvent:
     new_interface: str
     reason: str
     
+def detect_route_changes(current_routes: Dict[str, TableRoute], new_routes: List[TableRoute],
+                         timestamp: Optional[str] = None) -> List[PathChangeEvent]:
+    """現在のテーブル経路 {テーブル名: TableRoute} と新しい経路を比較して変更を検出"""
+    changes = []
+    timestamp = timestamp or time.strftime('%Y-%m-%d %H:%M:%S')
+    
+    for new_route in new_routes:
+        table_name = new_route.table_name
+        old_route = current_routes.get(table_name)
+        
+        if old_route is None:
+            # 初回設定
+            changes.append(PathChangeEvent(
+                timestamp=timestamp,
+                table_name=table_name,
+                old_path=None,
+                new_path=new_route.path,
+                old_segments=None,
+                new_segments=new_route.segments,
+                old_interface=None,
+                new_interface=new_route.output_interface,
+                reason="初回設定"
+            ))
+        elif (old_route.path != new_route.path or 
+              old_route.output_interface != new_route.output_interface):
+            # 経路またはインターフェース変更
+            reason = []
+            if old_route.path != new_route.path:
+                reason.append("経路変更")
+            if old_route.output_interface != new_route.output_interface:
+                reason.append("出力IF変更")
+            
+            changes.append(PathChangeEvent(
+                timestamp=timestamp,
+                table_name=table_name,
+                old_path=old_route.path,
+                new_path=new_route.path,
+                old_segments=old_route.segments,
+                new_segments=new_route.segments,
+                old_interface=old_route.output_interface,
+                new_interface=new_route.output_interface,
+                reason="負荷変動による" + "・".join(reason)
+            ))
+    
+    return changes
+
 class RoutingTableManager:
     """ルーティングテーブル管理クラス"""
     
@@ -752,6 +2649,27 @@ class RoutingTableManager:
         self.config = config
         self.ssh_manager = ssh_manager
         self.path_calculator = path_calculator
+        
+        # 切り替え時の損失計測（measure_switch_loss 有効時）
+        self.switch_stats = {
+            'measured': 0,          # 計測したテーブル更新回数（ルーター単位）
+            'lossy': 0,             # フォールスルーが発生した回数
+            'fallthrough': 0,       # 更新中にメインテーブルへ落ちたマーク付きパケット数の合計
+            'by_table': {},         # テーブルごとの合計 {テーブル名: パケット数}
+        }
+        
+        # 書き込み済みの状態 {(ルーター, テーブル名): (SIDリスト, 出力インターフェース)}
+        # 書き込みに失敗した・結果が不明なテーブルは削除し、次回の差分比較で必ず書き込む
+        self.installed: Dict[Tuple[str, str], Tuple[Tuple[str, ...], str]] = {}
+        # ルーターごとの差分書き込み回数と、前回確認した再接続回数（変わっていれば書き込み済みの状態を破棄）
+        self.reconcile_cycles: Dict[str, int] = {}
+        self.reconnect_counts: Dict[str, int] = {}
+        self.reconcile_stats = {
+            'programmed': 0,   # 書き込んだテーブル数
+            'unchanged': 0,    # 差分なしで省略したテーブル数
+            'noop': 0,         # 全テーブル差分なしで書き込みを省略した回数（ルーター単位）
+            'resyncs': 0,      # 定期再同期・再接続の検出で全テーブルを書き込み直した回数
+        }
     
     def create_table_routes(self, path: List[int], is_return: bool = False) -> List[TableRoute]:
         """テーブル経路情報作成"""
@@ -807,33 +2725,42 @@ class RoutingTableManager:
             logger.error(f"テーブル {table_name} クリアエラー: {e}")
             return False
     
+    def route_args(self, table_route: TableRoute, is_return: bool = False) -> str:
+        """経路追加（route_replace 有効時は置換）コマンドの引数（"ip -6" 以降、ip -batch の1行としても使う）"""
+        sid_str = ",".join(table_route.segments)
+        prefix = self.config.return_route_prefix if is_return else self.config.route_prefix
+        action = "replace" if self.config.route_replace else "add"
+        return (f"route {action} {prefix} "
+                f"encap seg6 mode encap segs {sid_str} "
+                f"dev {table_route.output_interface} table {table_route.table_name}")
+    
     def update_table_route(self, client: paramiko.SSHClient, table_route: TableRoute, is_return: bool = False) -> bool:
         """個別テーブル経路更新"""
         try:
-            # テーブルクリア
-            if not self.clear_table_routes(client, table_route.table_name):
+            # テーブルクリア（replace ではクリアせず既存経路をそのまま差し替える）
+            if not self.config.route_replace and not self.clear_table_routes(client, table_route.table_name):
                 logger.warning(f"テーブル {table_route.table_name} のクリアに失敗")
             
             # 新経路追加
             if table_route.segments:
-                sid_str = ",".join(table_route.segments)
-                prefix = self.config.return_route_prefix if is_return else self.config.route_prefix
-                add_cmd = (f"ip -6 route add {prefix} "
-                          f"encap seg6 mode encap segs {sid_str} "
-                          f"dev {table_route.output_interface} table {table_route.table_name}")
+                add_cmd = f"ip -6 {self.route_args(table_route, is_return)}"
                 
                 rc, out, err = self.ssh_manager.execute_command(client, add_cmd)
                 
                 if rc == 0:
                     logger.debug(f"✓ {table_route.table_name} 経路更新成功")
+                    self.mark_installed(table_route, is_return)
                     return True
                 else:
                     logger.error(f"✗ {table_route.table_name} 経路更新失敗: {err}")
+                    self.forget_installed(table_route, is_return)
                     return False
             
+            self.forget_installed(table_route, is_return)
             return False
         except Exception as e:
             logger.error(f"テーブル更新エラー {table_route.table_name}: {e}")
+            self.forget_installed(table_route, is_return)
             return False
     
     def update_all_tables(self, table_routes: List[TableRoute], is_return: bool = False) -> bool:
@@ -842,21 +2769,187 @@ class RoutingTableManager:
             connection_method = self.ssh_manager.r16_connection if is_return else self.ssh_manager.r1_connection
             
             with connection_method() as client:
-                success_count = 0
-                for table_route in table_routes:
-                    if self.update_table_route(client, table_route, is_return):
-                        success_count += 1
+                before = self.read_fallthrough_counters(client, is_return) if self.config.measure_switch_loss else None
                 
-                return success_count == len(table_routes)
+                if self.config.route_install in ("batch", "stream"):
+                    success = self.update_all_tables_batch(client, table_routes, is_return)
+                else:
+                    success_count = 0
+                    for table_route in table_routes:
+                        if self.update_table_route(client, table_route, is_return):
+                            success_count += 1
+                    success = success_count == len(table_routes)
+                
+                if before is not None:
+                    self.record_switch_loss(client, before, is_return)
+                return success
         except Exception as e:
             logger.error(f"全テーブル更新エラー: {e}")
+            for table_route in table_routes:
+                self.forget_installed(table_route, is_return)
             return False
+    
+    def render_batch(self, table_routes: List[TableRoute], is_return: bool = False) -> Tuple[List[str], Dict[int, TableRoute]]:
+        """全テーブルの変更を ip -batch スクリプトに変換
+        
+        テーブルごとに flush → add の2行（show で経路を列挙する往復を省くため flush でクリアする）。
+        route_replace 有効時は replace の1行のみ
+        
+        Returns:
+            (スクリプトの各行, {add / replace 行の行番号: TableRoute})
+        """
+        commands = []
+        add_lines = {}
+        for table_route in table_routes:
+            if not self.config.route_replace:
+                commands.append(f"route flush table {table_route.table_name}")
+            if table_route.segments:
+                commands.append(self.route_args(table_route, is_return))
+                add_lines[len(commands)] = table_route
+        return commands, add_lines
+    
+    def update_all_tables_batch(self, client: paramiko.SSHClient, table_routes: List[TableRoute],
+                                is_return: bool = False) -> bool:
+        """全テーブル経路更新（ルーターごとに1本の ip -batch スクリプトを1チャネル、stream では常駐プロセスで実行）"""
+        commands, add_lines = self.render_batch(table_routes, is_return)
+        if self.config.route_install == "stream":
+            host = self.config.r16_host if is_return else self.config.r1_host
+            rc, results = self.ssh_manager.stream_batch(host, commands)
+        else:
+            rc, results = self.ssh_manager.execute_batch(client, commands)
+        
+        for table_route in table_routes:
+            if not table_route.segments:
+                self.forget_installed(table_route, is_return)
+        
+        success_count = 0
+        for result in results:
+            table_route = add_lines.get(result.line)
+            if table_route is not None and result.success:
+                logger.debug(f"✓ {table_route.table_name} 経路更新成功")
+                self.mark_installed(table_route, is_return)
+                success_count += 1
+            elif table_route is not None:
+                logger.error(f"✗ {table_route.table_name} 経路更新失敗 (行{result.line}): {result.error}")
+                self.forget_installed(table_route, is_return)
+            elif not result.success:
+                logger.warning(f"バッチ行{result.line} 失敗: {result.command} - {result.error}")
+        
+        return success_count == len(table_routes)
+    
+    def _installed_key(self, table_route: TableRoute, is_return: bool) -> Tuple[str, str]:
+        return (self.config.r16_host if is_return else self.config.r1_host, table_route.table_name)
+    
+    def mark_installed(self, table_route: TableRoute, is_return: bool = False):
+        """テーブルの書き込み済み状態を記録"""
+        self.installed[self._installed_key(table_route, is_return)] = (
+            tuple(table_route.segments), table_route.output_interface)
+    
+    def forget_installed(self, table_route: TableRoute, is_return: bool = False):
+        """テーブルの書き込み済み状態を破棄（次回の差分比較で書き込み対象にする）"""
+        self.installed.pop(self._installed_key(table_route, is_return), None)
+    
+    def forget_host(self, host: str):
+        """ルーターの全テーブルの書き込み済み状態を破棄"""
+        for key in [key for key in self.installed if key[0] == host]:
+            del self.installed[key]
+    
+    def changed_tables(self, table_routes: List[TableRoute], is_return: bool = False) -> List[TableRoute]:
+        """書き込み済みの状態と SIDリスト・出力インターフェースが異なるテーブル"""
+        return [table_route for table_route in table_routes
+                if self.installed.get(self._installed_key(table_route, is_return))
+                != (tuple(table_route.segments), table_route.output_interface)]
+    
+    def reconcile(self, table_routes: List[TableRoute], is_return: bool = False,
+                  dry_run: bool = False) -> Tuple[bool, int]:
+        """望ましい状態と書き込み済みの状態の差分だけを書き込む
+        
+        書き込み済みの状態はコントローラーが書き込んだ内容のため、ルーターへの再接続（再起動の可能性）や
+        常駐 ip -batch の再起動を検出した場合と、reconcile_resync_cycles サイクルごとに全テーブルを書き込み直す
+        
+        Args:
+            dry_run: SSHで書き込まず、差分のあったテーブルを書き込み済みとして記録（リプレイ用）
+        
+        Returns:
+            (成功したか, 書き込んだテーブル数)
+        """
+        router = "r16" if is_return else "r1"
+        host = self.config.r16_host if is_return else self.config.r1_host
+        cycle = self.reconcile_cycles[host] = self.reconcile_cycles.get(host, 0) + 1
+        reconnects = self.ssh_manager.reconnect_count(host)
+        if reconnects != self.reconnect_counts.get(host, reconnects):
+            logger.warning(f"{router}: 再接続を検出 - ルーター側のテーブルが変わった可能性があるため全テーブルを書き込み")
+            self.forget_host(host)
+            self.reconcile_stats['resyncs'] += 1
+        elif self.config.reconcile_resync_cycles > 0 and cycle % self.config.reconcile_resync_cycles == 0:
+            logger.info(f"{router}: 定期再同期 - 全テーブルを書き込み")
+            self.forget_host(host)
+            self.reconcile_stats['resyncs'] += 1
+        # 書き込み中の再接続は次回の呼び出しで検出する（書き込み前の回数を記録）
+        self.reconnect_counts[host] = reconnects
+        
+        changed = self.changed_tables(table_routes, is_return)
+        self.reconcile_stats['unchanged'] += len(table_routes) - len(changed)
+        if not changed:
+            self.reconcile_stats['noop'] += 1
+            logger.info(f"{router}: 全{len(table_routes)}テーブル変更なし - 書き込みを省略")
+            return True, 0
+        
+        self.reconcile_stats['programmed'] += len(changed)
+        logger.info(f"{router}: {len(changed)}/{len(table_routes)}テーブルを更新 "
+                    f"({', '.join(table_route.table_name for table_route in changed)})")
+        if dry_run:
+            for table_route in changed:
+                self.mark_installed(table_route, is_return)
+            return True, len(changed)
+        return self.update_all_tables(changed, is_return), len(changed)
+    
+    def read_fallthrough_counters(self, client: paramiko.SSHClient, is_return: bool = False) -> Optional[Dict[str, int]]:
+        """ルーターのフォールスルーカウンタ {テーブル名: パケット数}"""
+        nft_table = self.config.r16_nft_table if is_return else self.config.r1_nft_table
+        rc, out, err = self.ssh_manager.execute_command(client, f"nft list chain {nft_table} {FALLTHROUGH_CHAIN}")
+        counters = {table: int(packets) for packets, table in FALLTHROUGH_PATTERN.findall(out)} if rc == 0 else {}
+        if not counters:
+            logger.warning(f"フォールスルーカウンタの取得失敗（Phase 2 の --fallthrough-counters で作成）: {err}")
+            return None
+        return counters
+    
+    def record_switch_loss(self, client: paramiko.SSHClient, before: Dict[str, int], is_return: bool = False):
+        """テーブル更新後のカウンタを読み、更新中にメインテーブルへ落ちたパケット数をテーブルごとに記録"""
+        after = self.read_fallthrough_counters(client, is_return)
+        if after is None:
+            return
+        deltas = {table: after[table] - before.get(table, after[table]) for table in after}
+        total = sum(deltas.values())
+        router = "r16" if is_return else "r1"
+        self.switch_stats['measured'] += 1
+        self.switch_stats['fallthrough'] += total
+        for table, delta in deltas.items():
+            self.switch_stats['by_table'][table] = self.switch_stats['by_table'].get(table, 0) + delta
+        detail = ", ".join(f"{table}: {delta}" for table, delta in sorted(deltas.items()))
+        if total > 0:
+            self.switch_stats['lossy'] += 1
+            logger.warning(f"経路切り替え中のフォールスルー ({router}): {total}パケット ({detail})")
+        else:
+            logger.debug(f"経路切り替え中のフォールスルー ({router}): 0パケット")
+    
+    def log_switch_stats(self):
+        """切り替え時損失・差分書き込みの集計を表示"""
+        if self.config.route_reconcile:
+            logger.info(f"差分書き込み: 更新 {self.reconcile_stats['programmed']}テーブル, "
+                        f"省略 {self.reconcile_stats['unchanged']}テーブル, "
+                        f"書き込みなし {self.reconcile_stats['noop']}回, "
+                        f"全テーブル再同期 {self.reconcile_stats['resyncs']}回")
+        if self.switch_stats['measured']:
+            logger.info(f"経路切り替え時の損失: 計測 {self.switch_stats['measured']}回, "
+                        f"フォールスルーあり {self.switch_stats['lossy']}回, "
+                        f"合計 {self.switch_stats['fallthrough']}パケット {self.switch_stats['by_table']}")
 
 class SRv6RealTimeMultiTableManager:
     """Phase 3拡張版: リアルタイムSRv6多テーブル管理クラス（簡素化版）"""
     
-    def __init__(self):
-        self.config = SRv6Config()
+    def __init__(self, config: Optional[SRv6Config] = None):
+        self.config = config or SRv6Config()
         self.rrd_manager = RRDDataManager(self.config)
         self.ssh_manager = SSHConnectionManager(self.config)
         self.path_calculator = PathCalculator(self.config)
@@ -869,9 +2962,13 @@ class SRv6RealTimeMultiTableManager:
             'total_updates': 0,
             'path_changes': 0,
             'rrd_fetch_count': 0,
+            'skipped_cycles': 0,
             'last_update': None
         }
         
+        # サイクルごとの列指向アーカイブ（config.archive_dir 設定時のみ、復路列は未使用）
+        self.archive = open_cycle_archive(self.config, self.path_calculator.graph)
+        
         logger.info("SRv6リアルタイム多テーブル管理システム初期化完了")
     
     def update_edge_weights(self) -> bool:
@@ -897,48 +2994,7 @@ class SRv6RealTimeMultiTableManager:
     
     def detect_path_changes(self, new_routes: List[TableRoute]) -> List[PathChangeEvent]:
         """経路変更の検出"""
-        changes = []
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-        
-        for new_route in new_routes:
-            table_name = new_route.table_name
-            old_route = self.current_table_routes.get(table_name)
-            
-            if old_route is None:
-                # 初回設定
-                changes.append(PathChangeEvent(
-                    timestamp=timestamp,
-                    table_name=table_name,
-                    old_path=None,
-                    new_path=new_route.path,
-                    old_segments=None,
-                    new_segments=new_route.segments,
-                    old_interface=None,
-                    new_interface=new_route.output_interface,
-                    reason="初回設定"
-                ))
-            elif (old_route.path != new_route.path or 
-                  old_route.output_interface != new_route.output_interface):
-                # 経路またはインターフェース変更
-                reason = []
-                if old_route.path != new_route.path:
-                    reason.append("経路変更")
-                if old_route.output_interface != new_route.output_interface:
-                    reason.append("出力IF変更")
-                
-                changes.append(PathChangeEvent(
-                    timestamp=timestamp,
-                    table_name=table_name,
-                    old_path=old_route.path,
-                    new_path=new_route.path,
-                    old_segments=old_route.segments,
-                    new_segments=new_route.segments,
-                    old_interface=old_route.output_interface,
-                    new_interface=new_route.output_interface,
-                    reason="負荷変動による" + "・".join(reason)
-                ))
-        
-        return changes
+        return detect_route_changes(self.current_table_routes, new_routes)
     
     # SSH接続は委譲
     @property
@@ -997,6 +3053,9 @@ class SRv6RealTimeMultiTableManager:
         logger.info(f"  総更新回数: {self.stats['total_updates']}")
         logger.info(f"  経路変更回数: {self.stats['path_changes']}")
         logger.info(f"  RRD取得回数: {self.stats['rrd_fetch_count']}")
+        logger.info(f"  スキップ回数: {self.stats['skipped_cycles']}")
+        if self.rrd_manager.forecaster.mae is not None:
+            logger.info(f"  予測誤差: MAE={self.rrd_manager.forecaster.mae:.4f}, RMSE={self.rrd_manager.forecaster.rmse:.4f}")
         
         # 現在のエッジ重み表示
         logger.info("現在のエッジ重み:")
@@ -1021,40 +3080,63 @@ class SRv6RealTimeMultiTableManager:
                 start_time = time.time()
                 
                 self.display_status(iteration)
+                stage_ms = {}
+                status = STATUS_UPDATED
                 
                 # RRDデータでエッジ重み更新
+                stage_start = time.perf_counter()
                 if self.update_edge_weights():
                     logger.info("エッジ重み更新完了")
+                    tuned_changed = self.path_calculator.refresh_tuned_weights(self.rrd_manager.last_rates, src, dst)
                 else:
                     logger.warning("エッジ重み更新に失敗")
+                    tuned_changed = self.path_calculator.refresh_tuned_weights(None, src, dst)
+                stage_ms['fetch'] = self.rrd_manager.last_fetch_ms
+                stage_ms['weights'] = (time.perf_counter() - stage_start) * 1000 - stage_ms['fetch']
                 
-                # 新しい経路計算
-                new_routes = self.create_table_routes(src, dst)
+                # 新しいサンプルが無ければ経路計算・テーブル更新を省略（最適化した重みが更新された場合は再計算）
+                if not self.rrd_manager.data_changed and self.current_table_routes and not tuned_changed:
+                    self.stats['skipped_cycles'] += 1
+                    status = STATUS_SKIPPED
+                    logger.info("⏭️ RRD更新なし - 経路計算・テーブル更新をスキップ")
+                else:
+                    # 新しい経路計算
+                    stage_start = time.perf_counter()
+                    new_routes = self.create_table_routes(src, dst)
+                    stage_ms['paths'] = (time.perf_counter() - stage_start) * 1000
                 
-                if new_routes:
-                    # 経路変更検出
-                    changes = self.detect_path_changes(new_routes)
+                    if new_routes:
+                        # 経路変更検出
+                        changes = self.detect_path_changes(new_routes)
                     
-                    if changes:
-                        logger.info(f"📊 {len(changes)}件の経路変更を検出")
-                        self.log_path_changes(changes)
+                        if changes:
+                            logger.info(f"📊 {len(changes)}件の経路変更を検出")
+                            self.log_path_changes(changes)
                         
-                        # 経路更新実行
-                        if self.update_all_tables(new_routes):
-                            logger.info("✅ 全テーブル経路更新成功")
+                            # 経路更新実行
+                            stage_start = time.perf_counter()
+                            if self.update_all_tables(new_routes):
+                                logger.info("✅ 全テーブル経路更新成功")
+                            else:
+                                logger.error("❌ 一部テーブル更新失敗")
+                                status = STATUS_FAILED
+                            stage_ms['program'] = (time.perf_counter() - stage_start) * 1000
                         else:
-                            logger.error("❌ 一部テーブル更新失敗")
-                    else:
-                        logger.info("✅ 経路変更なし")
+                            logger.info("✅ 経路変更なし")
                     
-                    # 現在の経路情報表示
-                    logger.info("現在のテーブル経路:")
-                    for route in new_routes:
-                        logger.info(f"  {route.table_name}: {route.description}")
-                        logger.info(f"    SID: {' → '.join(route.segments)}")
-                        logger.info(f"    出力IF: {route.output_interface}")
-                else:
-                    logger.error("❌ 経路計算に失敗")
+                        # 現在の経路情報表示
+                        logger.info("現在のテーブル経路:")
+                        for route in new_routes:
+                            logger.info(f"  {route.table_name}: {route.description}")
+                            logger.info(f"    SID: {' → '.join(route.segments)}")
+                            logger.info(f"    出力IF: {route.output_interface}")
+                    else:
+                        logger.error("❌ 経路計算に失敗")
+                        status = STATUS_FAILED
+                
+                if self.archive is not None:
+                    archive_cycle(self.archive, start_time, status, self.rrd_manager, self.graph,
+                                  list(self.current_table_routes.values()), None, stage_ms)
                 
                 # 統計更新
                 self.stats['total_updates'] += 1
@@ -1073,6 +3155,11 @@ class SRv6RealTimeMultiTableManager:
             self.display_final_stats()
         except Exception as e:
             logger.error(f"監視エラー: {e}")
+        finally:
+            if self.archive is not None:
+                self.archive.close()
+            self.path_calculator.close()
+            self.ssh_manager.close()
     
     def display_final_stats(self):
         """最終統計表示"""
@@ -1080,34 +3167,312 @@ class SRv6RealTimeMultiTableManager:
         logger.info(f"総更新回数: {self.stats['total_updates']}")
         logger.info(f"経路変更回数: {self.stats['path_changes']}")
         logger.info(f"RRD取得回数: {self.stats['rrd_fetch_count']}")
+        logger.info(f"スキップ回数: {self.stats['skipped_cycles']}")
+        if self.rrd_manager.forecaster.mae is not None:
+            logger.info(f"予測誤差: MAE={self.rrd_manager.forecaster.mae:.4f}, RMSE={self.rrd_manager.forecaster.rmse:.4f}")
         logger.info(f"最終更新: {self.stats['last_update']}")
+        self.table_manager.log_switch_stats()
         
         if self.path_history:
             logger.info("経路変更履歴:")
             for change in self.path_history[-5:]:  # 最新5件
                 logger.info(f"  {change.timestamp}: {change.table_name} - {change.reason}")
 
+class SRv6ReplayRunner:
+    """オフラインリプレイ: アーカイブ済みトラフィックを仮想時刻で再生して経路計算を評価
+
+    SRv6PathManager を dry_run で使い、RRDDataManager → PathCalculator → 経路差分検出までを
+    実機と同じ処理で実行する（SSHによるテーブル更新は行わない）。
+    サイクルごとの選択経路は1行1サイクルのJSONLとして書き出す。
+    """
+
+    def __init__(self, source: ReplayRateSource, config: Optional[SRv6Config] = None,
+                 enable_visualization: bool = False, output_path: Optional[str] = None):
+        self.source = source
+        self.manager = SRv6PathManager(enable_visualization=enable_visualization, config=config,
+                                       dry_run=True, clock=lambda: self.source.now)
+        self.manager.rrd_manager.rate_source = source
+        if self.manager.path_calculator.weight_optimizer is not None:
+            # 仮想時間で再生するため、前サイクルで開始した最適化の結果を待ってから経路計算する
+            self.manager.path_calculator.weight_optimizer.blocking = True
+        output_dir = self.manager.config.visualization_dir or os.path.join("/opt/app/visualization", REPLAY_SAVE_DIR)
+        self.output_path = output_path or os.path.join(output_dir, "replay_paths.jsonl")
+
+        # 方向ごとの現在のテーブル経路 {テーブル名: TableRoute}
+        self.current_routes: Dict[str, Dict[str, TableRoute]] = {"forward": {}, "return": {}}
+        self.stats = {
+            'cycles': 0,
+            'path_changes': 0,
+            'skipped_cycles': 0,
+            'noop_cycles': 0,
+            'failed_cycles': 0,
+            'compute_time': 0.0
+        }
+
+    def run_cycle(self, timestamp: float) -> Dict:
+        """仮想時刻 timestamp で1サイクル実行し、記録用の辞書を返す"""
+        self.source.seek(timestamp)
+        skipped_before = self.manager.skipped_cycles
+        noop_before = self.manager.noop_cycles
+
+        start_time = time.perf_counter()
+        success = self.manager.update_bidirectional_tables()
+        compute_time = time.perf_counter() - start_time
+        skipped = self.manager.skipped_cycles != skipped_before
+        noop = self.manager.noop_cycles != noop_before
+        time_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+        changes = []
+        if success and not skipped:
+            for direction, routes in (("forward", self.manager.last_forward_routes),
+                                      ("return", self.manager.last_return_routes)):
+                for change in detect_route_changes(self.current_routes[direction], routes, time_str):
+                    changes.append({
+                        "direction": direction,
+                        "table": change.table_name,
+                        "old_path": change.old_path,
+                        "new_path": change.new_path,
+                        "reason": change.reason
+                    })
+                self.current_routes[direction] = {route.table_name: route for route in routes}
+
+        self.stats['cycles'] += 1
+        self.stats['path_changes'] += sum(1 for change in changes if change["old_path"] is not None)
+        self.stats['skipped_cycles'] += int(skipped)
+        self.stats['noop_cycles'] += int(noop)
+        self.stats['failed_cycles'] += int(not success)
+        self.stats['compute_time'] += compute_time
+
+        return {
+            "cycle": self.stats['cycles'],
+            "timestamp": timestamp,
+            "time": time_str,
+            "success": success,
+            "skipped": skipped,
+            "noop": noop,
+            "compute_ms": round(compute_time * 1000, 3),
+            "forward": [{"table": r.table_name, "path": r.path, "cost": r.cost}
+                        for r in self.current_routes["forward"].values()],
+            "return": [{"table": r.table_name, "path": r.path, "cost": r.cost}
+                       for r in self.current_routes["return"].values()],
+            "changes": changes
+        }
+
+    def run(self, start: Optional[float] = None, duration_minutes: float = MEASUREMENT_DURATION_MINUTES,
+            interval: int = 60, verbose: bool = False) -> Dict:
+        """start から duration_minutes 分を interval 秒刻みで再生（待機なし）
+
+        Args:
+            start: 開始時刻（UNIX秒）。未指定時はアーカイブ内で最初に有効なサンプルの時刻
+            verbose: Falseの場合、再生中のサイクルごとのINFOログを抑制する
+        """
+        start = self.source.start if start is None else start
+        end = min(start + duration_minutes * 60, self.source.end)
+        os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+
+        logger.info(f"リプレイ開始: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))} - "
+                    f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(end))} "
+                    f"({len(self.source.keys)}リンク, 間隔: {interval}秒)")
+
+        previous_level = logger.level
+        if not verbose:
+            logger.setLevel(logging.WARNING)
+        wall_start = time.perf_counter()
+        try:
+            with open(self.output_path, 'w', encoding='utf-8') as f:
+                timestamp = start
+                while timestamp <= end:
+                    f.write(json.dumps(self.run_cycle(timestamp), ensure_ascii=False) + "\n")
+                    timestamp += interval
+        finally:
+            logger.setLevel(previous_level)
+            self.manager.cleanup()
+        wall_time = time.perf_counter() - wall_start
+
+        logger.info("=== リプレイ結果 ===")
+        logger.info(f"再生時間: {(end - start) / 60:.1f}分 → 実行時間: {wall_time:.2f}秒")
+        logger.info(f"サイクル数: {self.stats['cycles']} (スキップ: {self.stats['skipped_cycles']}, "
+                    f"失敗: {self.stats['failed_cycles']})")
+        logger.info(f"経路変更回数: {self.stats['path_changes']}")
+        if self.manager.config.route_reconcile:
+            logger.info(f"書き込みなしサイクル: {self.stats['noop_cycles']}, "
+                        f"書き込んだテーブル数: {self.manager.programmed_tables}")
+        if self.stats['cycles']:
+            logger.info(f"平均計算時間: {self.stats['compute_time'] / self.stats['cycles'] * 1000:.2f}ms/サイクル")
+        if self.manager.rrd_manager.forecaster.mae is not None:
+            logger.info(f"予測誤差: MAE={self.manager.rrd_manager.forecaster.mae:.4f}, "
+                        f"RMSE={self.manager.rrd_manager.forecaster.rmse:.4f}")
+        engine_stats = getattr(self.manager.path_calculator.engine, 'stats', None)
+        if engine_stats:
+            logger.info(f"経路計算エンジン統計 ({self.manager.path_calculator.engine.name}): {engine_stats}")
+        logger.info(f"選択経路の出力先: {self.output_path}")
+        return self.stats
+
+def replay_output_dir(replay_source: str) -> str:
+    """リプレイ結果の既定の出力先（visualization/REPLAY_SAVE_DIR/リプレイ元の名前）
+
+    実測の履歴（HISTORY_SAVE_DIR）を上書きしないよう、リプレイ元ごとに別のディレクトリを使う
+    """
+    name = os.path.splitext(os.path.basename(os.path.normpath(replay_source)))[0] or "replay"
+    return os.path.join("/opt/app/visualization", REPLAY_SAVE_DIR, name)
+
 def main():
     """メイン関数"""
     import argparse
     
     parser = argparse.ArgumentParser(description="SRv6双方向リアルタイム多テーブル管理")
-    parser.add_argument("--mode", type=str, default="bidirectional", choices=["bidirectional", "forward", "analyze"],
-                        help="実行モード: bidirectional(双方向), forward(往路のみ), analyze(分析のみ)")
+    parser.add_argument("--mode", type=str, default="bidirectional", choices=["bidirectional", "forward", "analyze", "replay", "compare-engines"],
+                        help="実行モード: bidirectional(双方向), forward(往路のみ), analyze(分析のみ), replay(アーカイブの再生), "
+                             "compare-engines(経路計算エンジンの一致確認と速度比較)")
     parser.add_argument("--src", type=int, default=1, help="送信元ノード")
     parser.add_argument("--dst", type=int, default=16, help="宛先ノード")
     parser.add_argument("--interval", type=int, default=60, help="更新間隔（秒）- RRD更新間隔に合わせて60秒推奨")
     parser.add_argument("--once", action="store_true", help="1回のみ実行")
     parser.add_argument("--visualize", action="store_true", help="トポロジ可視化を有効化")
+    parser.add_argument("--graph-mode", type=str, default="undirected", choices=["undirected", "directed"],
+                        help="グラフモード: undirected(リンク単位の重み), directed(方向別の重み、復路を独立に計算)")
+    parser.add_argument("--weight-function", type=str, default="instant", choices=list(LinkTelemetryBuffer.WEIGHT_FUNCTIONS),
+                        help="重み関数: instant(最新値), ewma(指数移動平均), mean(窓平均), p95(窓内95パーセンタイル)")
+    parser.add_argument("--window", type=int, default=10, help="重み関数の対象サンプル数")
+    parser.add_argument("--cost-function", type=str, default="linear", choices=list(COST_FUNCTIONS),
+                        help="利用率から重みへの変換: linear(利用率), mm1(M/M/1遅延 1/(1-u)), "
+                             "fortz-thorup(区分線形凸コスト), exponential((exp(10u)-1)/10)")
+    parser.add_argument("--weight-multipliers", type=float, nargs="+", default=None,
+                        help=f"経路選択後に使用エッジの重みへ掛ける倍率（テーブル順、既定: {PathCalculator.WEIGHT_MULTIPLIERS}）")
+    parser.add_argument("--ewma-alpha", type=float, default=0.3, help="EWMAの平滑化係数（0-1）")
+    parser.add_argument("--forecast", type=str, default="none", choices=list(UtilizationForecaster.METHODS),
+                        help="利用率予測: none(予測なし), holt(Holt線形指数平滑), ar(AR(1)モデル)")
+    parser.add_argument("--forecast-window", type=int, default=30, help="予測モデルの学習に使うサンプル数")
+    parser.add_argument("--traffic-source", type=str, default="rrd", choices=["rrd", "snmp"],
+                        help="トラフィック取得元: rrd(MRTGのRRDファイル), snmp(SNMP GETBULKで直接収集)")
+    parser.add_argument("--snmp-interval", type=float, default=1.0, help="SNMPポーリング間隔（秒、最小1秒）")
+    parser.add_argument("--rrdcached", type=str, default=None,
+                        help="rrdcachedのアドレス（例: unix:/var/run/rrdcached.sock）- 未指定時は環境変数 RRDCACHED_ADDRESS")
+    parser.add_argument("--replay-source", type=str, default="/opt/app/mrtg/mrtg_file",
+                        help="リプレイ元: RRDファイルのディレクトリ、またはSNMP収集デーモンのテレメトリアーカイブ（JSONL）")
+    parser.add_argument("--replay-start", type=float, default=None,
+                        help="リプレイ開始時刻（UNIX秒）- 未指定時は最初に有効なサンプルの時刻")
+    parser.add_argument("--replay-duration", type=float, default=MEASUREMENT_DURATION_MINUTES,
+                        help="リプレイする時間（分）")
+    parser.add_argument("--replay-output", type=str, default=None,
+                        help="サイクルごとの選択経路の出力先（既定: --replay-dir/replay_paths.jsonl）")
+    parser.add_argument("--replay-dir", type=str, default=None,
+                        help=f"リプレイ結果（選択経路・可視化画像・履歴）の出力先"
+                             f"（既定: visualization/{REPLAY_SAVE_DIR}/<リプレイ元の名前>、実測の履歴とは分ける）")
+    parser.add_argument("--replay-verbose", action="store_true", help="リプレイ中もサイクルごとの詳細ログを出力")
+    parser.add_argument("--archive-dir", type=str, default=None,
+                        help=f"サイクルアーカイブの出力先（既定: 監視モードは visualization/{HISTORY_SAVE_DIR}/archive、"
+                             "replay/analyze は指定時のみ）")
+    parser.add_argument("--no-archive", action="store_true", help="サイクルアーカイブを無効化")
+    parser.add_argument("--path-engine", type=str, default="networkx", choices=list(PathCalculator.PATH_ENGINES),
+                        help="経路計算エンジン: networkx(NetworkX), scipy(scipy.sparse.csgraph), array(CSR配列上のDijkstra), "
+                             "dynamic(最短経路木の差分更新), candidate(候補経路の接続行列を重みベクトルで一括評価)")
+    parser.add_argument("--spt-epsilon", type=float, default=0.0,
+                        help="dynamic エンジン: この値以下の重み変化は無視して前回の最短経路木を使う")
+    parser.add_argument("--path-mode", type=str, default="multiplier", choices=list(PathCalculator.PATH_MODES),
+                        help="テーブルごとの経路の選び方: multiplier(使用エッジの重みに倍率), "
+                             "edge-disjoint / node-disjoint(Suurballe/Bhandari法でリンク・ノードを共有しない経路), "
+                             "ksp(Yenのk最短経路から重複ペナルティ付きで選択), "
+                             "lp(クラスごとの需要を最大リンク利用率最小で割り当て)")
+    parser.add_argument("--ksp-candidates", type=int, default=8, help="ksp: 列挙する経路数")
+    parser.add_argument("--ksp-overlap-penalty", type=float, default=2.0,
+                        help="ksp: 既選択経路と共有するエッジの重みに加算する倍率")
+    parser.add_argument("--class-demand", type=float, nargs="+", default=None,
+                        help="lp: クラスごとの需要推定（Mbps、高・中・低優先度の順）- 未指定時は送信元リンクの観測値から推定")
+    parser.add_argument("--table-metric", type=str, nargs="+", default=None, choices=list(PathCalculator.PATH_METRICS),
+                        help="テーブルごとの経路メトリック（高・中・低優先度の順、multiplier 方式で有効）: "
+                             "shortest(重みの和), widest(残余帯域のボトルネック最大), "
+                             "widest-shortest(最短経路のうちボトルネック最大), shortest-widest(ボトルネック最大のうち最短)")
+    parser.add_argument("--max-utilization", type=float, nargs="+", default=None,
+                        help="CSPF: テーブルごとの利用率上限（高・中・低優先度の順）- 観測利用率が上限を超えるリンクを経路から除外")
+    parser.add_argument("--max-hops", type=int, nargs="+", default=None,
+                        help="CSPF: テーブルごとのホップ数上限（高・中・低優先度の順）- SRHのSID数の上限にもなる")
+    parser.add_argument("--weight-optimization", type=str, default="none", choices=["none", "background"],
+                        help="リンク重み最適化: none(利用率ベースの重み), "
+                             "background(Fortz–Thorup型の局所探索を別プロセスで実行し、最適化した重みで経路計算)")
+    parser.add_argument("--tuned-weights", type=str, default=None,
+                        help="weight_optimizer.py でオフライン最適化した重み（JSON）を経路計算に使う")
+    parser.add_argument("--optimizer-iterations", type=int, default=200, help="リンク重み最適化の反復回数")
+    parser.add_argument("--optimizer-max-weight", type=int, default=20, help="リンク重み最適化の整数重みの上限")
+    parser.add_argument("--optimizer-time-limit", type=float, default=None,
+                        help="1回のリンク重み最適化の打ち切り時間（秒、未指定時は反復回数のみ）")
+    parser.add_argument("--no-ssh-pool", action="store_true",
+                        help="SSH接続プールを使わず、テーブル更新ごとに接続・切断する")
+    parser.add_argument("--ssh-keepalive", type=int, default=15,
+                        help="SSH接続プールの keepalive 間隔（秒、0 で無効）")
+    parser.add_argument("--route-install", type=str, default="sequential", choices=["sequential", "batch", "stream"],
+                        help="経路の書き込み方式（sequential: テーブルごとに個別コマンド, batch: ルーターごとに ip -batch 1往復, "
+                             "stream: ルーターごとに常駐させた ip -batch へ流し込む）")
+    parser.add_argument("--route-replace", action="store_true",
+                        help="経路をクリアせず ip route replace で差し替える（切り替え時にテーブルが空にならない）")
+    parser.add_argument("--measure-switch-loss", action="store_true",
+                        help="テーブル更新の前後で nftables のフォールスルーカウンタを読み、切り替え中にメインテーブルへ落ちたパケット数を記録")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="bidirectional: SIDリストか出力インターフェースが変わったテーブルのみ書き込む")
+    parser.add_argument("--reconcile-resync", type=int, default=60,
+                        help="--reconcile: このサイクル数ごとに全テーブルを書き込み直す（0 で無効、再接続検出時は常に書き込み直す）")
+    parser.add_argument("--compare-trials", type=int, default=200,
+                        help="compare-engines: 現在の重みに加えて比較するランダム重みの回数")
+    parser.add_argument("--compare-grid", type=int, default=0,
+                        help="compare-engines: N×N格子トポロジで比較（0: テストベッドのトポロジ）")
     
     args = parser.parse_args()
     
+    class_constraints = None
+    if args.max_utilization or args.max_hops:
+        ceilings, hop_limits = args.max_utilization or [], args.max_hops or []
+        class_constraints = [
+            {"max_utilization": ceilings[i] if i < len(ceilings) else None,
+             "max_hops": hop_limits[i] if i < len(hop_limits) else None}
+            for i in range(max(len(ceilings), len(hop_limits)))
+        ]
+    
+    archive_dir = args.archive_dir
+    if archive_dir is None and args.mode in ("bidirectional", "forward") and not args.once:
+        archive_dir = os.path.join("/opt/app/visualization", HISTORY_SAVE_DIR, "archive")
+    
+    config = SRv6Config(
+        directed=(args.graph_mode == "directed"),
+        weight_function=args.weight_function,
+        cost_function=args.cost_function,
+        weight_multipliers=args.weight_multipliers,
+        telemetry_window=args.window,
+        ewma_alpha=args.ewma_alpha,
+        forecast_method=args.forecast,
+        forecast_window=args.forecast_window,
+        rrdcached_address=args.rrdcached,
+        traffic_source=args.traffic_source if args.mode != "replay" else "rrd",
+        snmp_interval=args.snmp_interval,
+        archive_dir=None if args.no_archive else archive_dir,
+        visualization_dir=(args.replay_dir or replay_output_dir(args.replay_source)) if args.mode == "replay" else None,
+        path_engine=args.path_engine,
+        spt_epsilon=args.spt_epsilon,
+        path_mode=args.path_mode,
+        ksp_candidates=args.ksp_candidates,
+        ksp_overlap_penalty=args.ksp_overlap_penalty,
+        class_demands=args.class_demand,
+        table_metrics=args.table_metric,
+        class_constraints=class_constraints,
+        weight_optimization=args.weight_optimization,
+        tuned_weights_path=args.tuned_weights,
+        optimizer_iterations=args.optimizer_iterations,
+        optimizer_max_weight=args.optimizer_max_weight,
+        optimizer_time_limit=args.optimizer_time_limit,
+        ssh_pool=not args.no_ssh_pool,
+        ssh_keepalive=args.ssh_keepalive,
+        route_install=args.route_install,
+        route_replace=args.route_replace,
+        measure_switch_loss=args.measure_switch_loss,
+        route_reconcile=args.reconcile,
+        reconcile_resync_cycles=args.reconcile_resync
+    )
+    
     logger.info("Phase 3拡張版: SRv6双方向リアルタイム多テーブル管理開始")
     
     try:
         if args.mode == "bidirectional":
             # 双方向管理（新実装）
-            manager = SRv6PathManager(enable_visualization=args.visualize)
+            manager = SRv6PathManager(enable_visualization=args.visualize, config=config)
             
             if args.once:
                 logger.info("双方向1回のみ実行モード")
@@ -1164,16 +3529,24 @@ def main():
                     
         elif args.mode == "analyze":
             # トラフィック分析モード
-            manager = SRv6PathManager(enable_visualization=args.visualize)
+            manager = SRv6PathManager(enable_visualization=args.visualize, config=config)
             traffic_data = manager.get_all_traffic_data()
             if traffic_data:
                 optimal_path = manager.calculate_optimal_path(traffic_data)
                 if optimal_path:
                     forward_path_str = ' → '.join([f'r{node}' for node in optimal_path])
-                    return_path_str = ' → '.join([f'r{node}' for node in optimal_path[::-1]])
+                    return_path = manager.calculate_return_path(optimal_path) or []
+                    return_path_str = ' → '.join([f'r{node}' for node in return_path])
                     logger.info(f"往路最適経路: {forward_path_str}")
                     logger.info(f"復路最適経路: {return_path_str}")
                     
+                    # 候補経路エンジンでは全候補のコスト順位も出力
+                    if config.path_engine == "candidate":
+                        ranked = manager.path_calculator.rank_paths(args.src, args.dst)
+                        logger.info(f"候補経路ランキング（上位10本 / 全{len(ranked)}本）:")
+                        for rank, (path, cost) in enumerate(ranked[:10], 1):
+                            logger.info(f"  {rank:2d}. {' → '.join([f'r{n}' for n in path])} (コスト: {cost:.6f})")
+                    
                     # 可視化
                     if args.visualize:
                         manager.update_count = 1
@@ -1186,9 +3559,47 @@ def main():
             else:
                 logger.error("トラフィックデータ取得失敗")
                 
+        elif args.mode == "replay":
+            # オフラインリプレイ（SSHなし・仮想時刻で待機なしに再生）
+            source = ReplayRateSource.load(args.replay_source, config.rrd_paths)
+            runner = SRv6ReplayRunner(source, config=config, enable_visualization=args.visualize,
+                                      output_path=args.replay_output)
+            runner.run(start=args.replay_start, duration_minutes=args.replay_duration,
+                       interval=args.interval, verbose=args.replay_verbose)
+                
+        elif args.mode == "compare-engines":
+            # 経路計算エンジンの比較（SSHなし）: 同じ重みで全エンジンを実行し、経路の一致と処理時間を確認
+            if args.compare_grid > 0:
+                n = args.compare_grid
+                graph = nx.convert_node_labels_to_integers(nx.grid_2d_graph(n, n), first_label=1)
+                if config.directed:
+                    graph = graph.to_directed()
+                nx.set_edge_attributes(graph, 0.0001, 'weight')
+                nx.set_edge_attributes(graph, 125_000_000, 'max_bandwidth')
+                calculator = PathCalculator(config, graph=graph)
+                src, dst = 1, n * n
+            else:
+                calculator = PathCalculator(config)
+                # 現在のRRDデータで重みを設定（取得できないリンクは最小重み）
+                rrd_manager = RRDDataManager(config)
+                rrd_manager.update_edge_weights(calculator.graph)
+                rrd_manager.close()
+                src, dst = args.src, args.dst
+            
+            results = calculator.compare_engines([(src, dst), (dst, src)], trials=args.compare_trials)
+            logger.info(f"=== 経路計算エンジン比較 ({calculator.graph.number_of_nodes()}ノード / "
+                        f"{calculator.graph.number_of_edges()}エッジ, 重み {args.compare_trials + 1}通り × 2方向) ===")
+            for name, result in sorted(results.items(), key=lambda item: item[1]["mean_us"]):
+                logger.info(f"  {name:10s}: {result['mean_us']:10.1f} us/回  一致 {result['identical']}, "
+                            f"同コスト別経路 {result['tie']}, 不一致 {result['mismatch']}")
+            if any(result["mismatch"] for result in results.values()):
+                logger.error("❌ エンジン間で経路コストが一致しません")
+                sys.exit(1)
+            logger.info("✅ 全エンジンの経路コストが一致しました")
+            
         elif args.mode == "forward":
             # 往路のみ（従来実装との互換性）
-            manager = SRv6RealTimeMultiTableManager()
+            manager = SRv6RealTimeMultiTableManager(config=config)
             
             if args.once:
                 # 往路1回のみ実行
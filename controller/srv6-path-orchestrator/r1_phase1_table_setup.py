@@ -11,6 +11,11 @@ import logging
 from typing import Tuple
 from contextlib import contextmanager
 
+try:
+    from ssh_connection_pool import shared_pool  # phase3 と共通のSSH接続プール
+except ImportError:
+    shared_pool = None
+
 # ログ設定
 logging.basicConfig(
     level=logging.INFO,
@@ -49,7 +54,20 @@ class SRv6TableSetup:
     
     @contextmanager
     def ssh_connection(self):
-        """SSH接続のコンテキストマネージャー"""
+        """SSH接続のコンテキストマネージャー（接続プールがあれば接続を使い回す）"""
+        if shared_pool is not None:
+            config = dict(self.ssh_config)
+            host = config.pop('hostname')
+            try:
+                self.logger.info(f"SSH接続開始: {host}:{config['port']}")
+                with shared_pool(**config).connection(host) as client:
+                    self.logger.info("r1への SSH接続成功")
+                    yield client
+            except Exception as e:
+                self.logger.error(f"SSH接続エラー: {e}")
+                raise
+            return
+        
         client = paramiko.SSHClient()
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         
@@ -70,7 +88,10 @@ class SRv6TableSetup:
         """SSHコマンド実行"""
         try:
             self.logger.debug(f"実行コマンド: {command}")
-            stdin, stdout, stderr = client.exec_command(command)
+            if shared_pool is not None:
+                stdin, stdout, stderr = shared_pool().exec_command(client, command)
+            else:
+                stdin, stdout, stderr = client.exec_command(command)
             
             rc = stdout.channel.recv_exit_status()
             out = stdout.read().decode('utf-8').strip()
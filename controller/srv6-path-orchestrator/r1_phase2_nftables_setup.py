@@ -11,6 +11,11 @@ import logging
 from typing import Tuple, List, Dict
 from contextlib import contextmanager
 
+try:
+    from ssh_connection_pool import shared_pool  # phase3 と共通のSSH接続プール
+except ImportError:
+    shared_pool = None
+
 # ログ設定
 logging.basicConfig(
     level=logging.INFO,
@@ -40,6 +45,15 @@ class SRv6NftablesSetup:
             'chain_config': 'type filter hook prerouting priority mangle;'
         }
         
+        # フォールスルーカウンタ（phase3 の --measure-switch-loss が読む）
+        # postrouting でマーク付きのまま宛先プレフィックス宛てのパケット = SRv6 でカプセル化されずメインテーブルで転送された
+        self.fallthrough_config = {
+            'chain_name': 'srv6_fallthrough',
+            'chain_config': 'type filter hook postrouting priority mangle;',
+            'route_prefix': 'fd03:1::/64',  # r1→r16方向
+            'tables': {4: 'rt_table1', 6: 'rt_table2', 9: 'rt_table3'}
+        }
+        
         # flow label → mark マッピング（デフォルトルート対応）
         # デフォルトルートとして、4と6以外は全て低優先度（mark 9）に振り分け
         self.flow_label_rules = [
@@ -65,7 +79,20 @@ class SRv6NftablesSetup:
     
     @contextmanager
     def ssh_connection(self):
-        """SSH接続のコンテキストマネージャー"""
+        """SSH接続のコンテキストマネージャー（接続プールがあれば接続を使い回す）"""
+        if shared_pool is not None:
+            config = dict(self.ssh_config)
+            host = config.pop('hostname')
+            try:
+                self.logger.info(f"SSH接続開始: {host}:{config['port']}")
+                with shared_pool(**config).connection(host) as client:
+                    self.logger.info("r1への SSH接続成功")
+                    yield client
+            except Exception as e:
+                self.logger.error(f"SSH接続エラー: {e}")
+                raise
+            return
+        
         client = paramiko.SSHClient()
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         
@@ -86,7 +113,10 @@ class SRv6NftablesSetup:
         """SSHコマンド実行"""
         try:
             self.logger.debug(f"実行コマンド: {command}")
-            stdin, stdout, stderr = client.exec_command(command)
+            if shared_pool is not None:
+                stdin, stdout, stderr = shared_pool().exec_command(client, command)
+            else:
+                stdin, stdout, stderr = client.exec_command(command)
             
             rc = stdout.channel.recv_exit_status()
             out = stdout.read().decode('utf-8').strip()
@@ -237,6 +267,36 @@ class SRv6NftablesSetup:
         
         return success_count == len(self.flow_label_rules)
     
+    def create_fallthrough_counters(self, client: paramiko.SSHClient) -> bool:
+        """フォールスルーカウンタの作成（経路切り替え中にテーブルを外れたパケットの計測用）
+        
+        既存のチェーンは中身を作り直す（カウンタは0に戻る）
+        """
+        self.logger.info("=== フォールスルーカウンタ作成 ===")
+        table = self.nft_config['table_name']
+        chain = self.fallthrough_config['chain_name']
+        
+        cmd_chain = f"nft 'add chain {table} {chain} {{ {self.fallthrough_config['chain_config']} }}'"
+        rc, out, err = self.execute_command(client, cmd_chain)
+        if rc != 0 and "exist" not in err.lower():
+            self.logger.error(f"✗ チェーン作成失敗: {chain} - {err}")
+            return False
+        self.execute_command(client, f"nft flush chain {table} {chain}")
+        
+        success_count = 0
+        for mark, rt_table in self.fallthrough_config['tables'].items():
+            cmd_rule = (f"nft 'add rule {table} {chain} "
+                       f"meta mark {mark} ip6 daddr {self.fallthrough_config['route_prefix']} "
+                       f"counter comment \"srv6-fallthrough {rt_table}\"'")
+            rc, out, err = self.execute_command(client, cmd_rule)
+            if rc == 0:
+                self.logger.info(f"✓ フォールスルーカウンタ作成: mark {mark} → {rt_table}")
+                success_count += 1
+            else:
+                self.logger.error(f"✗ フォールスルーカウンタ作成失敗: mark {mark} - {err}")
+        
+        return success_count == len(self.fallthrough_config['tables'])
+    
     def verify_nftables_setup(self, client: paramiko.SSHClient) -> bool:
         """Phase 2-3: nftables設定の検証（デフォルトルート対応）"""
         self.logger.info("=== Phase 2-3: nftables設定検証 ===")
@@ -341,6 +401,8 @@ def main():
     parser.add_argument("--verify", action="store_true", help="設定の検証")
     parser.add_argument("--test", action="store_true", help="Flow label検出テスト")
     parser.add_argument("--status", action="store_true", help="nftables状態確認")
+    parser.add_argument("--fallthrough-counters", action="store_true",
+                        help="フォールスルーカウンタのみ作成（既存の設定に追加）")
     parser.add_argument("--cleanup", action="store_true", help="設定のクリーンアップ")
     
     args = parser.parse_args()
@@ -360,11 +422,17 @@ def main():
                     if setup.create_flow_label_rules(client):
                         logger.info("✅ Flow labelルール作成完了")
                         
-                        # Step 3: 検証
+                        # Step 3: フォールスルーカウンタ作成
+                        if setup.create_fallthrough_counters(client):
+                            logger.info("✅ フォールスルーカウンタ作成完了")
+                        else:
+                            logger.warning("⚠️ フォールスルーカウンタ作成に失敗（経路切り替え時の計測は無効）")
+                        
+                        # Step 4: 検証
                         if setup.verify_nftables_setup(client):
                             logger.info("🎯 Phase 2完了: nftables設定が正常です")
                             
-                            # Step 4: テスト（オプション）
+                            # Step 5: テスト（オプション）
                             setup.test_flow_label_detection(client)
                         else:
                             logger.error("❌ 設定検証に失敗")
@@ -376,6 +444,9 @@ def main():
             elif args.verify:
                 setup.verify_nftables_setup(client)
             
+            elif args.fallthrough_counters:
+                setup.create_fallthrough_counters(client)
+            
             elif args.test:
                 setup.test_flow_label_detection(client)
             
@@ -386,7 +457,7 @@ def main():
                 setup.cleanup_nftables(client)
             
             else:
-                logger.info("使用法: --setup, --verify, --test, --status, --cleanup のいずれかを指定してください")
+                logger.info("使用法: --setup, --verify, --test, --status, --fallthrough-counters, --cleanup のいずれかを指定してください")
     
     except Exception as e:
         logger.error(f"実行エラー: {e}")
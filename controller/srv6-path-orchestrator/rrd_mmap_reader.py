@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+RRD mmap Reader: MRTG RRDファイルの直接読み出し
+rrdtool バイナリを使わず、.rrd ファイルをメモリマップして
+ヘッダ・DS定義・RRA(AVERAGE/MAX)を NumPy ビューとして取り出す
+
+対象レイアウト（create_rrd.sh で作成されるもの）:
+    --step 60, DS:ds0/ds1 (COUNTER), RRA:AVERAGE/MAX 1440行
+    x86_64 (little endian, unsigned long = 8 bytes) の rrd_format.h に準拠
+"""
+
+import mmap
+import os
+import struct
+import logging
+from dataclasses import dataclass
+from typing import List, Dict, Tuple, Optional, Hashable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# rrd_format.h の構造体サイズ（64bit Linux）
+FLOAT_COOKIE = 8.642135E130
+STAT_HEAD_SIZE = 128   # cookie[4] + version[5] + pad + float_cookie + ds_cnt + rra_cnt + pdp_step + par[10]
+DS_DEF_SIZE = 120      # ds_nam[20] + dst[20] + par[10]
+RRA_DEF_SIZE = 120     # cf_nam[20] + pad + row_cnt + pdp_cnt + par[10]
+PDP_PREP_SIZE = 112    # last_ds[30] + pad + scratch[10]
+CDP_PREP_SIZE = 80     # scratch[10]
+RRA_PTR_SIZE = 8       # cur_row
+
+
+def _cstr(raw: bytes) -> str:
+    """NUL終端の固定長文字列をデコード"""
+    return raw.split(b'\0', 1)[0].decode('ascii', 'replace')
+
+
+@dataclass
+class RRDDataSource:
+    """DS定義（ds0: in, ds1: out）"""
+    name: str
+    dst: str
+    heartbeat: int
+    min_value: float
+    max_value: float
+
+
+@dataclass
+class RRDArchive:
+    """RRA定義とデータ領域の位置"""
+    cf: str
+    row_count: int
+    pdp_count: int
+    xff: float
+    offset: int      # データ領域の先頭バイト位置
+    cur_row: int     # 最後に書き込まれた行（リングバッファ上の位置）
+
+
+@dataclass
+class RRDHeader:
+    """RRDファイルヘッダ"""
+    version: str
+    pdp_step: int
+    last_update: float
+    data_sources: List[RRDDataSource]
+    archives: List[RRDArchive]
+    file_size: int
+
+
+def parse_header(buf) -> RRDHeader:
+    """マップ済みバッファからヘッダを解析（struct のみ使用、NumPy不要）"""
+    cookie = bytes(buf[0:4])
+    if cookie != b'RRD\0':
+        raise ValueError("RRDファイルではありません（cookie不一致）")
+
+    version = _cstr(bytes(buf[4:9]))
+    float_cookie, ds_cnt, rra_cnt, pdp_step = struct.unpack_from('<dQQQ', buf, 16)
+    if float_cookie != FLOAT_COOKIE:
+        raise ValueError("未対応のRRDアーキテクチャです（float cookie不一致）")
+
+    offset = STAT_HEAD_SIZE
+    data_sources = []
+    for _ in range(ds_cnt):
+        name = _cstr(bytes(buf[offset:offset + 20]))
+        dst = _cstr(bytes(buf[offset + 20:offset + 40]))
+        heartbeat, min_value, max_value = struct.unpack_from('<Qdd', buf, offset + 40)
+        data_sources.append(RRDDataSource(name, dst, heartbeat, min_value, max_value))
+        offset += DS_DEF_SIZE
+
+    rra_defs = []
+    for _ in range(rra_cnt):
+        cf = _cstr(bytes(buf[offset:offset + 20]))
+        row_count, pdp_count, xff = struct.unpack_from('<QQd', buf, offset + 24)
+        rra_defs.append((cf, row_count, pdp_count, xff))
+        offset += RRA_DEF_SIZE
+
+    # live_head: バージョン3以降は last_up_usec を含む
+    if version >= '0003':
+        last_up, last_up_usec = struct.unpack_from('<qq', buf, offset)
+        offset += 16
+    else:
+        last_up, = struct.unpack_from('<q', buf, offset)
+        last_up_usec = 0
+        offset += 8
+
+    offset += PDP_PREP_SIZE * ds_cnt
+    offset += CDP_PREP_SIZE * ds_cnt * rra_cnt
+
+    cur_rows = struct.unpack_from(f'<{rra_cnt}Q', buf, offset)
+    offset += RRA_PTR_SIZE * rra_cnt
+
+    archives = []
+    for (cf, row_count, pdp_count, xff), cur_row in zip(rra_defs, cur_rows):
+        archives.append(RRDArchive(cf, row_count, pdp_count, xff, offset, cur_row))
+        offset += row_count * ds_cnt * 8
+
+    if offset > len(buf):
+        raise ValueError(f"RRDファイルサイズ不足: 期待 {offset} bytes, 実際 {len(buf)} bytes")
+
+    return RRDHeader(
+        version=version,
+        pdp_step=pdp_step,
+        last_update=last_up + last_up_usec / 1_000_000,
+        data_sources=data_sources,
+        archives=archives,
+        file_size=offset
+    )
+
+
+def read_last_update(rrd_path: str) -> float:
+    """RRDの last_update のみを読み出す（ヘッダ部分だけを読むため軽量）"""
+    with open(rrd_path, 'rb') as f:
+        head = f.read(STAT_HEAD_SIZE)
+        ds_cnt, rra_cnt = struct.unpack_from('<QQ', head, 24)
+        f.seek(STAT_HEAD_SIZE + DS_DEF_SIZE * ds_cnt + RRA_DEF_SIZE * rra_cnt)
+        last_up, = struct.unpack('<q', f.read(8))
+    return float(last_up)
+
+
+class RRDFile:
+    """1つのRRDファイルのメモリマップ"""
+
+    def __init__(self, rrd_path: str):
+        if np is None:
+            raise ImportError("RRDFile には numpy が必要です")
+        self.path = rrd_path
+        with open(rrd_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.inode = stat.st_ino
+            self.size = stat.st_size
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buf = memoryview(self._mm)
+
+    @property
+    def header(self) -> RRDHeader:
+        """ヘッダ（cur_row/last_update はMRTGの書き込みで変わるため毎回解析）"""
+        return parse_header(self._buf)
+
+    def archive(self, cf: str = 'AVERAGE', header: Optional[RRDHeader] = None) -> Tuple[RRDArchive, "np.ndarray"]:
+        """指定CFのRRAをリングバッファのまま (row_count, ds_cnt) ビューで返す（コピーなし）"""
+        header = header or self.header
+        for rra in header.archives:
+            if rra.cf == cf:
+                ds_cnt = len(header.data_sources)
+                view = np.frombuffer(self._buf, dtype='<f8',
+                                     count=rra.row_count * ds_cnt,
+                                     offset=rra.offset).reshape(rra.row_count, ds_cnt)
+                return rra, view
+        raise KeyError(f"RRA {cf} が存在しません: {self.path}")
+
+    def latest(self, cf: str = 'AVERAGE', rows: int = 3) -> Tuple["np.ndarray", "np.ndarray"]:
+        """最新 rows 行を時系列順で返す（折り返しが無ければコピーなしのビュー）
+
+        Returns:
+            (timestamps, values) - values は (rows, ds_cnt)
+        """
+        header = self.header
+        rra, ring = self.archive(cf, header)
+        rows = min(rows, rra.row_count)
+        first = rra.cur_row - rows + 1
+        if first >= 0:
+            values = ring[first:rra.cur_row + 1]
+        else:
+            values = np.concatenate((ring[first:], ring[:rra.cur_row + 1]))
+        return self._timestamps(header, rra, rows), values
+
+    def history(self, cf: str = 'AVERAGE') -> Tuple["np.ndarray", "np.ndarray"]:
+        """RRA全体（1440行 = 1日分）を時系列順で返す
+
+        cur_row が末尾の場合のみコピーなし。それ以外はリングの並べ替えで1回コピーする。
+        """
+        header = self.header
+        rra, ring = self.archive(cf, header)
+        start = (rra.cur_row + 1) % rra.row_count
+        values = ring if start == 0 else np.concatenate((ring[start:], ring[:start]))
+        return self._timestamps(header, rra, rra.row_count), values
+
+    def _timestamps(self, header: RRDHeader, rra: RRDArchive, rows: int) -> "np.ndarray":
+        """最新行を末尾とするタイムスタンプ列"""
+        period = rra.pdp_count * header.pdp_step
+        last_row_time = int(header.last_update) - int(header.last_update) % period
+        return last_row_time - period * np.arange(rows - 1, -1, -1, dtype=np.int64)
+
+    def close(self):
+        """マップ解除（NumPyビューが残っている場合はGCに任せる）"""
+        try:
+            self._buf.release()
+            self._mm.close()
+        except BufferError:
+            pass
+
+
+class MmapRRDReader:
+    """複数RRDファイルのmmapを保持し、全リンクをまとめて読み出すリーダー"""
+
+    def __init__(self):
+        if np is None:
+            raise ImportError("MmapRRDReader には numpy が必要です")
+        self._files: Dict[str, RRDFile] = {}
+
+    def _open(self, rrd_path: str) -> RRDFile:
+        """マップ済みファイルを取得（create_rrd.sh 等で再作成された場合は再マップ）"""
+        stat = os.stat(rrd_path)
+        rrd_file = self._files.get(rrd_path)
+        if rrd_file is None or rrd_file.inode != stat.st_ino or rrd_file.size != stat.st_size:
+            if rrd_file is not None:
+                rrd_file.close()
+            rrd_file = RRDFile(rrd_path)
+            self._files[rrd_path] = rrd_file
+        return rrd_file
+
+    def read_latest(self, rrd_paths: Dict[Hashable, str], cf: str = 'AVERAGE',
+                    rows: int = 3) -> Dict[Hashable, Tuple[Optional[float], Optional[float]]]:
+        """全リンクの最新有効値 (ds0, ds1) を取得
+
+        Args:
+            rrd_paths: {キー: RRDファイルパス}
+            cf: 対象RRA（AVERAGE / MAX）
+            rows: 有効値を探す最新行数
+        """
+        results = {}
+        for key, rrd_path in rrd_paths.items():
+            try:
+                _, values = self._open(rrd_path).latest(cf, rows)
+            except (OSError, ValueError, KeyError) as e:
+                logger.debug(f"RRD mmap読み出し失敗 ({rrd_path}): {e}")
+                continue
+            latest = []
+            for ds in range(values.shape[1]):
+                column = values[:, ds]
+                valid = column[~np.isnan(column)]
+                latest.append(float(valid[-1]) if valid.size else None)
+            results[key] = tuple(latest[:2])
+        return results
+
+    def read_history(self, rrd_paths: Dict[Hashable, str],
+                     cf: str = 'AVERAGE') -> Tuple[List[Hashable], "np.ndarray", "np.ndarray"]:
+        """全リンクの1日分の履歴を (links, rows, ds) 配列で取得
+
+        Returns:
+            (keys, timestamps, values) - timestamps は最初に読めたリンクのもの
+        """
+        keys, arrays, timestamps = [], [], None
+        for key, rrd_path in rrd_paths.items():
+            try:
+                ts, values = self._open(rrd_path).history(cf)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"RRD履歴読み出し失敗 ({rrd_path}): {e}")
+                continue
+            if timestamps is None:
+                timestamps = ts
+            keys.append(key)
+            arrays.append(values)
+        if not arrays:
+            return [], np.empty(0, dtype=np.int64), np.empty((0, 0, 2))
+        return keys, timestamps, np.stack(arrays)
+
+    def close(self):
+        """全マップを解除"""
+        for rrd_file in self._files.values():
+            rrd_file.close()
+        self._files.clear()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+SNMP Traffic Collector: MRTG cron を置き換えるトラフィック収集デーモン
+全ルーターの ifHCInOctets / ifHCOutOctets を GETBULK で並行取得し、
+カウンタ差分（Counter64の折り返し対応）からリンクごとの転送レートを算出する
+
+監視対象（リンク → ルーター/ifIndex）は mrtg_kurage.conf の Target 行から読み込む
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Dict, Tuple, Optional
+
+try:
+    from easysnmp import Session
+except ImportError:
+    Session = None
+
+# ログ設定
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# IF-MIB::ifHCInOctets / ifHCOutOctets
+IF_HC_IN_OCTETS = '.1.3.6.1.2.1.31.1.1.1.6'
+IF_HC_OUT_OCTETS = '.1.3.6.1.2.1.31.1.1.1.10'
+COUNTER64_MODULO = 2 ** 64
+
+# 最短ポーリング間隔（秒）
+MIN_INTERVAL = 1.0
+
+# Target[r1-r2]: 3:public@[fd02:1::2]:::::2
+TARGET_PATTERN = re.compile(r'^Target\[r(\d+)-r(\d+)\]:\s*(\d+):([^@]+)@\[([^\]]+)\]')
+
+
+@dataclass
+class LinkTarget:
+    """監視対象リンク（rrdファイルと同じく番号の小さい側のルーターで計測）"""
+    link: Tuple[int, int]
+    host: str
+    if_index: int
+    community: str
+
+
+def load_mrtg_targets(conf_path: str) -> List[LinkTarget]:
+    """MRTG設定ファイルの Target 行から監視対象を読み込む"""
+    targets = []
+    with open(conf_path, encoding='utf-8') as f:
+        for line in f:
+            match = TARGET_PATTERN.match(line.strip())
+            if match:
+                u, v, if_index, community, host = match.groups()
+                targets.append(LinkTarget((int(u), int(v)), host, int(if_index), community))
+    return targets
+
+
+class SNMPTrafficCollector:
+    """SNMP GETBULK によるリンクトラフィック収集クラス
+
+    rates: {(u, v): (in_Bps, out_Bps)} - RRDのds0(in)/ds1(out)と同じ向き
+    """
+
+    def __init__(self, targets: List[LinkTarget], interval: float = 1.0,
+                 timeout: float = 1.0, retries: int = 0, max_rate: float = 125_000_000):
+        if Session is None:
+            raise ImportError("SNMPTrafficCollector には easysnmp が必要です")
+        self.interval = max(MIN_INTERVAL, interval)
+        self.timeout = timeout
+        self.retries = retries
+        # create_rrd.sh のDS上限（1Gbps）を超える値はカウンタリセットとみなして破棄
+        self.max_rate = max_rate
+
+        # ルーターごとに監視インターフェースをまとめる
+        self.routers: Dict[Tuple[str, str], Dict[int, Tuple[int, int]]] = {}
+        for target in targets:
+            self.routers.setdefault((target.host, target.community), {})[target.if_index] = target.link
+
+        self._sessions: Dict[Tuple[str, str], "Session"] = {}
+        self._previous: Dict[Tuple[str, int], Tuple[int, int, float]] = {}
+        self._rates: Dict[Tuple[int, int], Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.routers)))
+
+        self.generation = 0  # ポーリング完了ごとに増加（新しいサンプルの検出用）
+        self.poll_errors = 0
+        self.last_poll_time = None
+
+    def _session(self, host: str, community: str) -> "Session":
+        """ルーターごとのSNMPセッション（スレッド間で共有しない）"""
+        key = (host, community)
+        if key not in self._sessions:
+            self._sessions[key] = Session(
+                hostname=f"udp6:[{host}]" if ':' in host else host,
+                community=community,
+                version=2,
+                timeout=self.timeout,
+                retries=self.retries,
+                use_numeric=True
+            )
+        return self._sessions[key]
+
+    def _poll_router(self, host: str, community: str) -> Tuple[str, Dict[int, Tuple[int, int]], float]:
+        """1ルーターの in/out カウンタを GETBULK 1回で取得"""
+        if_indexes = self.routers[(host, community)]
+        session = self._session(host, community)
+        variables = session.get_bulk([IF_HC_IN_OCTETS, IF_HC_OUT_OCTETS],
+                                     non_repeaters=0, max_repetitions=max(if_indexes))
+        sampled_at = time.monotonic()
+
+        in_octets, out_octets = {}, {}
+        for var in variables:
+            oid = f"{var.oid}.{var.oid_index}" if var.oid_index else var.oid
+            column, _, index = oid.rpartition('.')
+            if not index.isdigit() or int(index) not in if_indexes:
+                continue
+            if column == IF_HC_IN_OCTETS:
+                in_octets[int(index)] = int(var.value)
+            elif column == IF_HC_OUT_OCTETS:
+                out_octets[int(index)] = int(var.value)
+
+        counters = {idx: (in_octets[idx], out_octets[idx]) for idx in in_octets if idx in out_octets}
+        return host, counters, sampled_at
+
+    def _rate(self, current: int, previous: int, elapsed: float) -> Optional[float]:
+        """カウンタ差分からレート（Bytes/s）を算出（64bit折り返し対応）"""
+        delta = (current - previous) % COUNTER64_MODULO
+        rate = delta / elapsed
+        return rate if rate <= self.max_rate else None
+
+    def poll_once(self) -> int:
+        """全ルーターを並行にポーリングしてレートを更新
+
+        Returns:
+            レートを更新したリンク数
+        """
+        futures = {key: self._executor.submit(self._poll_router, *key) for key in self.routers}
+        updated = {}
+        for (host, community), future in futures.items():
+            try:
+                _, counters, sampled_at = future.result()
+            except Exception as e:
+                self.poll_errors += 1
+                logger.warning(f"SNMP取得失敗 ({host}): {e}")
+                # セッションを作り直して次回再試行
+                self._sessions.pop((host, community), None)
+                continue
+
+            for if_index, link in self.routers[(host, community)].items():
+                if if_index not in counters:
+                    continue
+                in_octets, out_octets = counters[if_index]
+                previous = self._previous.get((host, if_index))
+                self._previous[(host, if_index)] = (in_octets, out_octets, sampled_at)
+                if previous is None or sampled_at <= previous[2]:
+                    continue
+                elapsed = sampled_at - previous[2]
+                in_rate = self._rate(in_octets, previous[0], elapsed)
+                out_rate = self._rate(out_octets, previous[1], elapsed)
+                if in_rate is None or out_rate is None:
+                    logger.debug(f"r{link[0]}-r{link[1]}: カウンタリセットの可能性があるため破棄")
+                    continue
+                updated[link] = (in_rate, out_rate)
+
+        if updated:
+            with self._lock:
+                self._rates.update(updated)
+                self.generation += 1
+                self.last_poll_time = time.time()
+        return len(updated)
+
+    def latest_rates(self) -> Dict[Tuple[int, int], Tuple[float, float]]:
+        """最新のリンクレート {(u, v): (in_Bps, out_Bps)}"""
+        with self._lock:
+            return dict(self._rates)
+
+    def _run(self, on_update=None):
+        """ポーリングループ（処理時間を差し引いて一定間隔を維持）"""
+        next_time = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                if self.poll_once() and on_update:
+                    on_update(self)
+            except Exception as e:
+                logger.error(f"SNMPポーリングエラー: {e}")
+            next_time += self.interval
+            wait = next_time - time.monotonic()
+            if wait < 0:
+                # 処理が間隔を超えた場合は遅れを引きずらない
+                next_time = time.monotonic()
+                wait = 0
+            self._stop_event.wait(wait)
+
+    def start(self, on_update=None):
+        """バックグラウンドスレッドでポーリング開始"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(on_update,), daemon=True)
+        self._thread.start()
+        logger.info(f"SNMP収集開始: {len(self.routers)}ルーター / "
+                    f"{sum(len(v) for v in self.routers.values())}リンク (間隔: {self.interval}秒)")
+
+    def stop(self):
+        """ポーリング停止"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + self.timeout * (self.retries + 1))
+            self._thread = None
+        self._executor.shutdown(wait=False)
+
+    def publish(self, output_path: str, archive_path: Optional[str] = None):
+        """最新レートをJSONファイルへ書き出す（一時ファイル経由でアトミックに置換）
+
+        archive_path を指定した場合は同じスナップショットを1行ずつ追記する（リプレイ用アーカイブ）
+        """
+        with self._lock:
+            snapshot = {
+                "timestamp": self.last_poll_time,
+                "interval": self.interval,
+                "links": {f"r{u}-r{v}": [rate[0], rate[1]] for (u, v), rate in sorted(self._rates.items())}
+            }
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, output_path)
+        if archive_path:
+            with open(archive_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(snapshot) + "\n")
+
+
+def main():
+    """メイン関数（デーモンとして起動し、レートをJSONへ公開）"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="SNMP GETBULK トラフィック収集デーモン")
+    parser.add_argument("--mrtg-config", type=str, default="/opt/app/mrtg/mrtg_kurage.conf",
+                        help="監視対象を読み込むMRTG設定ファイル")
+    parser.add_argument("--interval", type=float, default=1.0, help=f"ポーリング間隔（秒、最小{MIN_INTERVAL}）")
+    parser.add_argument("--timeout", type=float, default=1.0, help="SNMPタイムアウト（秒）")
+    parser.add_argument("--output", type=str, default="/opt/app/mrtg/mrtg_file/link_rates.json",
+                        help="レートの公開先JSONファイル")
+    parser.add_argument("--archive", type=str, default=None,
+                        help="スナップショットを追記するテレメトリアーカイブ（JSONL、phase3 の --mode replay で再生可能）")
+
+    args = parser.parse_args()
+
+    collector = None
+    try:
+        targets = load_mrtg_targets(args.mrtg_config)
+        logger.info(f"監視対象: {len(targets)}リンク ({args.mrtg_config})")
+        collector = SNMPTrafficCollector(targets, interval=args.interval, timeout=args.timeout)
+        collector.start(on_update=lambda c: c.publish(args.output, args.archive))
+
+        while True:
+            time.sleep(60)
+            logger.info(f"SNMP収集中: 世代 {collector.generation}, 取得エラー {collector.poll_errors}回")
+    except KeyboardInterrupt:
+        logger.info("SNMP収集を停止します")
+        if collector:
+            collector.stop()
+    except Exception as e:
+        logger.error(f"実行エラー: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+SSH Connection Pool: r1/r16 への SSH セッションを使い回す接続プール
+ホストごとに paramiko の SSHClient を1つ保持し、トランスポートの keepalive で
+セッションを維持する。サイクルごとの TCP 接続・鍵交換・パスワード認証を省く
+
+- 取り出し時にトランスポートの生存を確認し、切れていれば透過的に再接続する
+- 一定時間使っていない接続はセッションチャネルを開いて応答を確認する（ヘルスチェック）
+- exec_command でチャネルを開けなかった場合は同じ SSHClient のまま再接続して1回だけ再試行する
+  （コマンド送信前の失敗のみ再試行するため、同じコマンドが2回実行されることはない）
+"""
+
+import time
+import socket
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+# トランスポートの keepalive 間隔（秒）
+DEFAULT_KEEPALIVE = 15
+# この時間以上使っていない接続は取り出し時にヘルスチェックする（秒）
+DEFAULT_HEALTH_CHECK_INTERVAL = 30.0
+
+# 接続が使えなくなったことを示す例外（再接続の対象）
+TRANSPORT_ERRORS = (paramiko.SSHException, EOFError, socket.error)
+
+
+@dataclass
+class PooledConnection:
+    """プール内の接続"""
+    client: paramiko.SSHClient
+    connected_at: float
+    last_used: float
+    uses: int = 0
+
+
+class SSHConnectionPool:
+    """ホストごとに SSH 接続を保持する接続プール
+
+    Args:
+        port / username / password / timeout: paramiko.SSHClient.connect の引数（全ホスト共通）
+        keepalive: トランスポートの keepalive 間隔（秒、0 で無効）
+        health_check_interval: 取り出し時にヘルスチェックする未使用時間（秒）
+    """
+
+    def __init__(self, port: int = 22, username: str = "root", password: Optional[str] = None,
+                 timeout: float = 15, keepalive: int = DEFAULT_KEEPALIVE,
+                 health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL):
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.health_check_interval = health_check_interval
+
+        self._connections: Dict[str, PooledConnection] = {}
+        self._connect_counts: Dict[str, int] = {}  # ホストごとの接続成功回数（初回接続を含む）
+        self._host_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'connects': 0,
+            'reuses': 0,
+            'reconnects': 0,
+            'health_check_failures': 0,
+            'retried_commands': 0,
+        }
+
+    def _host_lock(self, host: str) -> threading.Lock:
+        with self._lock:
+            return self._host_locks.setdefault(host, threading.Lock())
+
+    def _connect(self, client: paramiko.SSHClient, host: str):
+        """SSHClient を接続し keepalive を設定"""
+        logger.debug(f"SSH接続開始: {host}")
+        client.connect(
+            hostname=host,
+            port=self.port,
+            username=self.username,
+            password=self.password,
+            timeout=self.timeout
+        )
+        transport = client.get_transport()
+        if self.keepalive and transport is not None:
+            transport.set_keepalive(self.keepalive)
+        self._connect_counts[host] = self._connect_counts.get(host, 0) + 1
+        logger.debug(f"SSH接続成功: {host}")
+
+    def _is_healthy(self, entry: PooledConnection, now: float) -> bool:
+        """接続が使えるかを確認（未使用時間が長い場合はセッションチャネルを開いて確認）"""
+        transport = entry.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        if now - entry.last_used < self.health_check_interval:
+            return True
+        try:
+            channel = transport.open_session(timeout=self.timeout)
+            channel.close()
+            return True
+        except Exception as e:
+            logger.debug(f"SSHヘルスチェック失敗: {e}")
+            return False
+
+    def acquire(self, host: str) -> paramiko.SSHClient:
+        """ホストへの接続を取り出す（無ければ接続、切れていれば再接続）"""
+        with self._host_lock(host):
+            now = time.monotonic()
+            entry = self._connections.get(host)
+            if entry is not None:
+                if self._is_healthy(entry, now):
+                    entry.last_used = now
+                    entry.uses += 1
+                    self.stats['reuses'] += 1
+                    return entry.client
+                self.stats['health_check_failures'] += 1
+                logger.warning(f"SSH接続が切れているため再接続します: {host}")
+                entry.client.close()
+                self._connect(entry.client, host)
+                entry.connected_at = entry.last_used = time.monotonic()
+                entry.uses += 1
+                self.stats['reconnects'] += 1
+                return entry.client
+
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            self._connect(client, host)
+            self._connections[host] = PooledConnection(client, now, now, uses=1)
+            self.stats['connects'] += 1
+            return client
+
+    def _host_of(self, client: paramiko.SSHClient) -> Optional[str]:
+        for host, entry in self._connections.items():
+            if entry.client is client:
+                return host
+        return None
+
+    def reconnect(self, client: paramiko.SSHClient):
+        """プールの接続を同じ SSHClient のまま張り直す（保持している参照はそのまま使える）"""
+        host = self._host_of(client)
+        if host is None:
+            raise ValueError("プール管理外の SSHClient です")
+        with self._host_lock(host):
+            entry = self._connections[host]
+            entry.client.close()
+            self._connect(entry.client, host)
+            entry.connected_at = entry.last_used = time.monotonic()
+            self.stats['reconnects'] += 1
+            logger.info(f"SSH再接続: {host}")
+
+    def reconnect_count(self, host: str) -> int:
+        """ホストへ接続し直した回数（初回接続は含まない。破棄後の新規接続は含む）"""
+        return max(self._connect_counts.get(host, 0) - 1, 0)
+
+    def discard(self, host: str):
+        """ホストの接続を閉じてプールから外す（次回の取り出しで新規接続）"""
+        with self._host_lock(host):
+            entry = self._connections.pop(host, None)
+            if entry is not None:
+                entry.client.close()
+
+    @contextmanager
+    def connection(self, host: str):
+        """接続のコンテキストマネージャー（終了時に閉じずプールへ戻す）
+
+        ブロック内で接続断を示す例外が出た場合はその接続を破棄する
+        """
+        client = self.acquire(host)
+        try:
+            yield client
+        except TRANSPORT_ERRORS:
+            self.discard(host)
+            raise
+        finally:
+            entry = self._connections.get(host)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+
+    def exec_command(self, client: paramiko.SSHClient, command: str, timeout: Optional[float] = None):
+        """client.exec_command と同じ (stdin, stdout, stderr) を返す
+
+        チャネルを開けなかった場合（コマンド送信前）は再接続して1回だけ再試行する
+        """
+        try:
+            return client.exec_command(command, timeout=timeout)
+        except TRANSPORT_ERRORS as e:
+            if self._host_of(client) is None:
+                raise
+            logger.warning(f"SSHチャネル確立失敗のため再接続して再試行します: {e}")
+            self.reconnect(client)
+            self.stats['retried_commands'] += 1
+            return client.exec_command(command, timeout=timeout)
+
+    def close_all(self):
+        """全接続を閉じる"""
+        with self._lock:
+            connections, self._connections = self._connections, {}
+        for host, entry in connections.items():
+            entry.client.close()
+            logger.debug(f"SSH接続終了: {host} (使用回数: {entry.uses})")
+
+    def __len__(self):
+        return len(self._connections)
+
+
+_shared_pool: Optional[SSHConnectionPool] = None
+_shared_lock = threading.Lock()
+
+
+def shared_pool(**kwargs) -> SSHConnectionPool:
+    """プロセス内で共有する接続プール（最初の呼び出しの引数で作成し、終了時に全接続を閉じる）"""
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            _shared_pool = SSHConnectionPool(**kwargs)
+            atexit.register(_shared_pool.close_all)
+        return _shared_pool
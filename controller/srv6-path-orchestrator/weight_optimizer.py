@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Weight Optimizer: Fortz–Thorup 型の局所探索によるリンク重みの最適化
+観測トラフィックと優先度クラスの需要から、phase3 の経路選択（重み倍率方式）で選ばれる
+経路に需要を載せたときの最大リンク利用率が最小になる整数リンク重みを探索する
+
+評価は (最大リンク利用率, Fortz–Thorup のコスト Φ) の辞書式順序。近傍は1リンクの重みを
+1..max_weight の任意の値に変える操作で、改善しなくなったら一部の重みをランダムに変えて探索を続ける。
+
+使い方:
+    バックグラウンド: BackgroundWeightOptimizer（別プロセスで実行し、制御ループは結果を取りに行くだけ）
+    オフライン: python3 weight_optimizer.py <archive_dir> --demand 600 300 100 --output tuned_weights.json
+"""
+
+import os
+import json
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple, Optional, Sequence
+
+import numpy as np
+
+from compiled_topology import CompiledTopology
+
+logger = logging.getLogger(__name__)
+
+# Fortz–Thorup の区分線形コスト（利用率の区切りと各区間の傾き）
+PHI_BREAKPOINTS = np.array([0.0, 1 / 3, 2 / 3, 9 / 10, 1.0, 11 / 10])
+PHI_SLOPES = np.array([1.0, 3.0, 10.0, 70.0, 500.0, 5000.0])
+
+# 同コスト経路が生じないように整数重みへ加える固定の微小値（経路計算エンジンによる同コスト経路の選び方の違いを避ける）
+TIEBREAK_SCALE = 1e-4
+
+
+def fortz_thorup_phi(utilization: np.ndarray) -> np.ndarray:
+    """リンクごとの Fortz–Thorup の区分線形凸コスト φ(利用率)（帯域で正規化した値）"""
+    excess = np.clip(utilization[..., None] - PHI_BREAKPOINTS, 0.0, None)
+    return (excess * np.diff(PHI_SLOPES, prepend=0.0)).sum(axis=-1)
+
+
+def fortz_thorup_cost(utilization: np.ndarray) -> float:
+    """リンク利用率ベクトルに対する Fortz–Thorup のコスト Φ（全リンクの φ の合計）"""
+    return float(fortz_thorup_phi(utilization).sum())
+
+
+@dataclass
+class WeightProblem:
+    """最適化の入力（ワーカープロセスへ渡すため pickle 可能な値のみ）
+
+    observed: エッジ順の観測レート（Bytes/s、データなしは 0）
+    current_weights: 観測時に経路計算に使っていた重み。指定時は、その重みで選ばれる経路に載っている
+                     自クラスの需要を observed から差し引いたものを背景トラフィックとする
+    """
+    edges: List[Tuple[int, int]]
+    capacities: List[float]
+    observed: List[float]
+    demands: List[float]
+    pairs: List[Tuple[int, int]]
+    directed: bool = False
+    multipliers: List[float] = field(default_factory=lambda: [3.0, 2.0, 1.0])
+    current_weights: Optional[List[float]] = None
+    initial: Optional[List[int]] = None
+    max_weight: int = 20
+    iterations: int = 200
+    patience: int = 20
+    time_limit: Optional[float] = None
+    seed: int = 0
+
+
+@dataclass
+class WeightResult:
+    """最適化の結果"""
+    weights: np.ndarray              # 経路計算に使う重み（整数重み + 同コスト回避の微小値）
+    integer_weights: np.ndarray
+    max_utilization: float
+    phi: float
+    initial_max_utilization: float
+    evaluations: int
+    elapsed: float
+
+
+class RoutingModel:
+    """重みベクトルに対する経路選択（phase3 の重み倍率方式と同じ）と需要の配置"""
+
+    def __init__(self, problem: WeightProblem):
+        nodes = list(dict.fromkeys(n for edge in problem.edges for n in edge))
+        self.topology = CompiledTopology(nodes, problem.edges, directed=problem.directed)
+        self.capacities = np.array(problem.capacities, dtype=np.float64)
+        self.demands = list(problem.demands)
+        self.pairs = [tuple(pair) for pair in problem.pairs]
+        self.multipliers = list(problem.multipliers)
+        self.background = np.zeros(len(problem.edges))
+
+    def route(self, weights: np.ndarray) -> np.ndarray:
+        """各送受信ペアのクラスを順に最短経路へ載せたときのエッジ負荷（Bytes/s）"""
+        load = np.zeros(len(self.capacities))
+        for src, dst in self.pairs:
+            w = np.array(weights, dtype=np.float64)
+            for i, demand in enumerate(self.demands):
+                result = self.topology.shortest_path(src, dst, w)
+                if result is None:
+                    break
+                edge_ids = result[2]
+                load[edge_ids] += demand
+                if i < len(self.multipliers):
+                    w[edge_ids] *= self.multipliers[i]
+        return load
+
+    def evaluate(self, weights: np.ndarray) -> Tuple[float, float, np.ndarray]:
+        """(最大リンク利用率, Φ, 利用率ベクトル)"""
+        utilization = (self.background + self.route(weights)) / self.capacities
+        return float(utilization.max()), fortz_thorup_cost(utilization), utilization
+
+
+def _score(max_utilization: float, phi: float) -> Tuple[float, float]:
+    """比較用のキー（最大利用率の浮動小数点誤差で Φ の比較が無視されないよう丸める）"""
+    return round(max_utilization, 9), phi
+
+
+def optimize_weights(problem: WeightProblem) -> WeightResult:
+    """局所探索でリンク重みを最適化"""
+    start_time = time.perf_counter()
+    rng = np.random.default_rng(problem.seed)
+    model = RoutingModel(problem)
+    num_edges = len(problem.edges)
+    tiebreak = rng.uniform(0.0, TIEBREAK_SCALE, num_edges)
+
+    observed = np.nan_to_num(np.array(problem.observed, dtype=np.float64))
+    if problem.current_weights is not None:
+        observed = observed - model.route(np.array(problem.current_weights, dtype=np.float64))
+    model.background = np.clip(observed, 0.0, None)
+
+    if problem.initial is not None:
+        current = np.clip(np.rint(problem.initial), 1, problem.max_weight).astype(np.int64)
+    else:
+        # InvCap（帯域の逆数に比例、全リンク同帯域ならホップ数）
+        current = np.clip(np.rint(model.capacities.max() / model.capacities), 1, problem.max_weight).astype(np.int64)
+
+    max_util, phi, utilization = model.evaluate(current + tiebreak)
+    evaluations = 1
+    initial_max_util = max_util
+    best, best_score, best_phi, best_max_util = current.copy(), _score(max_util, phi), phi, max_util
+    current_score = best_score
+    candidates = np.arange(1, problem.max_weight + 1)
+    stale = 0
+
+    for _ in range(problem.iterations):
+        if problem.time_limit is not None and time.perf_counter() - start_time > problem.time_limit:
+            break
+        # 改善が続いている間は最も利用率の高いリンク、停滞したらランダムなリンクの重みを変える
+        if stale == 0:
+            hottest = np.flatnonzero(utilization >= utilization.max() - 1e-12)
+            edge = int(rng.choice(hottest))
+        else:
+            edge = int(rng.integers(num_edges))
+
+        move_score, move_value, move_result = current_score, None, None
+        for value in candidates:
+            if value == current[edge]:
+                continue
+            trial = current.copy()
+            trial[edge] = value
+            result = model.evaluate(trial + tiebreak)
+            evaluations += 1
+            if _score(result[0], result[1]) < move_score:
+                move_score, move_value, move_result = _score(result[0], result[1]), value, result
+        if move_value is not None:
+            current[edge] = move_value
+            current_score = move_score
+            max_util, phi, utilization = move_result
+            stale = 0
+            if current_score < best_score:
+                best, best_score, best_phi, best_max_util = current.copy(), current_score, phi, max_util
+        else:
+            stale += 1
+
+        # 停滞したら重みの一部をランダムに変えて別の領域を探索
+        if stale >= problem.patience:
+            changed = rng.random(num_edges) < 0.1
+            current[changed] = rng.integers(1, problem.max_weight + 1, int(changed.sum()))
+            max_util, phi, utilization = model.evaluate(current + tiebreak)
+            evaluations += 1
+            current_score = _score(max_util, phi)
+            stale = 0
+
+    return WeightResult(
+        weights=best + tiebreak,
+        integer_weights=best,
+        max_utilization=best_max_util,
+        phi=best_phi,
+        initial_max_utilization=initial_max_util,
+        evaluations=evaluations,
+        elapsed=time.perf_counter() - start_time
+    )
+
+
+class BackgroundWeightOptimizer:
+    """別プロセスで optimize_weights を実行（制御ループは submit と poll だけで待たない）
+
+    実行中の最適化がある間は新しい問題を受け付けない（次のサイクルで最新の観測値を渡し直す）。
+    blocking=True の場合は poll で結果を待つ（リプレイなど結果を決定的にしたい場合）。
+    ワーカーは forkserver（無い環境では spawn）で起動する。制御プロセスは paramiko の keepalive スレッドや
+    SSH・rrdcached のソケットを持つため fork しない（問題と結果は pickle 可能な値のみ）。
+    """
+
+    def __init__(self, blocking: bool = False):
+        self.blocking = blocking
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context(start_method))
+        self._future: Optional[Future] = None
+        self.submitted = 0
+        self.completed = 0
+        self.failures = 0
+
+    @property
+    def busy(self) -> bool:
+        return self._future is not None and not self._future.done()
+
+    def submit(self, problem: WeightProblem) -> bool:
+        """最適化を開始（実行中なら何もせず False）"""
+        if self._future is not None:
+            return False
+        self._future = self._executor.submit(optimize_weights, problem)
+        self.submitted += 1
+        return True
+
+    def poll(self) -> Optional[WeightResult]:
+        """完了した結果を取り出す（未完了・未投入なら None）"""
+        if self._future is None or not (self.blocking or self._future.done()):
+            return None
+        future, self._future = self._future, None
+        try:
+            result = future.result()
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"リンク重み最適化エラー: {e}")
+            return None
+        self.completed += 1
+        return result
+
+    def close(self):
+        """ワーカープロセスを停止"""
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def save_weights(path: str, edges: Sequence[Tuple[int, int]], result: WeightResult):
+    """最適化した重みをJSONで保存（phase3 の --tuned-weights で読み込める形式）"""
+    data = {
+        "edges": [list(edge) for edge in edges],
+        "weights": [float(w) for w in result.weights],
+        "integer_weights": [int(w) for w in result.integer_weights],
+        "max_utilization": result.max_utilization,
+        "phi": result.phi,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_weights(path: str) -> Dict[Tuple[int, int], float]:
+    """保存した重みを {(u, v): 重み} で読み込む"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return {tuple(edge): weight for edge, weight in zip(data["edges"], data["weights"])}
+
+
+def main():
+    """サイクルアーカイブの観測トラフィックに対してオフラインで最適化"""
+    import argparse
+    from cycle_archive import load_cycle_archive, decode_paths
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Fortz–Thorup 型局所探索によるリンク重み最適化（オフライン）")
+    parser.add_argument("archive", help="phase3 のサイクルアーカイブディレクトリ")
+    parser.add_argument("--demand", type=float, nargs="+", required=True,
+                        help="クラスごとの需要（Mbps、高・中・低優先度の順）")
+    parser.add_argument("--percentile", type=float, default=95.0, help="背景トラフィックとして使う観測値のパーセンタイル")
+    parser.add_argument("--capacity", type=float, default=125_000_000, help="リンク帯域（Bytes/s）")
+    parser.add_argument("--src", type=int, default=1, help="送信元ノード")
+    parser.add_argument("--dst", type=int, default=16, help="宛先ノード")
+    parser.add_argument("--iterations", type=int, default=500, help="局所探索の反復回数")
+    parser.add_argument("--max-weight", type=int, default=20, help="重みの上限（1..max）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    parser.add_argument("--output", type=str, default="tuned_weights.json", help="出力先JSON")
+    args = parser.parse_args()
+
+    meta, data = load_cycle_archive(args.archive, columns=["rate", "path"])
+    edges = meta["edges"]
+    if len(data["rate"]) == 0:
+        parser.error(f"アーカイブが空です: {args.archive}")
+    directed = any((v, u) in set(edges) for u, v in edges)
+    edge_index = {}
+    for e, (u, v) in enumerate(edges):
+        edge_index[(u, v)] = e
+        if not directed:
+            edge_index[(v, u)] = e
+
+    # 行ごとに、アーカイブされた選択経路に載っていた自クラスの需要を差し引いて背景トラフィックとする
+    demands = [mbps * 125_000 for mbps in args.demand]
+    own = np.zeros(data["rate"].shape)
+    for row, paths in enumerate(decode_paths(data["path"])):
+        for demand, path in zip(demands, paths):
+            own[row, [edge_index[hop] for hop in zip(path, path[1:]) if hop in edge_index]] += demand
+    background = np.nanpercentile(np.clip(data["rate"] - own, 0.0, None), args.percentile, axis=0)
+
+    problem = WeightProblem(
+        edges=edges,
+        capacities=[args.capacity] * len(edges),
+        observed=np.nan_to_num(background).tolist(),
+        demands=demands,
+        pairs=[(args.src, args.dst)] + ([(args.dst, args.src)] if directed else []),
+        directed=directed,
+        max_weight=args.max_weight,
+        iterations=args.iterations,
+        seed=args.seed
+    )
+    result = optimize_weights(problem)
+    save_weights(args.output, edges, result)
+    logger.info(f"最大リンク利用率: {result.initial_max_utilization:.4f} → {result.max_utilization:.4f} "
+                f"(Φ={result.phi:.4f}, 評価 {result.evaluations}回, {result.elapsed:.1f}秒)")
+    logger.info(f"重みを保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()